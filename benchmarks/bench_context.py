@@ -0,0 +1,75 @@
+"""
+Benchmark assembling the build context and runner folder.
+Compares the old approach (copy into a temp dir and tar it every time)
+against the hardlinked runner and cached context tarball.
+
+Usage: python benchmarks/bench_context.py [--size-mb N] [--runs N]
+"""
+import argparse
+import io
+import os
+import shutil
+import tarfile
+import tempfile
+import time
+from dockenv import context
+
+
+def time_it(func, runs):
+    """
+    Run a function 'runs' times, returning the average time in milliseconds
+    """
+    start = time.perf_counter()
+    for _ in range(runs):
+        func()
+    return (time.perf_counter() - start) * 1000 / runs
+
+
+def main():
+    """
+    Main entry function
+    """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--size-mb", type=int, default=64,
+                        help="size of the input file to put in the context")
+    parser.add_argument("--runs", type=int, default=10)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        input_path = os.path.join(work_dir, "input.whl")
+        with open(input_path, "wb") as finput:
+            finput.write(os.urandom(args.size_mb * 1024 * 1024))
+        files = {"Dockerfile": b"FROM python:3", "input.whl": input_path}
+        cache_folder = os.path.join(work_dir, "cache")
+
+        def old_context():
+            with tempfile.TemporaryDirectory(dir=work_dir) as build_dir:
+                shutil.copy(input_path, build_dir)
+                with tarfile.open(fileobj=io.BytesIO(), mode="w") as tar:
+                    tar.add(build_dir, arcname=".")
+
+        def new_context():
+            context.get_context_tar(files, cache_folder=cache_folder)
+
+        def old_runner():
+            with tempfile.TemporaryDirectory(dir=work_dir) as runner_dir:
+                shutil.copy(input_path, runner_dir)
+
+        def new_runner():
+            with tempfile.TemporaryDirectory(dir=work_dir) as runner_dir:
+                context.link_or_copy(input_path,
+                                     os.path.join(runner_dir, "input.whl"))
+
+        cold = time_it(new_context, 1)
+        tar_size = os.path.getsize(context.get_context_tar(files, cache_folder))
+        print(f"input size:            {args.size_mb} MB")
+        print(f"context tar size:      {tar_size / 1024 / 1024:.1f} MB")
+        print(f"copy + tar context:    {time_it(old_context, args.runs):.2f} ms")
+        print(f"cached context (cold): {cold:.2f} ms")
+        print(f"cached context (warm): {time_it(new_context, args.runs):.2f} ms")
+        print(f"copy runner:           {time_it(old_runner, args.runs):.2f} ms")
+        print(f"hardlink runner:       {time_it(new_runner, args.runs):.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""
+Benchmark read throughput of a '--mount' folder inside an env,
+comparing a bind mount against a '--cache-mount' named volume.
+Needs Docker and an existing env.
+
+Usage: python benchmarks/bench_mount.py ENVNAME [--size-mb N] [--files N]
+"""
+import argparse
+import os
+import subprocess
+import tempfile
+import time
+import docker
+from dockenv import volumes
+
+READ_SCRIPT = """
+import os, time
+start = time.perf_counter()
+total = 0
+for root, _, fnames in os.walk('/data'):
+    for fname in fnames:
+        with open(os.path.join(root, fname), 'rb') as fdata:
+            while True:
+                chunk = fdata.read(1024 * 1024)
+                if not chunk:
+                    break
+                total += len(chunk)
+print(total / 1024 / 1024 / (time.perf_counter() - start))
+"""
+
+
+def read_throughput(image_name, mount_cmd):
+    """
+    Read every file in a mount from inside a container
+
+    :returns: The read throughput in MB/s
+    """
+    output = subprocess.check_output([
+        "docker", "run", "--rm", "--read-only", "--network", "none", "-v",
+        mount_cmd, image_name, "python", "-c", READ_SCRIPT
+    ])
+    return float(output.strip())
+
+
+def main():
+    """
+    Main entry function
+    """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("envname", help="name of an existing virtualenv")
+    parser.add_argument("--size-mb", type=int, default=256,
+                        help="total size of the dataset")
+    parser.add_argument("--files", type=int, default=64,
+                        help="number of files in the dataset")
+    args = parser.parse_args()
+    image_name = f"dockenv-{args.envname}"
+    client = docker.from_env()
+
+    with tempfile.TemporaryDirectory() as data_dir:
+        file_size = args.size_mb * 1024 * 1024 // args.files
+        for i in range(args.files):
+            with open(os.path.join(data_dir, f"{i}.bin"), "wb") as fdata:
+                fdata.write(os.urandom(file_size))
+
+        start = time.perf_counter()
+        volume_name = volumes.sync_volume(client, image_name, data_dir)
+        cold_sync = time.perf_counter() - start
+        start = time.perf_counter()
+        volumes.sync_volume(client, image_name, data_dir)
+        warm_sync = time.perf_counter() - start
+
+        bind = read_throughput(image_name, f"{data_dir}:/data:ro")
+        volume = read_throughput(image_name, f"{volume_name}:/data:ro")
+        print(f"dataset:           {args.size_mb} MB in {args.files} files")
+        print(f"volume sync cold:  {cold_sync:.2f} s")
+        print(f"volume sync warm:  {warm_sync:.2f} s")
+        print(f"bind mount read:   {bind:.1f} MB/s")
+        print(f"volume read:       {volume:.1f} MB/s")
+        client.volumes.get(volume_name).remove(force=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""
+Compare a standard env image against a '--slim' one with the same packages.
+Rebuilds both from the packages in each existing env ('pip freeze'), then
+reports the image size, and the cold start time of a container that imports
+every top-level package. Needs Docker and existing envs.
+
+Usage: python benchmarks/bench_slim.py ENVNAME [ENVNAME ...] [--runs N]
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import tempfile
+import time
+import uuid
+from dockenv.api import Session, format_size
+
+# Imports each installed top-level package, skipping any that fail to import
+IMPORT_SCRIPT = """
+import importlib, pkgutil, site
+for module in pkgutil.iter_modules([site.getusersitepackages()]):
+    try:
+        importlib.import_module(module.name)
+    except Exception:
+        pass
+"""
+
+
+def cold_start(image_name, runs):
+    """
+    Time starting a new container that imports every package
+
+    :returns: The median time in milliseconds
+    """
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([
+            "docker", "run", "--rm", "--read-only", "--network", "none",
+            image_name, "python", "-c", IMPORT_SCRIPT
+        ],
+                       stdout=subprocess.DEVNULL,
+                       stderr=subprocess.DEVNULL,
+                       check=True)
+        times.append((time.perf_counter() - start) * 1000)
+    return statistics.median(times)
+
+
+def bench_env(session, envname, runs):
+    """
+    Build a standard and a slim copy of an env, and compare them
+
+    :returns: dict of variant name to (size in bytes, cold start in ms)
+    """
+    freeze = session.freeze(envname)
+    if not freeze.ok:
+        raise RuntimeError(freeze.error)
+
+    results = {}
+    with tempfile.TemporaryDirectory() as work_dir:
+        requirements = os.path.join(work_dir, "requirements.txt")
+        with open(requirements, "w") as frequirements:
+            frequirements.write("\n".join(freeze.packages) + "\n")
+
+        for variant, slim in [("standard", False), ("slim", True)]:
+            # Never clash with, and so delete, one of the user's own envs
+            bench_name = f"{envname}-bench-{variant}-{uuid.uuid4().hex[:8]}"
+            build = session.new(
+                bench_name,
+                requirements=requirements,
+                allow_nonbinary=True,
+                slim=slim)
+            if not build.ok:
+                raise RuntimeError(build.error)
+            try:
+                results[variant] = (build.size, cold_start(build.image, runs))
+            finally:
+                session.delete(bench_name)
+    return results
+
+
+def main():
+    """
+    Main entry function
+    """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("envnames", nargs="+", help="names of existing virtualenvs")
+    parser.add_argument("--runs", type=int, default=5,
+                        help="cold starts to time for each image")
+    args = parser.parse_args()
+
+    with Session() as session:
+        print(f"{'env':20} {'variant':10} {'size':>12} {'cold start':>12}")
+        for envname in args.envnames:
+            results = bench_env(session, envname, args.runs)
+            for variant, (size, start_ms) in results.items():
+                print(f"{envname:20} {variant:10} {format_size(size):>12} "
+                      f"{start_ms:9.0f} ms")
+            (std_size, std_ms), (slim_size, slim_ms) = results.values()
+            print(f"{envname:20} {'change':10} "
+                  f"{(slim_size - std_size) / std_size:+12.1%} "
+                  f"{(slim_ms - std_ms) / std_ms:+12.1%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,259 @@
+"""
+Benchmark suite, run against the in-process fake Docker daemon in fake_docker.py,
+so it needs neither Docker nor any envs.
+
+Measures:
+ - cli startup: 'dockenv list' as a new process
+ - image lookup time as the number of images grows
+ - export and import throughput, and peak Python memory used
+ - dockenv's own overhead for 'run' (with a 'docker' that exits straight away)
+   and for 'delete'
+
+Results are saved in '.benchmarks/results.json' with the current git commit,
+and compared against the last results from a different commit.
+
+Usage: python benchmarks/bench_suite.py [--quick] [--latency-ms N]
+                                        [--fail-on-regression]
+"""
+import argparse
+import datetime
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import docker
+
+ROOT_FOLDER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_FOLDER)
+# pylint: disable=wrong-import-position
+from benchmarks.fake_docker import FakeDocker, API_VERSION  # noqa: E402
+from dockenv.api import Session  # noqa: E402
+
+RESULTS_FILE = os.path.join(ROOT_FOLDER, ".benchmarks", "results.json")
+# Results that get bigger when things get better
+HIGHER_IS_BETTER = ["export_mb_s", "import_mb_s"]
+
+
+def time_median(func, runs):
+    """
+    Run a function 'runs' times
+
+    :returns: The median time in milliseconds
+    """
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        func()
+        times.append((time.perf_counter() - start) * 1000)
+    return statistics.median(times)
+
+
+def get_session(fake):
+    """
+    Get a Session talking to the fake daemon
+    """
+    return Session(docker.DockerClient(base_url=fake.url, version=API_VERSION))
+
+
+def bench_cli_startup(fake, runs):
+    """
+    Time 'dockenv list' as a new process, like a user would run it
+    """
+    env = dict(os.environ, DOCKER_HOST=fake.url, PYTHONPATH=ROOT_FOLDER)
+    cmd = [sys.executable, "-m", "dockenv", "--no-service", "list"]
+    return {
+        "cli_list_ms":
+        time_median(
+            lambda: subprocess.run(
+                cmd,
+                env=env,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+                check=True), runs)
+    }
+
+
+def bench_lookup(fake, counts, runs):
+    """
+    Time checking an env exists, as the number of images grows
+    """
+    results = {}
+    for count in counts:
+        fake.set_image_count(count)
+        session = get_session(fake)
+        # Listing images inspects every image, so big counts are slow
+        count_runs = min(runs, 3) if count >= 1000 else runs
+        results[f"lookup_{count}_ms"] = time_median(
+            lambda: session.image_exists(f"dockenv-env{count - 2}"),
+            count_runs)
+        cached = get_session(fake)
+        cached.cache_images = True
+        results[f"lookup_cached_{count}_ms"] = time_median(
+            lambda: cached.image_exists(f"dockenv-env{count - 2}"), runs)
+    fake.set_image_count(10)
+    return results
+
+
+def bench_export_import(fake, size_mb):
+    """
+    Time exporting and importing an env, and the peak memory used doing it
+    """
+    fake.export_size = size_mb * 1024 * 1024
+    fake.set_image_count(10)
+    session = get_session(fake)
+    results = {}
+    with tempfile.TemporaryDirectory() as work_dir:
+        filename = os.path.join(work_dir, "env.tar")
+        tracemalloc.start()
+        start = time.perf_counter()
+        assert session.export("env0", filename).ok
+        elapsed = time.perf_counter() - start
+        results["export_peak_mb"] = tracemalloc.get_traced_memory()[1] / 1024 / 1024
+        tracemalloc.stop()
+        results["export_mb_s"] = size_mb / elapsed
+
+        tracemalloc.start()
+        start = time.perf_counter()
+        assert session.import_env(filename).ok
+        elapsed = time.perf_counter() - start
+        results["import_peak_mb"] = tracemalloc.get_traced_memory()[1] / 1024 / 1024
+        tracemalloc.stop()
+        results["import_mb_s"] = size_mb / elapsed
+    return results
+
+
+def bench_run_delete(fake, runs):
+    """
+    Time dockenv's own overhead for 'run' and 'delete'.
+    'run' uses a fake 'docker' that exits straight away, so only
+    dockenv's work is timed, not a real container
+    """
+    results = {}
+    session = get_session(fake)
+    with tempfile.TemporaryDirectory() as work_dir:
+        script = os.path.join(work_dir, "script.py")
+        with open(script, "w") as fscript:
+            fscript.write("print('hello')\n")
+        if os.name != "nt":
+            fake_bin = os.path.join(work_dir, "bin")
+            os.mkdir(fake_bin)
+            fake_docker_cli = os.path.join(fake_bin, "docker")
+            with open(fake_docker_cli, "w") as fcli:
+                fcli.write("#!/bin/sh\nexit 0\n")
+            os.chmod(fake_docker_cli, 0o755)
+            old_path = os.environ["PATH"]
+            os.environ["PATH"] = fake_bin + os.pathsep + old_path
+            try:
+                results["run_overhead_ms"] = time_median(
+                    lambda: session.run("env0", script, capture_output=True),
+                    runs)
+            finally:
+                os.environ["PATH"] = old_path
+
+    def delete():
+        fake.set_image_count(10)
+        session.delete("env0")
+
+    results["delete_ms"] = time_median(delete, runs)
+    return results
+
+
+def get_commit():
+    """
+    Get the current git commit, or None if not in a git repo
+    """
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=ROOT_FOLDER,
+            universal_newlines=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(previous, results, threshold):
+    """
+    Print the results next to the previous results
+
+    :returns: list of names of results that got worse by more than 'threshold'
+    """
+    regressions = []
+    print(f"{'benchmark':28} {'previous':>12} {'current':>12} {'change':>8}")
+    for name, value in results.items():
+        old = (previous or {}).get("results", {}).get(name)
+        if not old:
+            print(f"{name:28} {'':>12} {value:12.3f}")
+            continue
+        change = (value - old) / old
+        worse = -change if name in HIGHER_IS_BETTER else change
+        flag = ""
+        if worse > threshold:
+            flag = " REGRESSION"
+            regressions.append(name)
+        print(f"{name:28} {old:12.3f} {value:12.3f} {change:+8.1%}{flag}")
+    return regressions
+
+
+def main():
+    """
+    Main entry function
+    """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--quick", action="store_true",
+                        help="fewer runs and smaller sizes")
+    parser.add_argument("--latency-ms", type=float, default=0.0,
+                        help="latency of every fake Docker request")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="how much worse a result can get, default 20%%")
+    parser.add_argument("--fail-on-regression", action="store_true")
+    parser.add_argument("--no-save", action="store_true",
+                        help="don't save the results")
+    args = parser.parse_args()
+
+    runs = 3 if args.quick else 10
+    counts = [10, 100, 1000] if args.quick else [10, 100, 1000, 10000]
+    size_mb = 16 if args.quick else 256
+
+    results = {}
+    with FakeDocker(latency=args.latency_ms / 1000) as fake:
+        results.update(bench_cli_startup(fake, runs))
+        results.update(bench_lookup(fake, counts, runs))
+        results.update(bench_export_import(fake, size_mb))
+        results.update(bench_run_delete(fake, runs))
+
+    history = []
+    if os.path.exists(RESULTS_FILE):
+        with open(RESULTS_FILE, "r") as fresults:
+            history = json.load(fresults)
+    commit = get_commit()
+    previous = None
+    for entry in reversed(history):
+        if entry["commit"] != commit and entry["quick"] == args.quick:
+            previous = entry
+            break
+    if previous:
+        print(f"Comparing against {previous['commit']} ({previous['date']})")
+    regressions = compare(previous, results, args.threshold)
+
+    if not args.no_save:
+        history.append({
+            "commit": commit,
+            "date": datetime.datetime.now().isoformat(timespec="seconds"),
+            "quick": args.quick,
+            "latency_ms": args.latency_ms,
+            "results": results,
+        })
+        os.makedirs(os.path.dirname(RESULTS_FILE), exist_ok=True)
+        with open(RESULTS_FILE, "w") as fresults:
+            json.dump(history, fresults, indent=2)
+
+    if regressions and args.fail_on_regression:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
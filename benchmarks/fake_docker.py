@@ -0,0 +1,309 @@
+"""
+A fake Docker daemon, run in-process, for benchmarking dockenv without Docker.
+
+Serves just enough of the Docker Engine API for the Docker SDK calls dockenv
+makes: listing, inspecting, building, saving, loading and removing images,
+and the container lifecycle. Every request waits 'latency' seconds first,
+and image count and export size can be changed between benchmarks.
+
+Usage:
+    with FakeDocker(image_count=1000) as fake:
+        client = docker.DockerClient(base_url=fake.url, version="1.41")
+"""
+import hashlib
+import json
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, unquote
+
+API_VERSION = "1.41"
+CHUNK_SIZE = 1024 * 1024
+
+
+def get_image_id(name):
+    """
+    Get a stable fake image ID for an image name
+    """
+    return "sha256:" + hashlib.sha256(name.encode()).hexdigest()
+
+
+class FakeDocker():
+    """
+    The fake daemon, listening on a random local port
+    """
+
+    def __init__(self, image_count=10, export_size=1024 * 1024, latency=0.0):
+        """
+        :param image_count: How many images to pretend exist
+        :param export_size: Size in bytes of every saved image
+        :param latency: Seconds to wait before answering each request
+        """
+        self.export_size = export_size
+        self.latency = latency
+        self.images = {}
+        self.containers = {}
+        self.lock = threading.Lock()
+        self.set_image_count(image_count)
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), _make_handler(self))
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        """
+        The URL to point a Docker client, or DOCKER_HOST, at
+        """
+        host, port = self._server.server_address
+        return f"tcp://{host}:{port}"
+
+    def set_image_count(self, image_count):
+        """
+        Replace the fake images with 'image_count' dockenv images
+        """
+        with self.lock:
+            self.images = {}
+            self.add_image("python:3")
+            for i in range(image_count - 1):
+                self.add_image(f"dockenv-env{i}:latest")
+
+    def add_image(self, tag):
+        """
+        Add, or re-tag, a fake image
+        """
+        image_id = get_image_id(tag)
+        self.images[image_id] = {
+            "Id": image_id,
+            "RepoTags": [tag],
+            "Created": int(time.time()),
+            "Size": self.export_size,
+            "Labels": {},
+            "Config": {
+                "Labels": {}
+            },
+            "RootFS": {
+                "Type": "layers",
+                "Layers": []
+            },
+        }
+        return image_id
+
+    def find_image(self, name):
+        """
+        Find a fake image by ID or tag
+        """
+        if name in self.images:
+            return self.images[name]
+        if ":" not in name:
+            name = f"{name}:latest"
+        for image in self.images.values():
+            if name in image["RepoTags"]:
+                return image
+        return None
+
+    def start(self):
+        """
+        Start serving in a background thread
+        """
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """
+        Stop serving
+        """
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+def _make_handler(fake):
+    """
+    Make the request handler class for a FakeDocker
+    """
+
+    class Handler(BaseHTTPRequestHandler):
+        """
+        Handles the Docker Engine API requests
+        """
+        protocol_version = "HTTP/1.1"
+        # Headers and body are written separately, don't let Nagle delay them
+        disable_nagle_algorithm = True
+
+        def log_message(self, *args):  # pylint: disable=arguments-differ
+            pass
+
+        def _path(self):
+            path = unquote(urlparse(self.path).path)
+            # Strip the API version, e.g. '/v1.41/images/json'
+            return re.sub(r"^/v[0-9.]+", "", path)
+
+        def _read_body(self):
+            """
+            Read, and throw away, the request body. Returns its size
+            """
+            size = 0
+            if self.headers.get("Transfer-Encoding") == "chunked":
+                while True:
+                    chunk_size = int(self.rfile.readline().strip(), 16)
+                    if chunk_size == 0:
+                        self.rfile.readline()
+                        break
+                    size += len(self.rfile.read(chunk_size))
+                    self.rfile.readline()
+                return size
+            remaining = int(self.headers.get("Content-Length") or 0)
+            while remaining > 0:
+                data = self.rfile.read(min(CHUNK_SIZE, remaining))
+                if not data:
+                    break
+                remaining -= len(data)
+                size += len(data)
+            return size
+
+        def _send_json(self, data, status=200):
+            body = json.dumps(data).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _send_stream(self, messages):
+            body = b"".join(json.dumps(msg).encode() + b"\r\n" for msg in messages)
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _send_bytes(self, size):
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-tar")
+            self.send_header("Content-Length", str(size))
+            self.end_headers()
+            chunk = b"\0" * CHUNK_SIZE
+            while size > 0:
+                self.wfile.write(chunk[:size])
+                size -= CHUNK_SIZE
+
+        def _not_found(self):
+            self._send_json({"message": "No such object"}, status=404)
+
+        def do_HEAD(self):  # pylint: disable=invalid-name
+            time.sleep(fake.latency)
+            self.send_response(200)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+
+        def do_GET(self):  # pylint: disable=invalid-name
+            time.sleep(fake.latency)
+            path = self._path()
+            if path == "/_ping":
+                self.send_response(200)
+                self.send_header("Content-Length", "2")
+                self.end_headers()
+                self.wfile.write(b"OK")
+            elif path == "/version":
+                self._send_json({"ApiVersion": API_VERSION, "Version": "20.10.0"})
+            elif path == "/images/json":
+                with fake.lock:
+                    self._send_json(list(fake.images.values()))
+            elif path.startswith("/images/") and path.endswith("/json"):
+                image = fake.find_image(path[len("/images/"):-len("/json")])
+                if image is None:
+                    return self._not_found()
+                self._send_json(image)
+            elif path.startswith("/images/") and path.endswith("/get"):
+                image = fake.find_image(path[len("/images/"):-len("/get")])
+                if image is None:
+                    return self._not_found()
+                self._send_bytes(fake.export_size)
+            elif path == "/containers/json":
+                with fake.lock:
+                    self._send_json(list(fake.containers.values()))
+            elif path.startswith("/containers/") and path.endswith("/json"):
+                container_id = path.split("/")[2]
+                if container_id not in fake.containers:
+                    return self._not_found()
+                self._send_json(fake.containers[container_id])
+            else:
+                self._not_found()
+            return None
+
+        def do_POST(self):  # pylint: disable=invalid-name
+            time.sleep(fake.latency)
+            path = self._path()
+            query = urlparse(self.path).query
+            if path == "/build":
+                self._read_body()
+                tag = re.search(r"(?:^|&)t=([^&]+)", query)
+                tag = unquote(tag.group(1)) if tag else "untagged"
+                with fake.lock:
+                    image_id = fake.add_image(
+                        tag if ":" in tag else f"{tag}:latest")
+                self._send_stream([{
+                    "stream": "Step 1/1 : FROM python:3\n"
+                }, {
+                    "aux": {
+                        "ID": image_id
+                    }
+                }, {
+                    "stream": f"Successfully built {image_id[7:19]}\n"
+                }])
+            elif path == "/images/load":
+                self._read_body()
+                tag = "dockenv-imported:latest"
+                with fake.lock:
+                    fake.add_image(tag)
+                self._send_stream([{"stream": f"Loaded image: {tag}\n"}])
+            elif path == "/containers/create":
+                self._read_body()
+                container_id = uuid.uuid4().hex
+                with fake.lock:
+                    fake.containers[container_id] = {
+                        "Id": container_id,
+                        "Image": "dockenv-env0:latest",
+                        "State": {"Status": "created"},
+                    }
+                self._send_json({"Id": container_id, "Warnings": []}, 201)
+            elif path.startswith("/containers/") and path.endswith("/start"):
+                self._read_body()
+                self.send_response(204)
+                self.end_headers()
+            elif path.startswith("/containers/") and path.endswith("/wait"):
+                self._read_body()
+                self._send_json({"StatusCode": 0})
+            else:
+                self._read_body()
+                self._not_found()
+
+        def do_DELETE(self):  # pylint: disable=invalid-name
+            time.sleep(fake.latency)
+            path = self._path()
+            if path.startswith("/images/"):
+                image = fake.find_image(path[len("/images/"):])
+                if image is None:
+                    return self._not_found()
+                with fake.lock:
+                    fake.images.pop(image["Id"], None)
+                self._send_json([{"Untagged": image["RepoTags"][0]}])
+            elif path.startswith("/containers/"):
+                with fake.lock:
+                    fake.containers.pop(path.split("/")[2], None)
+                self.send_response(204)
+                self.end_headers()
+            else:
+                self._not_found()
+            return None
+
+    return Handler
@@ -0,0 +1,6 @@
+"""
+Dockenv - Run untrusted python in Docker
+"""
+from .api import AsyncSession, DockenvError, Result, Session
+
+__all__ = ["AsyncSession", "DockenvError", "Result", "Session"]
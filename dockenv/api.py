@@ -0,0 +1,1733 @@
+"""
+Dockenv - Python API, to use dockenv from other Python code.
+
+A Session holds a single Docker client that is reused by every call.
+Every call returns a Result, with an exit code instead of printing errors:
+
+    with Session() as session:
+        result = session.run("myenv", "script.py", capture_output=True)
+        print(result.exit_code, result.stdout)
+
+AsyncSession has the same calls as coroutines. Scripts are run as asyncio
+subprocesses, so many runs can be awaited at once without a thread per run.
+"""
+import asyncio
+import codecs
+import concurrent.futures
+import contextlib
+import functools
+import logging
+import os
+import posixpath
+import re
+import shlex
+import shutil
+import stat
+import subprocess
+import sys
+import tempfile
+import time
+import traceback
+import uuid
+import docker
+from .build import (PYTHON_VERSION, download_wheels, get_base_images,
+                    get_dockerfile, get_pip_script)
+from .context import link_or_copy, get_context_tar
+from .imports import (find_regressions, get_image_imports, label_image,
+                      profile_imports)
+from .store import (export_image, get_daemon_chain_ids, import_image,
+                    list_images)
+from .versions import (get_current_version, get_keep_versions,
+                       get_image_versions, get_prune_versions,
+                       get_version_tag)
+from .volumes import sync_volume
+from .watcher import Watcher
+
+ROOT_FOLDER = os.path.abspath(os.path.dirname(__file__))
+PROFILE_DEST = "/usr/src/app/profile"
+# Default size of the in-memory '/tmp' and scratch folders
+TMPFS_SIZE = "64m"
+# Scratch space is for data, not programs
+TMPFS_OPTIONS = "rw,mode=1777,nosuid,nodev,noexec"
+# A size of 0 would mean no limit at all, so isn't allowed
+TMPFS_SIZE_FORMAT = re.compile(r"^0*[1-9][0-9]*[kmg]?$", re.IGNORECASE)
+
+LOGGER = logging.getLogger(__name__)
+
+
+class DockenvError(Exception):
+    """
+    Raised when a call can't be done, e.g. the env doesn't exist.
+    Public Session calls catch this, and return it as a failed Result
+    """
+
+
+class Result():
+    """
+    The result of a Session call.
+    Every result has 'envname', 'exit_code' and 'error', other attributes
+    depend on the call, and are listed in each call's docstring.
+    Only the attributes listed in 'FIELDS' can be set, any not set by the
+    call are None.
+    """
+    FIELDS = [
+        "current", "deduplicated", "duration", "envs", "filename", "image",
+        "import_regressions", "imports", "packages", "profile", "removed",
+        "size", "stderr", "stdout", "store", "version", "versions"
+    ]
+    current = deduplicated = duration = envs = filename = image = None
+    import_regressions = imports = packages = profile = removed = None
+    size = stderr = stdout = store = version = versions = None
+
+    def __init__(self, envname, exit_code=0, error=None, **kwargs):
+        self.envname = envname
+        self.exit_code = exit_code
+        self.error = error
+        for name, value in kwargs.items():
+            if name not in self.FIELDS:
+                raise TypeError(f"Result has no field {name!r}")
+            setattr(self, name, value)
+
+    @property
+    def ok(self):  # pylint: disable=invalid-name
+        """
+        True if the call succeeded
+        """
+        return self.exit_code == 0
+
+    def to_dict(self):
+        """
+        Get the result as a dict, e.g. to send as JSON
+        """
+        return dict(self.__dict__)
+
+    def __repr__(self):
+        fields = ", ".join(f"{key}={value!r}"
+                           for key, value in self.to_dict().items())
+        return f"Result({fields})"
+
+
+def get_posix_path(path):
+    """
+    If on Windows, convert a windows path to POSIX
+    """
+    if os.name != "nt":
+        return path
+    split = os.path.splitdrive(path)
+    drive = split[0].replace(":", "").lower()
+    posix_path = "/" + drive + split[1].replace("\\", "/")
+    return posix_path
+
+
+def get_dockenv_name(envname):
+    """
+    Get the Docker image name of a virtual env
+
+    :param envname: The user-defined virtual env name
+    """
+    return f"dockenv-{envname}"
+
+
+def get_matrix_envname(envname, python_version):
+    """
+    Get the name of one env in a Python version matrix
+
+    :param envname: The name of the matrix
+    :param python_version: The Python version of the env, e.g. '3.10'
+    """
+    return f"{envname}-py{python_version}"
+
+
+def get_venv_name(dockenv_name):
+    """
+    Helper function to split the user-defined virtual env name
+    out of the full name that includes the dockenv tag
+
+    :param dockenv_name: The full name to pull the virtual env name
+                         out of
+    """
+    # Format of tage name if dockenv-**NAME**:latest
+    venv_start = len("dockenv-")
+    if dockenv_name.endswith(":latest"):
+        venv_end = len(":latest") * -1
+        return dockenv_name[venv_start:venv_end]
+    return dockenv_name[venv_start:]
+
+
+def get_watch_snapshot(paths):
+    """
+    Get the size and modified time of every file in a list of files
+    and folders, to see if anything has changed between two calls
+
+    :param paths: list of files and folders to check
+    :returns: dict of file path to (size, modified time)
+    """
+    snapshot = {}
+    for path in paths:
+        if os.path.isfile(path):
+            files = [path]
+        else:
+            files = [
+                os.path.join(root, fname)
+                for root, _, fnames in os.walk(path) for fname in fnames
+            ]
+        for fname in files:
+            try:
+                file_stat = os.stat(fname)
+            except OSError:
+                # File removed while we were looking at it
+                continue
+            snapshot[fname] = (file_stat.st_size, file_stat.st_mtime_ns)
+    return snapshot
+
+
+def open_profile_file(fname):
+    """
+    Open a file the profiler wrote, only if it's a regular file.
+    The script can write into the profile folder too, so could have
+    swapped a file for a link to one of our own files
+
+    :param fname: The path of the file
+    :returns: The file object, opened for binary reading, or None
+    """
+    if os.path.islink(fname):
+        return None
+    # Non-blocking, so opening a FIFO doesn't hang
+    flags = os.O_RDONLY | getattr(os, "O_NOFOLLOW", 0) | getattr(
+        os, "O_NONBLOCK", 0) | getattr(os, "O_BINARY", 0)
+    try:
+        fd = os.open(fname, flags)
+    except OSError:
+        return None
+    if not stat.S_ISREG(os.fstat(fd).st_mode):
+        os.close(fd)
+        return None
+    return os.fdopen(fd, "rb")
+
+
+def read_profile(profile_dir, profile_output=None):
+    """
+    Read the hotspot summary written by the profiler inside the container,
+    and optionally keep the full profile.
+    The summary is made inside the container, so we never load the
+    profile, which the script could have tampered with, ourselves.
+
+    :param profile_dir: The folder the profiler wrote into
+    :param profile_output: If not None, folder to copy the full profile into
+    :returns: The summary text, or None if the profiler didn't write one
+    """
+    fsummary = open_profile_file(os.path.join(profile_dir, "summary.txt"))
+    if fsummary is None:
+        return None
+    with fsummary:
+        summary = fsummary.read().decode(errors="replace")
+
+    if profile_output:
+        os.makedirs(profile_output, exist_ok=True)
+        for fname in ["profile.prof", "profile.html"]:
+            fprofile = open_profile_file(os.path.join(profile_dir, fname))
+            if fprofile is None:
+                continue
+            output_fname = os.path.join(profile_output, fname)
+            with fprofile, open(output_fname, "wb") as foutput:
+                shutil.copyfileobj(fprofile, foutput)
+            LOGGER.info(f"[*] Saved profile to {output_fname!r}")
+    return summary
+
+
+def format_size(size):
+    """
+    Format a size in bytes to show to the user
+
+    :param size: The size in bytes, or None if not known
+    """
+    if size is None:
+        return "unknown size"
+    return f"{size / 1024 / 1024:.1f} MB"
+
+
+def get_tmpfs_args(tmpfs_size=None, scratch_dir=None):
+    """
+    Get the 'docker run' arguments to mount size-limited, in-memory folders
+    at '/tmp' and, optionally, a scratch folder. These can be written to
+    even when the rest of the filesystem is read-only
+
+    :param tmpfs_size: The most each folder can hold, e.g. '64m' or '1g'.
+                       If None, no folders are mounted, unless 'scratch_dir'
+                       is set, then the default size is used
+    :param scratch_dir: If not None, absolute path inside the container of
+                        a scratch folder to mount, as well as '/tmp'
+    :returns: list of 'docker run' arguments
+    """
+    if scratch_dir and not tmpfs_size:
+        tmpfs_size = TMPFS_SIZE
+    if not tmpfs_size:
+        return []
+    if not TMPFS_SIZE_FORMAT.match(str(tmpfs_size)):
+        raise DockenvError(
+            f"Bad tmpfs size {tmpfs_size!r}, should be more than 0, "
+            "e.g. '64m' or '1g'")
+
+    folders = ["/tmp"]
+    if scratch_dir:
+        scratch_dir = posixpath.normpath(scratch_dir)
+        if not posixpath.isabs(scratch_dir) or scratch_dir == "/" or \
+                ":" in scratch_dir or "," in scratch_dir:
+            raise DockenvError(
+                f"Bad scratch folder {scratch_dir!r}, should be an absolute "
+                "path inside the container, e.g. '/scratch'")
+        if scratch_dir != "/tmp":
+            folders.append(scratch_dir)
+
+    args = []
+    for folder in folders:
+        args += ["--tmpfs", f"{folder}:{TMPFS_OPTIONS},size={tmpfs_size}"]
+    return args
+
+
+def parse_freeze(output):
+    """
+    Get the list of packages from the output of 'pip freeze'
+
+    :param output: The text output of 'pip freeze'
+    :returns: list of package lines
+    """
+    return [line.strip() for line in output.splitlines() if line.strip()]
+
+
+class Session():
+    """
+    A dockenv session, holding one Docker client for all calls.
+    The client is only created the first time it is needed.
+    """
+
+    def __init__(self, client=None, cache_images=False, keep_versions=None):
+        """
+        :param client: A docker.DockerClient to use. If None, one is
+                       created from the environment when first needed
+        :param cache_images: If True, keep the list of local image tags between
+                             calls. Only use this if something calls
+                             'invalidate_images' when images change outside
+                             of this session, e.g. the dockenv service
+        :param keep_versions: How many versions of each env to keep after a
+                              build. If 0, keep every version. If None, use
+                              $DOCKENV_KEEP_VERSIONS, or 5
+        """
+        self._client = client
+        self.cache_images = cache_images
+        self._keep_versions = keep_versions
+        self._image_labels = None
+
+    @property
+    def keep_versions(self):
+        """
+        How many versions of each env to keep after a build, 0 for all
+        """
+        if self._keep_versions is None:
+            return get_keep_versions()
+        return self._keep_versions
+
+    @property
+    def client(self):
+        """
+        The Docker client used by this session
+        """
+        if self._client is None:
+            self._client = docker.from_env()
+        return self._client
+
+    def close(self):
+        """
+        Close the Docker client
+        """
+        if self._client is not None:
+            self._client.close()
+            self._client = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def image_labels(self):
+        """
+        Get the labels of every local image
+
+        :returns: dict of image tag to dict of labels
+        """
+        image_labels = self._image_labels
+        if image_labels is None:
+            image_labels = {}
+            for image in self.client.images.list():
+                for tag in image.tags:
+                    image_labels[tag] = image.labels
+            if self.cache_images:
+                self._image_labels = image_labels
+        return image_labels
+
+    def image_tags(self):
+        """
+        Get the tags of every local image
+
+        :returns: set of image tags
+        """
+        return set(self.image_labels())
+
+    def invalidate_images(self):
+        """
+        Forget the cached list of local image tags
+        """
+        self._image_labels = None
+
+    def image_exists(self, image_name, tagname="latest"):
+        """
+        Check if we already have an image stored locally.
+
+        :param image_name: The name of the image
+        :param tagname: The particular tag of the image to get. defaults to 'latest'
+        :returns: True if the image exists locally
+        """
+        return f"{image_name}:{tagname}" in self.image_tags()
+
+    def get_local_container(self, venv_name, tagname="latest"):
+        """
+        Get a Docker container object, but only if we have it locally.
+        The Docker API will attempt to call out to the remote registry if we
+        do not have the container localy.
+
+        However as Dockenv only operates on the local
+        level, calling out to a remote site is reduntant at best, and a potential
+        security risk at worst, as the name may contain sensitive information, and
+        would open the user to an attack where a malicious user uploads their own
+        container matching the name to the registry.
+
+        :param venv_name: The name of the container to attempt to get.
+        :param tagname: The particular tag of the image to get. defaults to 'latest'
+        :returns: The Docker container object that matches the name if it
+                  exists locally, otherwise None.
+        """
+        if self.image_exists(venv_name, tagname=tagname):
+            return self.client.containers.get(venv_name)
+        return None
+
+    def _check_env(self, envname):
+        """
+        Raise if an env doesn't exist
+
+        :returns: The Docker image name of the env
+        """
+        dockenv_name = get_dockenv_name(envname)
+        if not self.image_exists(dockenv_name):
+            raise DockenvError(f"Virtual Env {envname!r} doesn't exist")
+        return dockenv_name
+
+    def list(self):
+        """
+        List all virtual envs. This will list all images that
+        match the name "dockenv-<envname>"
+
+        :returns: Result, with 'envs' the list of env names, and 'imports'
+                  a dict of env name to its import profile, for envs built
+                  with 'import_profile'
+        """
+        envs = []
+        imports = {}
+        for tag, labels in self.image_labels().items():
+            # Versions of envs are tagged 'v<N>', only list the current one
+            if not tag.startswith("dockenv") or not tag.endswith(":latest"):
+                continue
+            envname = get_venv_name(tag)
+            envs.append(envname)
+            profile = get_image_imports(labels)
+            if profile is not None:
+                imports[envname] = profile
+        return Result(None, envs=sorted(envs), imports=imports)
+
+    # pylint: disable=too-many-arguments, too-many-locals
+    def _build(self,
+               envname,
+               upgrade=False,
+               requirements=None,
+               package=None,
+               allow_nonbinary=False,
+               extra_pip_arguments=None,
+               slim=False,
+               python_version=None,
+               wheels=None,
+               import_profile=False,
+               verbose=False):
+        """
+        Create a new virtual env or upgrade an existing one.
+        If new, this will build a Docker image based on the "Python:3" image,
+        and our Image will be named named "dockenv-<envname>".
+        If upgrading, we will build from a base image of the same name
+
+        :param upgrade: If True, base image will be the same dockenv image.
+                        If False, base image will be "python:3"
+        :param slim: If True, install in a builder stage and copy the
+                     packages into a "python:3-slim" image
+        :param python_version: If not None, build off "python:<python_version>"
+        :param wheels: If not None, list of downloaded wheels to install
+                       from, instead of downloading them again
+        :param import_profile: If True, measure the import time of every
+                               package after building. Always done when
+                               upgrading an env that was measured before
+        """
+        dockenv_name = get_dockenv_name(envname)
+        try:
+            base_image = get_base_images(python_version)[0]
+        except ValueError as exc:
+            raise DockenvError(str(exc)) from exc
+
+        image_exists = self.image_exists(dockenv_name)
+        # Check if either upgrading and image is missing,
+        # or if creating new and image already exists
+        if (not upgrade) and image_exists:
+            raise DockenvError(f"Virtual Env {envname!r} already exists! "
+                               "Use 'dockenv delete' or 'dockenv run'")
+        if upgrade and (not image_exists):
+            raise DockenvError(f"Virtual Env {envname!r} doesn't exist! ")
+
+        if package and requirements:
+            raise DockenvError(
+                "Use only one of '--package' or '--requirements'")
+
+        # Only send the files the build needs, no 'COPY . .'
+        context_files = {}
+        if requirements is not None:
+            context_files["requirements.txt"] = requirements
+        if package is not None:
+            context_files["requirements.txt"] = package.encode()
+        for wheel in wheels or []:
+            context_files[f"wheels/{os.path.basename(wheel)}"] = wheel
+
+        old_image = None
+        old_labels = {}
+        if upgrade:
+            old_image = self.client.images.get(dockenv_name)
+            old_labels = old_image.labels
+        # Upgrading a slim env builds off the slim image, which has no compilers
+        if old_labels.get("dockenv.slim") == "true":
+            LOGGER.info("[*] Upgrading a slim env, packages must be binary")
+        old_imports = get_image_imports(old_labels)
+        import_profile = import_profile or old_imports is not None
+        pip_script = get_pip_script(
+            bool(context_files), allow_nonbinary, extra_pip_arguments,
+            bool(wheels))
+        dockerfile = get_dockerfile(
+            dockenv_name,
+            upgrade=upgrade,
+            slim=slim,
+            has_requirements=bool(context_files),
+            pip_script=pip_script,
+            python_version=python_version,
+            wheels=bool(wheels) and not upgrade)
+        context_files["Dockerfile"] = dockerfile.encode()
+
+        # The context tarball is cached, so rebuilding the same env
+        # doesn't need to re-read and re-tar the same files
+        context_tar = get_context_tar(context_files)
+
+        # It takes a while to build the base Python3 image if we haven't already
+        if not self.image_exists(*base_image.split(":")):
+            LOGGER.info(
+                f"[*] First time using dockenv, may take some extra time")
+
+        # Build the container
+        LOGGER.info(f"[*] building virtual env {dockenv_name!r}...")
+        # NOTE: I didn't see how to get 'client.images.build'
+        # to actually print what it is doing, leading this to "hang" with no output
+        # Switched to calling subprocess so user gets feedback on whats going on
+        try:
+            with open(context_tar, "rb") as fcontext:
+                if verbose:
+                    subprocess.check_call(
+                        ["docker", "build", "-t", dockenv_name, "-"],
+                        stdin=fcontext)
+                else:
+                    self.client.images.build(
+                        tag=dockenv_name, fileobj=fcontext, custom_context=True)
+        finally:
+            self.invalidate_images()
+        size = self.client.images.get(dockenv_name).attrs.get("Size")
+        LOGGER.info(f"[*] built virtual env {dockenv_name!r}"
+                    f" ({format_size(size)})")
+        result = Result(envname, image=dockenv_name, size=size)
+        if import_profile:
+            LOGGER.info(f"[*] Measuring import times in {dockenv_name!r}...")
+            try:
+                result.imports = profile_imports(self.client, dockenv_name)
+                label_image(self.client, dockenv_name, result.imports)
+            except (docker.errors.DockerException, OSError, ValueError) as exc:
+                # The env itself built fine, so don't fail
+                LOGGER.debug(traceback.format_exc())
+                LOGGER.error(f"ERROR: Failed to measure import times: {exc}")
+                # An upgrade keeps the old image's label, whose numbers
+                # no longer match the packages
+                result.imports = {"error": str(exc), "modules": {}}
+                self._clear_imports(dockenv_name, result.imports)
+            else:
+                result.import_regressions = find_regressions(
+                    old_imports, result.imports)
+            finally:
+                self.invalidate_images()
+        result.version = self._tag_version(dockenv_name, old_image)
+        return result
+
+    def _clear_imports(self, dockenv_name, profile):
+        """
+        Replace an env's import profile after measuring it failed
+
+        :param dockenv_name: The Docker image name of the env
+        :param profile: The import profile dict to store instead
+        """
+        try:
+            label_image(self.client, dockenv_name, profile)
+        except docker.errors.DockerException as exc:
+            LOGGER.debug(traceback.format_exc())
+            LOGGER.error(f"ERROR: Failed to clear old import times: {exc}")
+
+    def _env_versions(self, dockenv_name):
+        """
+        Get the versions of an env
+
+        :returns: dict of version number to Image, oldest first
+        """
+        return get_image_versions(
+            self.client.images.list(name=dockenv_name), dockenv_name)
+
+    def _tag_version(self, dockenv_name, old_image=None):
+        """
+        Tag the env's new 'latest' image as the next version,
+        then remove old versions past 'keep_versions'
+
+        :param old_image: If upgrading, the image 'latest' was before
+        :returns: The new version number
+        """
+        try:
+            versions = self._env_versions(dockenv_name)
+            next_version = max(versions, default=0) + 1
+            # Envs from before versions existed, keep what we upgraded from
+            if old_image is not None and get_current_version(
+                    versions, old_image.id) is None:
+                old_image.tag(dockenv_name, get_version_tag(next_version))
+                next_version += 1
+
+            image = self.client.images.get(dockenv_name)
+            version = get_current_version(versions, image.id)
+            # A build that changed nothing gives the same image
+            if version is None:
+                version = next_version
+                image.tag(dockenv_name, get_version_tag(version))
+                LOGGER.info(f"[*] tagged {dockenv_name!r} as version {version}")
+        finally:
+            self.invalidate_images()
+        self._prune(dockenv_name, self.keep_versions)
+        return version
+
+    def _prune(self, dockenv_name, keep):
+        """
+        Remove all but the newest 'keep' versions of an env
+
+        :returns: list of the removed version numbers
+        """
+        versions = self._env_versions(dockenv_name)
+        current = get_current_version(
+            versions, self.client.images.get(dockenv_name).id)
+        removed = []
+        try:
+            for version in get_prune_versions(versions, keep, current):
+                try:
+                    self.client.images.remove(
+                        f"{dockenv_name}:{get_version_tag(version)}")
+                except docker.errors.APIError as exc:
+                    # e.g. a container still uses it
+                    LOGGER.debug(traceback.format_exc())
+                    LOGGER.info(f"[*] Kept version {version} of "
+                                f"{dockenv_name!r}: {exc.explanation}")
+                    continue
+                removed.append(version)
+        finally:
+            self.invalidate_images()
+        if removed:
+            LOGGER.info(f"[*] Removed old versions of {dockenv_name!r}: "
+                        f"{', '.join(str(version) for version in removed)}")
+        return removed
+
+    def new(self, envname, **kwargs):
+        """
+        Create a new virtual env. This will build a Docker image based on the
+        "Python:3" image. Our Image will be named named "dockenv-<envname>"
+
+        :param envname: name of the virtualenv to create
+        :param requirements: requirements.txt file to install
+        :param package: name of a packge to install from pip
+        :param allow_nonbinary: If False, pip will be run with '--only-binary=:all:'
+        :param extra_pip_arguments: list of extra arguments to pass to pip
+        :param slim: If True, install in a builder stage and copy only the
+                     installed packages into a smaller "python:3-slim" image
+        :param python_version: If not None, build off "python:<python_version>"
+                               instead of "python:3"
+        :param import_profile: If True, measure how long, and how much memory,
+                               importing each installed package takes, and
+                               store it on the env
+        :param verbose: If True, print the docker build output
+        :returns: Result, with 'image' the Docker image name, 'size' the
+                  image size in bytes, and 'imports' the import profile
+                  (if measured)
+        """
+        try:
+            return self._build(envname, upgrade=False, **kwargs)
+        except (DockenvError, docker.errors.DockerException,
+                subprocess.CalledProcessError) as exc:
+            LOGGER.debug(traceback.format_exc())
+            return Result(envname, exit_code=1, error=str(exc))
+
+    def upgrade(self, envname, **kwargs):
+        """
+        Upgrade a virtual env, installing new packages and creating
+        a new version of the virtualenv image.
+        Takes the same arguments as 'new'. If the env's import times were
+        measured before, they are measured again, and packages that got
+        slower to import are flagged
+
+        :returns: Result, with 'image' the Docker image name, 'size' the
+                  image size in bytes, 'imports' the import profile, and
+                  'import_regressions' the packages that got slower
+                  (if measured)
+        """
+        try:
+            return self._build(envname, upgrade=True, **kwargs)
+        except (DockenvError, docker.errors.DockerException,
+                subprocess.CalledProcessError) as exc:
+            LOGGER.debug(traceback.format_exc())
+            return Result(envname, exit_code=1, error=str(exc))
+
+    def matrix_envs(self, envname):
+        """
+        Get the envs of a Python version matrix made by 'new_matrix'
+
+        :param envname: The name of the matrix
+        :returns: dict of Python version to env name, oldest version first
+        """
+        prefix = f"{envname}-py"
+        envs = {}
+        for name in self.list().envs or []:
+            version = name[len(prefix):]
+            if name.startswith(prefix) and PYTHON_VERSION.match(version):
+                envs[version] = name
+        return dict(
+            sorted(envs.items(),
+                   key=lambda item: [int(part) for part in item[0].split(".")]))
+
+    def new_matrix(self, envname, python_versions, **kwargs):
+        """
+        Create an env for every Python version in a list, building them
+        at once. Each env is named "<envname>-py<version>".
+        Unless 'allow_nonbinary' or 'extra_pip_arguments' are set, wheels
+        for every version are downloaded first into one folder, so wheels
+        that work on every version are only downloaded once.
+        Takes the same arguments as 'new'
+
+        :param envname: The name of the matrix
+        :param python_versions: list of Python versions, e.g. ['3.8', '3.12']
+        :returns: Result, with 'envs' the env names, and 'versions' a dict of
+                  Python version to each build's Result as a dict
+        """
+        try:
+            for python_version in python_versions:
+                get_base_images(python_version)
+        except ValueError as exc:
+            return Result(envname, exit_code=1, error=str(exc))
+
+        requirements = kwargs.get("requirements")
+        package = kwargs.get("package")
+        share_wheels = ((requirements or package)
+                        and not kwargs.get("allow_nonbinary")
+                        and not kwargs.get("extra_pip_arguments"))
+        with tempfile.TemporaryDirectory(prefix="dockenv-wheels-") as wheel_folder:
+            wheels = {}
+            if share_wheels:
+                LOGGER.info("[*] Downloading wheels for every Python version")
+                try:
+                    if requirements:
+                        with open(requirements, "rb") as freqs:
+                            requirements = freqs.read()
+                    else:
+                        requirements = package.encode()
+                    wheels = download_wheels(self.client, requirements,
+                                             python_versions, wheel_folder)
+                except (docker.errors.DockerException, OSError):
+                    LOGGER.debug(traceback.format_exc())
+                    LOGGER.info("[*] Couldn't download wheels, "
+                                "every version will download its own")
+
+            with concurrent.futures.ThreadPoolExecutor(
+                    max_workers=len(python_versions)) as executor:
+                futures = {
+                    python_version: executor.submit(
+                        self.new,
+                        get_matrix_envname(envname, python_version),
+                        python_version=python_version,
+                        wheels=wheels.get(python_version),
+                        **kwargs)
+                    for python_version in python_versions
+                }
+                results = {
+                    python_version: future.result()
+                    for python_version, future in futures.items()
+                }
+
+        errors = [
+            f"{result.envname}: {result.error}"
+            for result in results.values() if not result.ok
+        ]
+        return Result(
+            envname,
+            exit_code=1 if errors else 0,
+            error="; ".join(errors) or None,
+            envs=[result.envname for result in results.values()],
+            versions={
+                python_version: result.to_dict()
+                for python_version, result in results.items()
+            })
+
+    # pylint: disable=too-many-branches, too-many-statements
+    @contextlib.contextmanager
+    def _prepare_run(self,
+                     envname,
+                     script,
+                     as_module=False,
+                     expose_port=None,
+                     mount=None,
+                     write_filesystem=False,
+                     write_mount=False,
+                     cache_mount=False,
+                     profile=None,
+                     profile_top=20,
+                     capture_output=False,
+                     tmpfs_size=None,
+                     scratch_dir=None,
+                     container_name=None,
+                     script_args=None):
+        """
+        Set up the runner folder for a script, and get the 'docker run'
+        arguments to run it. The runner folder only lives as long as
+        the context.
+
+        :param container_name: If not None, the name to give the container
+        :yields: tuple of ('docker run' arguments, profile folder or None)
+        """
+        dockenv_name = self._check_env(envname)
+        tmpfs_args = get_tmpfs_args(tmpfs_size, scratch_dir)
+
+        if cache_mount and write_mount:
+            raise DockenvError(
+                "Use only one of '--cache-mount' or '--writeable-mount'")
+
+        if as_module:
+            cmd = ["-m", f"{script}"]
+        else:
+            cmd = [f"./{os.path.split(script)[-1]}"]
+
+        if profile:
+            if as_module:
+                cmd = ["--as-module", f"{script}"]
+            cmd = [
+                "./profile_runner.py", "--output", PROFILE_DEST, "--top",
+                str(profile_top), "--profiler", profile
+            ] + cmd
+
+        if script_args:
+            cmd += script_args
+        cmd_quoted = " ".join(shlex.quote(x) for x in cmd)
+
+        expose_script = ""
+        if expose_port:
+            expose_script = f"echo [***] Exposed port: $(hostname -i):{expose_port} [***]"
+
+        runner_script = f"""
+        {expose_script}
+        cd ./runner
+        python {cmd_quoted}
+        """
+
+        with contextlib.ExitStack() as stack:
+            runner_dir = stack.enter_context(tempfile.TemporaryDirectory())
+            profile_dir = None
+            if profile:
+                # The only place the script can write to when the filesystem is
+                # read-only. Others can write and enter, but not list, the folder
+                profile_dir = tempfile.mkdtemp(prefix="dockenv-profile-")
+                stack.callback(shutil.rmtree, profile_dir, ignore_errors=True)
+                os.chmod(profile_dir, 0o733)
+                shutil.copy(
+                    os.path.join(ROOT_FOLDER, "scripts", "profile_runner.py"),
+                    runner_dir)
+
+            if not as_module:
+                # Only hardlink the script if the container can't write to it
+                link_or_copy(
+                    script,
+                    os.path.join(runner_dir, os.path.split(script)[-1]),
+                    allow_link=not write_filesystem)
+            with open(
+                    os.path.join(runner_dir, "run.sh"), "w",
+                    newline="\n") as frunner:
+                frunner.write(runner_script)
+
+            # Create new container to run, mounting our temp dir into it
+            args = ["docker", "run", "--rm"]
+            if container_name:
+                args += ["--name", container_name]
+            if not capture_output:
+                args += ["-i"]
+                if sys.stdin.isatty():
+                    args += ["-t"]
+            # mount temp dir into container
+            vol_cmd = f"{get_posix_path(runner_dir)}:/usr/src/app/runner"
+            if write_filesystem:
+                args += ["-v", vol_cmd]
+            else:
+                args += ["-v", f"{vol_cmd}:ro"]
+                args += ["--read-only"]
+            args += tmpfs_args
+
+            if expose_port:
+                args += ["--expose", str(expose_port)]
+
+            if profile:
+                args += ["-v", f"{get_posix_path(profile_dir)}:{PROFILE_DEST}"]
+
+            if mount:
+                src_abs = os.path.abspath(mount)
+                dest_folder = os.path.split(src_abs)[-1]
+                args += ["-v"]
+                mount_cmd = f"{get_posix_path(src_abs)}:/usr/src/app/{dest_folder}"
+                if cache_mount:
+                    LOGGER.info(f"[*] syncing {mount!r} into cache volume")
+                    volume_name = sync_volume(self.client, dockenv_name,
+                                              src_abs)
+                    mount_cmd = f"{volume_name}:/usr/src/app/{dest_folder}"
+                if write_mount:
+                    args += [mount_cmd]
+                else:
+                    args += [f"{mount_cmd}:ro"]
+            args += [dockenv_name]
+            yield args, profile_dir
+
+    @staticmethod
+    def _run_result(envname, returncode, stdout, stderr, start, profile_dir,
+                    profile_output):
+        """
+        Make the Result of a finished run
+        """
+        result = Result(
+            envname,
+            exit_code=returncode,
+            stdout=stdout,
+            stderr=stderr,
+            duration=time.perf_counter() - start,
+            profile=None)
+        if profile_dir:
+            result.profile = read_profile(profile_dir, profile_output)
+            if result.profile is None:
+                LOGGER.error("ERROR: Profiler didn't write any output")
+        return result
+
+    def run(self,
+            envname,
+            script,
+            profile_output=None,
+            capture_output=False,
+            **kwargs):
+        """
+        Run a script inside a virtual env. This will create a container
+        based on an image named "dockenv-<envname>", and run the script
+        inside it, passing in the args
+
+        :param envname: The name of the env to run in
+        :param script: The path to the script file to run
+        :param as_module: If True, script is not a file on disk, but a python module
+                          to run with 'python -m'
+        :param expose_port: A port to expose on the docker container, so the host
+                            can connect to it
+        :param mount: A folder to mount inside the container. This can be used to
+                      pass in config files or other data to the script to read
+        :param write_filesystem: If True, allow script to write to conainer's
+                                 filesystem
+        :param write_mount: If True, allow script to write to the mounted folder
+        :param cache_mount: If True, sync the mount folder into a named volume
+                            and mount that instead of the folder itself
+        :param tmpfs_size: If not None, mount an in-memory '/tmp' that can hold
+                           this much, e.g. '64m', even if the filesystem is
+                           read-only
+        :param scratch_dir: If not None, also mount an in-memory folder here,
+                            e.g. '/scratch'. Uses 'tmpfs_size', or 64m
+        :param profile: If not None, run the script under a profiler. One of 'auto',
+                        'cprofile' or 'sampling'. 'auto' uses a sampling profiler
+                        if one is installed in the env, otherwise cProfile
+        :param profile_top: How many hotspots to include when profiling
+        :param profile_output: If not None, folder to copy the full profile into
+        :param capture_output: If True, return the script's output instead of
+                               printing it
+        :param script_args: If not None, an array of arguments to pass into the
+                            script
+        :returns: Result, with 'stdout' and 'stderr' (if captured), 'duration'
+                  in seconds, and 'profile' the profile summary (if profiled)
+        """
+        start = time.perf_counter()
+        try:
+            with self._prepare_run(
+                    envname, script, capture_output=capture_output,
+                    **kwargs) as (args, profile_dir):
+                output = subprocess.PIPE if capture_output else None
+                process = subprocess.run(
+                    args,
+                    stdout=output,
+                    stderr=output,
+                    universal_newlines=capture_output)
+                return self._run_result(envname, process.returncode,
+                                        process.stdout, process.stderr, start,
+                                        profile_dir, profile_output)
+        except (DockenvError, docker.errors.DockerException, OSError) as exc:
+            LOGGER.debug(traceback.format_exc())
+            return Result(envname, exit_code=1, error=str(exc))
+
+    def run_matrix(self, envname, script, **kwargs):
+        """
+        Run a script in every env of a Python version matrix at once.
+        Takes the same arguments as 'run', but output is always captured
+
+        :param envname: The name of the matrix
+        :param script: The path to the script file to run
+        :returns: Result, with 'versions' a dict of Python version to
+                  each run's Result as a dict
+        """
+        try:
+            envs = self.matrix_envs(envname)
+        except docker.errors.DockerException as exc:
+            LOGGER.debug(traceback.format_exc())
+            return Result(envname, exit_code=1, error=str(exc))
+        if not envs:
+            return Result(
+                envname,
+                exit_code=1,
+                error=(f"Python version matrix {envname!r} doesn't exist! "
+                       f"Use 'dockenv new {envname} --python ...'"))
+        kwargs["capture_output"] = True
+        with concurrent.futures.ThreadPoolExecutor(
+                max_workers=len(envs)) as executor:
+            futures = {
+                python_version: executor.submit(self.run, name, script,
+                                                **kwargs)
+                for python_version, name in envs.items()
+            }
+            results = {
+                python_version: future.result()
+                for python_version, future in futures.items()
+            }
+        return Result(
+            envname,
+            exit_code=0 if all(result.ok for result in results.values()) else 1,
+            versions={
+                python_version: result.to_dict()
+                for python_version, result in results.items()
+            })
+
+    def shell(self,
+              envname,
+              expose_port=None,
+              mount=None,
+              read_only=False,
+              tmpfs_size=None,
+              scratch_dir=None):
+        """
+        Launch a shell inside a virtual env. This will create a container
+        based on an image named "dockenv-<envname>".
+        As this is for debugging, it has a writable filesystem,
+        unless 'read_only' is set
+
+        :param read_only: If True, keep the filesystem read-only, like 'run',
+                          with an in-memory '/tmp' to write to
+        :param tmpfs_size: See 'run'
+        :param scratch_dir: See 'run'
+        :returns: Result
+        """
+        if read_only and not tmpfs_size:
+            tmpfs_size = TMPFS_SIZE
+        with tempfile.TemporaryDirectory() as runner_dir:
+            shell_fname = os.path.join(runner_dir, "shell.py")
+            with open(shell_fname, "w", newline="\n") as fshell:
+                fshell.write("import pty; pty.spawn('/bin/bash')")
+            return self.run(
+                envname,
+                shell_fname,
+                expose_port=expose_port,
+                mount=mount,
+                write_mount=True,
+                write_filesystem=not read_only,
+                tmpfs_size=tmpfs_size,
+                scratch_dir=scratch_dir)
+
+    def freeze(self, envname, tmpfs_size=TMPFS_SIZE):
+        """
+        Run "pip freeze" inside the virtual env
+
+        :param tmpfs_size: How much pip can write to its in-memory '/tmp'
+        :returns: Result, with 'packages' the list of installed packages,
+                  and 'imports' the env's import profile, or None
+        """
+        # Pip freeze needs to write to /tmp, so give it an in-memory one,
+        # instead of making the whole filesystem writeable
+        result = self.run(
+            envname,
+            "pip",
+            as_module=True,
+            capture_output=True,
+            tmpfs_size=tmpfs_size,
+            script_args=["--disable-pip-version-check", "freeze"])
+        result.packages = parse_freeze(result.stdout or "")
+        result.imports = get_image_imports(
+            self.image_labels().get(f"{get_dockenv_name(envname)}:latest"))
+        return result
+
+    # pylint: disable=too-many-arguments
+    def watch(self,
+              envname,
+              script,
+              as_module=False,
+              expose_port=None,
+              mount=None,
+              preload=None,
+              script_args=None,
+              interval=0.25):
+        """
+        Run a script inside a virtual env, and re-run it every time the script
+        or the mounted folder changes. Blocks until stopped with Ctrl+C.
+        Unlike 'run', one container is kept running, with a helper script
+        that forks a new child for each run, so the interpreter and any
+        preloaded modules are already warm. A change while the script is
+        still running stops it and starts it again.
+        Changes are seen with inotify on Linux, and by polling elsewhere.
+
+        :param envname: The name of the env to run in
+        :param script: The path to the script file to run
+        :param as_module: If True, script is not a file on disk, but a python module
+        :param expose_port: A port to expose on the docker container
+        :param mount: A folder to mount read-only inside the container
+        :param preload: list of modules to import once, before the first run
+        :param script_args: If not None, an array of arguments to pass into the
+                            script
+        :param interval: How often, in seconds, to check for changes,
+                         when inotify can't be used
+        :returns: Result, with the container's exit code if it stopped
+                  by itself instead of with Ctrl+C
+        """
+        try:
+            dockenv_name = self._check_env(envname)
+        except DockenvError as exc:
+            return Result(envname, exit_code=1, error=str(exc))
+
+        watch_paths = []
+        if not as_module:
+            watch_paths.append(os.path.abspath(script))
+        if mount:
+            watch_paths.append(os.path.abspath(mount))
+
+        container_name = f"{dockenv_name}-watch-{uuid.uuid4().hex[:8]}"
+        with tempfile.TemporaryDirectory() as runner_dir:
+            shutil.copy(
+                os.path.join(ROOT_FOLDER, "scripts", "watch_runner.py"),
+                runner_dir)
+            target = script
+            if not as_module:
+                target = os.path.split(script)[-1]
+                # Never link, the copy is replaced each time the script changes
+                link_or_copy(
+                    script, os.path.join(runner_dir, target), allow_link=False)
+
+            args = ["docker", "run", "-i", "--rm", "--name", container_name]
+            args += ["--read-only", "-w", "/usr/src/app/runner"]
+            args += [
+                "-v", f"{get_posix_path(runner_dir)}:/usr/src/app/runner:ro"
+            ]
+            if expose_port:
+                args += ["--expose", str(expose_port)]
+            if mount:
+                src_abs = os.path.abspath(mount)
+                dest_folder = os.path.split(src_abs)[-1]
+                args += [
+                    "-v",
+                    f"{get_posix_path(src_abs)}:/usr/src/app/{dest_folder}:ro"
+                ]
+            args += [dockenv_name, "python", "-u", "./watch_runner.py"]
+            if as_module:
+                args += ["--as-module"]
+            if preload:
+                args += ["--preload", ",".join(preload)]
+            args += [target] + (script_args or [])
+
+            LOGGER.info(f"[*] Watching {', '.join(watch_paths) or script!r}, "
+                        "press Ctrl+C to stop")
+            runner = subprocess.Popen(args, stdin=subprocess.PIPE)
+            stopped = False
+            try:
+                with Watcher(watch_paths, interval) as watcher:
+                    snapshot = None
+                    changed = True
+                    while runner.poll() is None:
+                        # With inotify, only look at the files when told
+                        # something changed
+                        if changed or not watcher.uses_inotify:
+                            new_snapshot = get_watch_snapshot(watch_paths)
+                            if new_snapshot != snapshot:
+                                snapshot = new_snapshot
+                                if not as_module and os.path.exists(script):
+                                    link_or_copy(
+                                        script,
+                                        os.path.join(runner_dir, target),
+                                        allow_link=False)
+                                # The runner stops any run still going first
+                                runner.stdin.write(b"run\n")
+                                runner.stdin.flush()
+                        changed = watcher.wait()
+            except KeyboardInterrupt:
+                stopped = True
+            except BrokenPipeError:
+                LOGGER.debug(traceback.format_exc())
+            finally:
+                if runner.poll() is None:
+                    stopped = True
+                    subprocess.call(
+                        ["docker", "kill", container_name],
+                        stdout=subprocess.DEVNULL,
+                        stderr=subprocess.DEVNULL)
+                runner.wait()
+        if not stopped and runner.returncode != 0:
+            return Result(
+                envname,
+                exit_code=runner.returncode,
+                error=f"Watch container exited with code {runner.returncode}")
+        return Result(envname)
+
+    def delete(self, envname):
+        """
+        Delete a virtual environment.
+        This will remove both containers and images that match the
+        name "dockenv-<envname>"
+
+        :returns: Result
+        """
+        try:
+            dockenv_name = self._check_env(envname)
+            # First force-stop any running containers of this env. Only an
+            # exact match, so 'foo' doesn't delete 'foo-py3.8' containers
+            for container in self.client.containers.list():
+                for tag in container.image.tags:
+                    if tag.rpartition(":")[0] == dockenv_name:
+                        LOGGER.info(f"[*] deleting container {dockenv_name!r}")
+                        container.remove(force=True)
+                        break
+
+            # Then delete the image, and every version of it
+            LOGGER.info(f"[*] deleting image {dockenv_name!r}")
+            for version in self._env_versions(dockenv_name):
+                self.client.images.remove(
+                    f"{dockenv_name}:{get_version_tag(version)}", force=True)
+            self.client.images.remove(dockenv_name, force=True)
+            self.invalidate_images()
+        except (DockenvError, docker.errors.DockerException) as exc:
+            LOGGER.debug(traceback.format_exc())
+            return Result(envname, exit_code=1, error=str(exc))
+        return Result(envname)
+
+    def history(self, envname):
+        """
+        List the versions of a virtual env
+
+        :returns: Result, with 'versions' a list of dicts with 'version',
+                  'id', 'created' and 'size', oldest first, and 'current'
+                  the version 'latest' points at, or None
+        """
+        try:
+            dockenv_name = self._check_env(envname)
+            versions = self._env_versions(dockenv_name)
+            current = get_current_version(
+                versions, self.client.images.get(dockenv_name).id)
+        except (DockenvError, docker.errors.DockerException) as exc:
+            LOGGER.debug(traceback.format_exc())
+            return Result(envname, exit_code=1, error=str(exc))
+        return Result(
+            envname,
+            current=current,
+            versions=[{
+                "version": version,
+                "id": image.short_id,
+                "created": image.attrs.get("Created"),
+                "size": image.attrs.get("Size"),
+            } for version, image in versions.items()])
+
+    def rollback(self, envname, version=None):
+        """
+        Point a virtual env back at an older version. This only moves the
+        'latest' tag, so nothing is rebuilt
+
+        :param envname: The name of the env
+        :param version: The version number to roll back to. If None,
+                        the version before the current one
+        :returns: Result, with 'version' the version now in use
+        """
+        try:
+            dockenv_name = self._check_env(envname)
+            versions = self._env_versions(dockenv_name)
+            current = get_current_version(
+                versions, self.client.images.get(dockenv_name).id)
+            if version is None:
+                older = [
+                    older for older in versions
+                    if current is None or older < current
+                ]
+                if not older:
+                    raise DockenvError(
+                        f"Virtual Env {envname!r} has no older version")
+                version = max(older)
+            if version not in versions:
+                raise DockenvError(
+                    f"Virtual Env {envname!r} has no version {version}, "
+                    f"use 'dockenv history {envname}' to list them")
+            versions[version].tag(dockenv_name, "latest")
+        except (DockenvError, docker.errors.DockerException) as exc:
+            LOGGER.debug(traceback.format_exc())
+            return Result(envname, exit_code=1, error=str(exc))
+        finally:
+            self.invalidate_images()
+        LOGGER.info(f"[*] {envname!r} is now version {version}")
+        return Result(envname, version=version)
+
+    def prune(self, envname, keep=None):
+        """
+        Remove old versions of a virtual env.
+        The version in use is never removed
+
+        :param envname: The name of the env
+        :param keep: How many of the newest versions to keep.
+                     If None, use the session's 'keep_versions'
+        :returns: Result, with 'removed' the list of removed versions
+        """
+        try:
+            dockenv_name = self._check_env(envname)
+            removed = self._prune(
+                dockenv_name, self.keep_versions if keep is None else keep)
+        except (DockenvError, docker.errors.DockerException) as exc:
+            LOGGER.debug(traceback.format_exc())
+            return Result(envname, exit_code=1, error=str(exc))
+        return Result(envname, removed=removed)
+
+    def export(self, envname, filename):
+        """
+        Exports a virtual environment to a .tar file
+
+        :param envname: The name of the env to export
+        :param filename: The file to save the env to
+        :returns: Result, with 'filename' and 'size' in bytes
+        """
+        try:
+            dockenv_name = self._check_env(envname)
+            image = self.client.images.get(dockenv_name)
+            LOGGER.info(
+                f"Exporting env {envname!r}, this can take 5-10 minutes")
+            with open(filename, "wb") as fimage:
+                # The image is also tagged with its version, make sure
+                # the ':latest' tag is the one saved
+                for chunk in image.save(chunk_size=209715,
+                                        named=f"{dockenv_name}:latest"):
+                    fimage.write(chunk)
+        except (DockenvError, docker.errors.DockerException, OSError) as exc:
+            LOGGER.debug(traceback.format_exc())
+            return Result(envname, exit_code=1, error=str(exc))
+        LOGGER.info(f"Exported env {envname!r} to {filename!r}")
+        return Result(
+            envname, filename=filename, size=os.path.getsize(filename))
+
+    def import_env(self, filename):
+        """
+        Imports a virtual environment from a saved a .tar file
+
+        :param filename: The file to load the env from
+        :returns: Result, with 'envname' the name of the imported env
+        """
+        LOGGER.info(
+            f"Attempting to import from {filename!r}, this can take 5 minutes")
+        try:
+            # Stream the file, instead of reading it all into memory
+            with open(filename, "rb") as fimage:
+                image = self.client.images.load(fimage)[0]
+            self.invalidate_images()
+            # Get the new env name
+            for tag in image.tags:
+                if tag.startswith("dockenv"):
+                    envname = get_venv_name(tag)
+                    LOGGER.info(f"Imported env {envname!r}")
+                    return Result(envname, filename=filename)
+            # Wasn't a dockenv image, remove it an error out
+            self.client.images.remove(image.id)
+            self.invalidate_images()
+        except (docker.errors.DockerException, OSError) as exc:
+            LOGGER.debug(traceback.format_exc())
+            return Result(None, exit_code=1, error=str(exc))
+        return Result(
+            None,
+            exit_code=1,
+            error=f"Imported Docker image from {filename!r} wasn't a dockenv env"
+        )
+
+    def export_store(self, envnames, store):
+        """
+        Exports virtual environments into a shared OCI-layout store folder.
+        Layers already in the store, e.g. the 'python:3' base layers,
+        are only stored once
+
+        :param envnames: list of names of envs to export
+        :param store: The store folder, created if it doesn't exist
+        :returns: Result, with 'store', 'size' the bytes written, and
+                  'deduplicated' the bytes that were already in the store
+        """
+        written = deduplicated = 0
+        try:
+            for envname in envnames:
+                dockenv_name = self._check_env(envname)
+                LOGGER.info(f"[*] Exporting env {envname!r} into {store!r}")
+                env_written, env_deduplicated = export_image(
+                    store, self.client.images.get(dockenv_name),
+                    f"{dockenv_name}:latest")
+                written += env_written
+                deduplicated += env_deduplicated
+        except (DockenvError, docker.errors.DockerException, OSError,
+                ValueError) as exc:
+            LOGGER.debug(traceback.format_exc())
+            return Result(None, exit_code=1, error=str(exc))
+        LOGGER.info(f"[*] Wrote {format_size(written)}, "
+                    f"{format_size(deduplicated)} was already in the store")
+        return Result(
+            None, store=store, size=written, deduplicated=deduplicated)
+
+    def import_store(self, store, envnames=None):
+        """
+        Imports virtual environments from a store folder made by
+        'export_store', only sending the layers Docker doesn't have
+
+        :param store: The store folder
+        :param envnames: list of names of envs to import. If None,
+                         import every env in the store
+        :returns: Result, with 'envs' the names of the imported envs,
+                  'size' the bytes sent, and 'deduplicated' the bytes
+                  Docker already had
+        """
+        imported = []
+        sent = deduplicated = 0
+        try:
+            images = list_images(store)
+            if envnames is None:
+                envnames = sorted(
+                    get_venv_name(name) for name in images
+                    if name.startswith("dockenv-"))
+            daemon_chain_ids = get_daemon_chain_ids(self.client)
+            for envname in envnames:
+                image_name = f"{get_dockenv_name(envname)}:latest"
+                if image_name not in images:
+                    raise DockenvError(f"Virtual Env {envname!r} isn't in {store!r}")
+                LOGGER.info(f"[*] Importing env {envname!r} from {store!r}")
+                env_sent, env_deduplicated = import_image(
+                    self.client, store, image_name, images[image_name],
+                    daemon_chain_ids)
+                sent += env_sent
+                deduplicated += env_deduplicated
+                imported.append(envname)
+        except (DockenvError, docker.errors.DockerException, OSError,
+                ValueError) as exc:
+            LOGGER.debug(traceback.format_exc())
+            return Result(None, exit_code=1, error=str(exc), envs=imported)
+        finally:
+            self.invalidate_images()
+        LOGGER.info(f"[*] Sent {format_size(sent)}, "
+                    f"Docker already had {format_size(deduplicated)}")
+        return Result(None, envs=imported, size=sent, deduplicated=deduplicated)
+
+
+async def stream_output(stream, name, output_callback):
+    """
+    Pass everything read from a subprocess stream to a callback
+
+    :param stream: The asyncio.StreamReader to read from
+    :param name: Name of the stream, passed to the callback
+    :param output_callback: Coroutine function called with (name, text)
+    """
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    while True:
+        data = await stream.read(65536)
+        text = decoder.decode(data, final=not data)
+        if text:
+            await output_callback(name, text)
+        if not data:
+            break
+
+
+async def stop_run(process, container_name):
+    """
+    Stop a run that is still going. Killing 'docker run' doesn't stop
+    the container, so the container is removed as well
+
+    :param process: The asyncio subprocess running 'docker run'
+    :param container_name: The name of the run's container
+    """
+    with contextlib.suppress(ProcessLookupError):
+        process.kill()
+    await process.wait()
+    # Once 'docker run' is gone, it can't make the container any more
+    remover = await asyncio.create_subprocess_exec(
+        "docker",
+        "rm",
+        "--force",
+        container_name,
+        stdout=asyncio.subprocess.DEVNULL,
+        stderr=asyncio.subprocess.DEVNULL)
+    await remover.wait()
+
+
+class AsyncSession():
+    """
+    An asyncio version of Session, with the same calls as coroutines.
+    'run' and 'freeze' use asyncio subprocesses, so don't need a thread per run.
+    Other calls run the Session call in the loop's default executor.
+    """
+
+    def __init__(self, client=None, max_concurrency=None, cache_images=False):
+        """
+        :param client: A docker.DockerClient to use. If None, one is
+                       created from the environment when first needed
+        :param max_concurrency: If not None, the most scripts to run at once
+        :param cache_images: See Session
+        """
+        self.session = Session(client, cache_images=cache_images)
+        self._max_concurrency = max_concurrency
+        self._semaphore = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """
+        Close the Docker client
+        """
+        self.session.close()
+
+    async def _in_executor(self, func, *args, **kwargs):
+        """
+        Run a blocking Session call without blocking the loop
+        """
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(
+            None, functools.partial(func, *args, **kwargs))
+
+    @staticmethod
+    def _exit_when_entered(prepare, entering):
+        """
+        Clean up after a run that was cancelled while it was being set up
+
+        :param prepare: The run's Session._prepare_run context manager
+        :param entering: The finished future of its __enter__
+        """
+        if entering.cancelled() or entering.exception() is not None:
+            return
+        asyncio.get_event_loop().run_in_executor(
+            None, prepare.__exit__, None, None, None)
+
+    async def list(self):
+        """
+        See Session.list
+        """
+        return await self._in_executor(self.session.list)
+
+    async def new(self, envname, **kwargs):
+        """
+        See Session.new
+        """
+        return await self._in_executor(self.session.new, envname, **kwargs)
+
+    async def upgrade(self, envname, **kwargs):
+        """
+        See Session.upgrade
+        """
+        return await self._in_executor(self.session.upgrade, envname,
+                                       **kwargs)
+
+    async def new_matrix(self, envname, python_versions, **kwargs):
+        """
+        See Session.new_matrix
+        """
+        return await self._in_executor(self.session.new_matrix, envname,
+                                       python_versions, **kwargs)
+
+    async def run_matrix(self, envname, script, **kwargs):
+        """
+        See Session.run_matrix
+        """
+        return await self._in_executor(self.session.run_matrix, envname,
+                                       script, **kwargs)
+
+    async def delete(self, envname):
+        """
+        See Session.delete
+        """
+        return await self._in_executor(self.session.delete, envname)
+
+    async def history(self, envname):
+        """
+        See Session.history
+        """
+        return await self._in_executor(self.session.history, envname)
+
+    async def rollback(self, envname, version=None):
+        """
+        See Session.rollback
+        """
+        return await self._in_executor(self.session.rollback, envname, version)
+
+    async def prune(self, envname, keep=None):
+        """
+        See Session.prune
+        """
+        return await self._in_executor(self.session.prune, envname, keep)
+
+    async def export(self, envname, filename):
+        """
+        See Session.export
+        """
+        return await self._in_executor(self.session.export, envname, filename)
+
+    async def import_env(self, filename):
+        """
+        See Session.import_env
+        """
+        return await self._in_executor(self.session.import_env, filename)
+
+    async def export_store(self, envnames, store):
+        """
+        See Session.export_store
+        """
+        return await self._in_executor(self.session.export_store, envnames,
+                                       store)
+
+    async def import_store(self, store, envnames=None):
+        """
+        See Session.import_store
+        """
+        return await self._in_executor(self.session.import_store, store,
+                                       envnames)
+
+    async def run(self,
+                  envname,
+                  script,
+                  profile_output=None,
+                  capture_output=False,
+                  output_callback=None,
+                  **kwargs):
+        """
+        See Session.run
+
+        :param output_callback: If not None, a coroutine function called with
+                                ('stdout' or 'stderr', text) as the script
+                                writes output, instead of capturing or
+                                printing it
+        """
+        if self._max_concurrency and self._semaphore is None:
+            # Made here, so it belongs to the running loop
+            self._semaphore = asyncio.Semaphore(self._max_concurrency)
+        if self._max_concurrency:
+            await self._semaphore.acquire()
+        start = time.perf_counter()
+        container_name = f"dockenv-run-{uuid.uuid4().hex[:12]}"
+        # Setting up lists images, and can sync a cache volume, which block,
+        # so only the subprocess itself is run on the loop
+        prepare = self.session._prepare_run(  # pylint: disable=protected-access
+            envname,
+            script,
+            capture_output=capture_output or bool(output_callback),
+            container_name=container_name,
+            **kwargs)
+        try:
+            entering = asyncio.ensure_future(
+                self._in_executor(prepare.__enter__))
+            try:
+                args, profile_dir = await asyncio.shield(entering)
+            except asyncio.CancelledError:
+                # The executor carries on setting up regardless, so clean
+                # up once it's done, or the temp folders are left behind
+                entering.add_done_callback(
+                    functools.partial(self._exit_when_entered, prepare))
+                raise
+            process = None
+            try:
+                output = None
+                if capture_output or output_callback:
+                    output = asyncio.subprocess.PIPE
+                process = await asyncio.create_subprocess_exec(
+                    *args, stdout=output, stderr=output)
+                if output_callback:
+                    readers = [
+                        asyncio.ensure_future(
+                            stream_output(stream, name, output_callback))
+                        for stream, name in [(process.stdout, "stdout"),
+                                             (process.stderr, "stderr")]
+                    ]
+                    try:
+                        await asyncio.gather(*readers)
+                    finally:
+                        # If one failed, e.g. the client went away,
+                        # don't leave the other one running
+                        for reader in readers:
+                            reader.cancel()
+                    await process.wait()
+                    stdout = stderr = None
+                else:
+                    stdout, stderr = await process.communicate()
+                if capture_output and not output_callback:
+                    stdout = stdout.decode(errors="replace")
+                    stderr = stderr.decode(errors="replace")
+                return await self._in_executor(
+                    Session._run_result,  # pylint: disable=protected-access
+                    envname, process.returncode, stdout, stderr, start,
+                    profile_dir, profile_output)
+            finally:
+                # e.g. the caller was cancelled, or went away mid-output
+                if process is not None and process.returncode is None:
+                    await stop_run(process, container_name)
+                await self._in_executor(prepare.__exit__, None, None, None)
+        except (DockenvError, docker.errors.DockerException, OSError) as exc:
+            LOGGER.debug(traceback.format_exc())
+            return Result(envname, exit_code=1, error=str(exc))
+        finally:
+            if self._max_concurrency:
+                self._semaphore.release()
+
+    async def freeze(self, envname, tmpfs_size=TMPFS_SIZE):
+        """
+        See Session.freeze
+        """
+        result = await self.run(
+            envname,
+            "pip",
+            as_module=True,
+            capture_output=True,
+            tmpfs_size=tmpfs_size,
+            script_args=["--disable-pip-version-check", "freeze"])
+        result.packages = parse_freeze(result.stdout or "")
+        labels = await self._in_executor(self.session.image_labels)
+        result.imports = get_image_imports(
+            labels.get(f"{get_dockenv_name(envname)}:latest"))
+        return result
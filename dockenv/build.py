@@ -0,0 +1,188 @@
+"""
+Dockenv - Helpers to write the Dockerfiles that build envs
+"""
+import os
+import re
+
+BASE_IMAGE = "python:3"
+SLIM_IMAGE = "python:3-slim"
+USER_SCRIPT = "RUN groupadd -r dockenv && useradd -m -r -g dockenv dockenv"
+RUNNER_CMD = 'CMD [ "sh", "./runner/run.sh" ]'
+# Where 'pip install --user' puts packages for the dockenv user
+USER_PACKAGES = "/home/dockenv/.local"
+# Where shared wheels are copied to in the builder stage
+WHEELS_DEST = "/tmp/wheels"
+# Lines 'pip download' prints for every file it saved, or already had
+WHEEL_LINE = re.compile(r"^(?:Saved|File was already downloaded) (\S+)$",
+                        re.MULTILINE)
+PYTHON_VERSION = re.compile(r"^[0-9]+(\.[0-9]+)*$")
+
+
+def get_base_images(python_version=None):
+    """
+    Get the images to build an env off
+
+    :param python_version: If not None, the Python version, e.g. '3.10'
+    :returns: tuple of (standard image, slim image)
+    """
+    if python_version is None:
+        return BASE_IMAGE, SLIM_IMAGE
+    if not PYTHON_VERSION.match(python_version):
+        raise ValueError(f"Bad Python version {python_version!r}")
+    return f"python:{python_version}", f"python:{python_version}-slim"
+
+
+def get_pip_script(has_requirements,
+                   allow_nonbinary=False,
+                   extra_pip_arguments=None,
+                   wheels=False):
+    """
+    Get the Dockerfile line that installs the requirements
+
+    :param has_requirements: If True, a requirements.txt is in the context
+    :param allow_nonbinary: If False, pip will be run with '--only-binary=:all:'
+    :param extra_pip_arguments: list of extra arguments to pass to pip
+    :param wheels: If True, only install from the wheels in the context
+    """
+    pip_script = ""
+    if has_requirements:
+        pip_script = "RUN pip install --no-cache-dir --user -r requirements.txt"
+        if not allow_nonbinary:
+            pip_script += " --only-binary=:all:"
+        if wheels:
+            pip_script += f" --no-index --find-links {WHEELS_DEST}"
+
+    if extra_pip_arguments:
+        pip_script += " " + " ".join(extra_pip_arguments)
+    return pip_script
+
+
+# pylint: disable=too-many-arguments
+def get_dockerfile(dockenv_name,
+                   upgrade=False,
+                   slim=False,
+                   has_requirements=False,
+                   pip_script="",
+                   python_version=None,
+                   wheels=False):
+    """
+    Get the Dockerfile to build an env.
+    A new env is built off "python:3". An upgrade is built off the env's
+    current image. A slim env installs packages in a "python:3" builder stage,
+    which has compilers and headers, then copies only the installed packages
+    into a "python:3-slim" image.
+
+    :param dockenv_name: The Docker image name of the env
+    :param upgrade: If True, build off the env's current image
+    :param slim: If True, and not upgrading, make a slim multi-stage build
+    :param has_requirements: If True, a requirements.txt is in the context
+    :param pip_script: The Dockerfile line that installs the requirements
+    :param python_version: If not None, build off "python:<python_version>"
+    :param wheels: If True, and not upgrading, the context has a 'wheels'
+                   folder to install from. They are only copied into the
+                   builder stage, so don't end up in the env
+    """
+    base_image, slim_image = get_base_images(python_version)
+    copy_script = ""
+    if has_requirements:
+        copy_script = "COPY requirements.txt ."
+
+    # If a new env, we need to setup the user permissions
+    if upgrade:
+        base_script = f"""
+        FROM {dockenv_name}
+        USER root
+        RUN python -m pip install --upgrade pip
+        """
+    elif slim or wheels:
+        if wheels:
+            copy_script += f"\nCOPY wheels {WHEELS_DEST}"
+        runtime_image = slim_image if slim else base_image
+        base_script = f"""
+        FROM {base_image} AS builder
+        RUN python -m pip install --upgrade pip
+        {USER_SCRIPT}
+        USER dockenv
+        WORKDIR /usr/src/app
+        {copy_script}
+        RUN mkdir -p {USER_PACKAGES}
+        {pip_script}
+
+        FROM {runtime_image}
+        LABEL dockenv.slim="{str(slim).lower()}"
+        {USER_SCRIPT}
+        COPY --from=builder --chown=dockenv:dockenv {USER_PACKAGES} {USER_PACKAGES}
+        USER dockenv
+        WORKDIR /usr/src/app
+        """
+        # Packages were installed for the builder's Python, so fail now,
+        # not when a script runs, if the two images have different versions
+        check_script = ""
+        if slim and has_requirements:
+            check_script = (
+                "RUN python -c \"import os, site, sys; "
+                "sys.exit(not os.path.isdir(site.getusersitepackages()) and "
+                f"'{base_image} and {slim_image} have different Python versions, "
+                "pull both to update them')\"")
+        return f"""
+        {base_script}
+        {check_script}
+        {RUNNER_CMD}
+        """
+    else:
+        base_script = f"""
+        FROM {base_image}
+        RUN python -m pip install --upgrade pip
+        {USER_SCRIPT}
+        """
+
+    return f"""
+    {base_script}
+    USER dockenv
+    WORKDIR /usr/src/app
+    {copy_script}
+    {pip_script}
+    {RUNNER_CMD}
+    """
+
+
+def download_wheels(client, requirements, python_versions, wheel_folder):
+    """
+    Download the wheels every Python version needs into one folder.
+    Wheels that work on every version, e.g. pure Python packages, are only
+    downloaded once. 'pip download' runs inside a container of each version,
+    so environment markers like 'python_version < "3.11"' match the
+    Python the env is built with
+
+    :param client: The docker.DockerClient to use
+    :param requirements: The bytes of the requirements.txt
+    :param python_versions: list of Python versions, e.g. ['3.8', '3.10']
+    :param wheel_folder: The folder to download into
+    :returns: dict of Python version to list of wheel paths
+    """
+    with open(os.path.join(wheel_folder, "requirements.txt"), "wb") as freqs:
+        freqs.write(requirements)
+    # Files in the folder should belong to us, not root
+    user = None
+    if hasattr(os, "getuid"):
+        user = f"{os.getuid()}:{os.getgid()}"
+
+    wheels = {}
+    for python_version in python_versions:
+        output = client.containers.run(
+            get_base_images(python_version)[0], [
+                "pip", "download", "--no-cache-dir", "--only-binary=:all:",
+                "-d", "/wheels", "-r", "/wheels/requirements.txt"
+            ],
+            volumes={wheel_folder: {
+                "bind": "/wheels",
+                "mode": "rw"
+            }},
+            user=user,
+            environment={"HOME": "/tmp"},
+            remove=True)
+        wheels[python_version] = sorted({
+            os.path.join(wheel_folder, os.path.basename(path))
+            for path in WHEEL_LINE.findall(output.decode(errors="replace"))
+        })
+    return wheels
@@ -0,0 +1,179 @@
+"""
+Dockenv - Helpers to assemble the files sent to, or mounted into, containers
+"""
+import os
+import io
+import shutil
+import hashlib
+import tarfile
+import tempfile
+
+CACHE_FOLDER = os.path.join(os.path.expanduser("~"), ".cache", "dockenv")
+CONTEXT_FOLDER = os.path.join(CACHE_FOLDER, "contexts")
+# Number of built context tarballs to keep around
+CONTEXT_CACHE_SIZE = 32
+CHUNK_SIZE = 1024 * 1024
+
+# Digests of files we've already hashed, keyed by path and stat info
+# so a file that hasn't changed isn't read again
+_DIGEST_CACHE = {}
+
+
+def file_digest(path):
+    """
+    Get the sha256 of a file on disk, reading it in chunks
+
+    :param path: The file to hash
+    :returns: The hex digest of the file's contents
+    """
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_ino, stat.st_size, stat.st_mtime_ns)
+    if key in _DIGEST_CACHE:
+        return _DIGEST_CACHE[key]
+
+    digest = hashlib.sha256()
+    with open(path, "rb") as fdata:
+        for chunk in iter(lambda: fdata.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+    _DIGEST_CACHE[key] = digest.hexdigest()
+    return _DIGEST_CACHE[key]
+
+
+def link_or_copy(src, dest, allow_link=True):
+    """
+    Place a file at 'dest' as cheaply as possible.
+    If 'dest' already has the same contents nothing is done. Otherwise we try
+    to hardlink, then to let the kernel clone the file (reflink on filesystems
+    that support it), and finally fall back to a normal copy.
+
+    Only allow a link if the destination will never be written to, as
+    writing through a hardlink would change the user's original file.
+
+    :param src: The file to place
+    :param dest: The path to place the file at
+    :param allow_link: If False, never hardlink, always get a separate copy
+    """
+    if os.path.exists(dest):
+        if file_digest(src) == file_digest(dest):
+            return
+        os.remove(dest)
+
+    if allow_link:
+        try:
+            os.link(src, dest)
+            return
+        except OSError:
+            # Different filesystems, or filesystem doesn't support links
+            pass
+
+    # copy_file_range lets the kernel reflink or copy without going
+    # through userspace, but is only on Linux and Python >= 3.8
+    if hasattr(os, "copy_file_range"):
+        try:
+            with open(src, "rb") as fsrc, open(dest, "wb") as fdest:
+                remaining = os.fstat(fsrc.fileno()).st_size
+                while remaining > 0:
+                    copied = os.copy_file_range(fsrc.fileno(), fdest.fileno(),
+                                                remaining)
+                    if copied == 0:
+                        break
+                    remaining -= copied
+            if remaining == 0:
+                shutil.copymode(src, dest)
+                return
+        except OSError:
+            pass
+    shutil.copy(src, dest)
+
+
+def context_digest(files):
+    """
+    Get a digest that identifies a build context
+
+    :param files: dict of filename inside the context to either
+                  the bytes of the file, or a path to the file on disk
+    :returns: The hex digest of the context
+    """
+    digest = hashlib.sha256()
+    for name in sorted(files):
+        content = files[name]
+        if isinstance(content, bytes):
+            content_digest = hashlib.sha256(content).hexdigest()
+        else:
+            content_digest = file_digest(content)
+        digest.update(f"{name}\0{content_digest}\0".encode())
+    return digest.hexdigest()
+
+
+def write_context_tar(files, fileobj):
+    """
+    Write a build context as a tar stream.
+    The tar is reproducible: entries are sorted and all metadata is fixed,
+    so the same files always give the same bytes.
+
+    :param files: dict of filename inside the context to either
+                  the bytes of the file, or a path to the file on disk
+    :param fileobj: The file object to write the tar to
+    """
+    with tarfile.open(fileobj=fileobj, mode="w") as tar:
+        for name in sorted(files):
+            content = files[name]
+            info = tarfile.TarInfo(name)
+            info.mode = 0o644
+            if isinstance(content, bytes):
+                info.size = len(content)
+                tar.addfile(info, io.BytesIO(content))
+            else:
+                info.size = os.path.getsize(content)
+                with open(content, "rb") as fcontent:
+                    tar.addfile(info, fcontent)
+
+
+def prune_context_cache(cache_folder=CONTEXT_FOLDER,
+                        keep=CONTEXT_CACHE_SIZE):
+    """
+    Remove the least recently used context tarballs from the cache
+
+    :param cache_folder: The folder the tarballs are stored in
+    :param keep: How many tarballs to keep
+    """
+    tarballs = [
+        os.path.join(cache_folder, fname) for fname in os.listdir(cache_folder)
+        if fname.endswith(".tar")
+    ]
+    tarballs.sort(key=os.path.getmtime, reverse=True)
+    for tarball in tarballs[keep:]:
+        try:
+            os.remove(tarball)
+        except OSError:
+            pass
+
+
+def get_context_tar(files, cache_folder=CONTEXT_FOLDER):
+    """
+    Get the path to a tarball of a build context, only building it if
+    the same context hasn't already been built
+
+    :param files: dict of filename inside the context to either
+                  the bytes of the file, or a path to the file on disk
+    :param cache_folder: The folder to store the tarballs in
+    :returns: The path to the tarball
+    """
+    os.makedirs(cache_folder, exist_ok=True)
+    tar_path = os.path.join(cache_folder, f"{context_digest(files)}.tar")
+    if os.path.exists(tar_path):
+        # Mark as recently used
+        os.utime(tar_path)
+        return tar_path
+
+    # Write to a temp file first, so a half-written tar is never used
+    fd, tmp_path = tempfile.mkstemp(dir=cache_folder, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as ftar:
+            write_context_tar(files, ftar)
+        os.replace(tmp_path, tar_path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    prune_context_cache(cache_folder)
+    return tar_path
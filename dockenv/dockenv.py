@@ -1,51 +1,22 @@
 """
-Dockenv - Run untrusted python in Docker
+Dockenv - Run untrusted python in Docker.
+This is the cli, all the work is done by the Session in 'api.py'
 """
 import argparse
-import os
 import sys
-import shutil
-import tempfile
-import subprocess
 import logging
-import traceback
-import shlex
-import docker
+from .api import Session, TMPFS_SIZE, format_size, get_dockenv_name
+from .imports import get_slowest
+from .versions import parse_version
+from .service import (Service, ServiceClient, SOCKET_PATH, ping,
+                      service_supported)
 
-ROOT_FOLDER = os.path.abspath(os.path.dirname(__file__))
-CLIENT = docker.from_env()
-
-LOGGER = logging.getLogger(__name__)
+LOGGER = logging.getLogger("dockenv")
 LOGGER.setLevel(logging.INFO)
 LOGGER.addHandler(logging.StreamHandler())
 
-
-def get_posix_path(path):
-    """
-    If on Windows, convert a windows path to POSIX
-    """
-    if os.name != "nt":
-        return path
-    split = os.path.splitdrive(path)
-    drive = split[0].replace(":", "").lower()
-    posix_path = "/" + drive + split[1].replace("\\", "/")
-    return posix_path
-
-
-def get_venv_name(dockenv_name):
-    """
-    Helper function to split the user-defined virtual env name
-    out of the full name that includes the dockenv tag
-
-    :param dockenv_name: The full name to pull the virtual env name
-                         out of
-    """
-    # Format of tage name if dockenv-**NAME**:latest
-    venv_start = len("dockenv-")
-    if dockenv_name.endswith(":latest"):
-        venv_end = len(":latest") * -1
-        return dockenv_name[venv_start:venv_end]
-    return dockenv_name[venv_start:]
+# One session, so one Docker client, for the whole cli
+SESSION = Session()
 
 
 def local_image_exists(image_name, tagname="latest"):
@@ -53,222 +24,146 @@ def local_image_exists(image_name, tagname="latest"):
     Check if we already have an image stored locally.
 
     :param tagname: The particular tag of the image to get. defaults to 'latest'
-    :returns: The Docker container object that matches the name if it
-              exists locally, otherwise None.
+    :returns: True if the image exists locally
     """
-    for image in CLIENT.images.list():
-        for tag in image.tags:
-            if tag == f"{image_name}:{tagname}":
-                return True
-    return False
+    return SESSION.image_exists(image_name, tagname=tagname)
 
 
 def get_local_container(venv_name, tagname="latest"):
     """
     Get a Docker container object, but only if we have it locally.
-    The Docker API will attempt to call out to the remote registry if we
-    do not have the container localy.
-
-    However as Dockenv only operates on the local
-    level, calling out to a remote site is reduntant at best, and a potential security
-    risk at worst, as the name may contain sensitive information, and would open
-    the user to an attack where a malicious user uploads their own container matching
-    the name to the registry.
+    See Session.get_local_container
 
     :param venv_name: The name of the container to attempt to get.
     :param tagname: The particular tag of the image to get. defaults to 'latest'
     :returns: The Docker container object that matches the name if it
               exists locally, otherwise None.
     """
-    if local_image_exists(venv_name, tagname=tagname):
-        return CLIENT.containers.get(venv_name)
-    return None
-
-
-# pylint: disable=too-many-arguments, too-many-locals
-# pylint: disable=too-many-branches, too-many-statements
-def run_script(dockenv_name,
-               script,
-               as_module=False,
-               expose_port=None,
-               mount=None,
-               write_filesystem=False,
-               write_mount=False,
-               script_args=None):
-    """
-    Run a script inside a virtual env. This will build the new image that includes
-    the the script file. It will then run the script passing in the args
-
-    :param dockenv_name: The full name of the image to create
-    :param script_path: The path to the script file to run
-    :param as_module: If True, script is not a file on disk, but a python module
-                      to run with 'python -m'
-    :param expose_port: A port to expose on the docker container, so the host can
-                        connect to it
-    :param mount: A folder to mount inside the container. This can be used to pass
-                  in config files or other data to the script to read
-    :param write_filesystem: If True, allow script to write to conainer's filesystem
-    :param write_mount: If True, allow script to write to the mounted folder
-    :param script_args: If not None, an array of arguments to pass into the script
-    """
-    # Check venv exists:
-    if not local_image_exists(dockenv_name):
-        venv_name = get_venv_name(dockenv_name)
-        LOGGER.error(f"ERROR: {venv_name!r} doesn't exist")
-        return
-
-    if as_module:
-        cmd = ["-m", f"{script}"]
-    else:
-        cmd = [f"./{os.path.split(script)[-1]}"]
-
-    if script_args:
-        cmd += script_args
-    cmd_quoted = " ".join(shlex.quote(x) for x in cmd)
-
-    expose_script = ""
-    if expose_port:
-        expose_script = f"echo [***] Exposed port: $(hostname -i):{expose_port} [***]"
-
-    runner_script = f"""
-    {expose_script}
-    cd ./runner
-    python {cmd_quoted}
-    """
-
-    with tempfile.TemporaryDirectory() as runner_dir:
-        if not as_module:
-            shutil.copy(script, runner_dir)
-        with open(
-                os.path.join(runner_dir, "run.sh"), "w",
-                newline="\n") as frunner:
-            frunner.write(runner_script)
-
-        # Create new container to run, mounting our temp dir into it
-        try:
-            args = ["docker", "run", "-ti", "--rm"]
-            # mount temp dir into container
-            vol_cmd = f"{get_posix_path(runner_dir)}:/usr/src/app/runner"
-            if write_filesystem:
-                args += ["-v", vol_cmd]
-            else:
-                args += ["-v", f"{vol_cmd}:ro"]
-                args += ["--read-only"]
-
-            if expose_port:
-                args += ["--expose", expose_port]
-
-            if mount:
-                src_abs = os.path.abspath(mount)
-                dest_folder = os.path.split(src_abs)[-1]
-                args += ["-v"]
-                mount_cmd = f"{get_posix_path(src_abs)}:/usr/src/app/{dest_folder}"
-                if write_mount:
-                    args += [mount_cmd]
-                else:
-                    args += [f"{mount_cmd}:ro"]
-            args += [dockenv_name]
-            subprocess.check_call(args)
-        except subprocess.CalledProcessError:
-            # As long as docker is installed, this is just the same
-            # amout of information that is printed out by the running container
-            LOGGER.debug(traceback.format_exc())
-            LOGGER.error("\nERROR: Script completed with error! "
-                         "Use 'dockenv --verbose run' to get more info")
-
-
-def build_venv(args, upgrade=False):
-    """
-    Create a new virtual env or upgrade an existing one.
-    If new, this will build a Docker image based on the "Python:3" image,
-    and our Image will be named named "dockenv-<envname>".
-    If upgrading, we will build from a base image of the same name
-
-    :param args: cli args
-    :param upgrade: If True, base image will be the same dockenv image.
-                    If False, base image will be "python:3"
-    """
-    dockenv_name = f"dockenv-{args.envname}"
-
-    image_exists = local_image_exists(dockenv_name)
-    # Check if either upgrading and image is missing,
-    # or if creating new and image already exists
-    if (not upgrade) and image_exists:
-        LOGGER.error(f"ERROR: Virtual Env {args.envname!r} already exists! "
-                     "Use 'dockenv delete' or 'dockenv run'")
-        return
-    if upgrade and (not image_exists):
-        LOGGER.error(f"ERROR: Virtual Env {args.envname!r} doesn't exist! ")
-        return
-
-    if args.package and args.requirements:
-        LOGGER.error(f"ERROR: Use only one of '--package' or '--requirements'")
-        return
-
-    # If a new env, we need to setup the user permissions
-    if upgrade:
-        base_script = f"""
-        FROM {dockenv_name}
-        USER root
-        RUN python -m pip install --upgrade pip
-        """
-    else:
-        base_script = """
-        FROM python:3
-        RUN python -m pip install --upgrade pip
-        RUN groupadd -r dockenv && useradd -m -r -g dockenv dockenv
-        """
-
-    pip_script = ""
-    if args.requirements or args.package:
-        pip_script = "RUN pip install --no-cache-dir --user -r requirements.txt"
-        if not args.allow_nonbinary:
-            pip_script += " --only-binary=:all:"
-
-    if args.extra_pip_arguments:
-        pip_script += " " + " ".join(args.extra_pip_arguments)
-
-    dockerfile = f"""
-    {base_script}
-    USER dockenv
-    WORKDIR /usr/src/app
-    COPY . .
-    {pip_script}
-    CMD [ "sh", "./runner/run.sh" ]
-    """
-
-    # Put everything inside a temp directory
-    with tempfile.TemporaryDirectory() as build_dir:
-        # copy required files
-        with open(os.path.join(build_dir, "Dockerfile"), "w") as fdockerfile:
-            fdockerfile.write(dockerfile)
-
-        # Copy any optional files
-        if args.requirements is not None:
-            shutil.copy(args.requirements,
-                        os.path.join(build_dir, "requirements.txt"))
-
-        if args.package is not None:
-            with open(os.path.join(build_dir, "requirements.txt"),
-                      "w") as fpackage:
-                fpackage.write(args.package)
-
-        # It takes a while to build the base Python3 image if we haven't already
-        if not local_image_exists("python", tagname="3"):
-            LOGGER.info(
-                f"[*] First time using dockenv, may take some extra time")
-
-        # Build the container
-        LOGGER.info(f"[*] building virtual env {dockenv_name!r}...")
-        # NOTE: I didn't see how to get 'CLIENT.images.build'
-        # to actually print what it is doing, leading this to "hang" with no output
-        # Switched to calling subprocess so user gets feedback on whats going on
-        if args.verbose:
-            subprocess.check_call(
-                ["docker", "build", "-t", dockenv_name, build_dir])
+    return SESSION.get_local_container(venv_name, tagname=tagname)
+
+
+def get_session(args):
+    """
+    Get what to send a command to: the dockenv service if it's running,
+    otherwise our own Session
+
+    :param args: cli arguments
+    """
+    if args.no_service or args.verbose:
+        return SESSION
+    if ping(SOCKET_PATH):
+        LOGGER.debug(f"[*] Using dockenv service on {SOCKET_PATH!r}")
+        return ServiceClient(SOCKET_PATH)
+    return SESSION
+
+
+def log_result(result):
+    """
+    Print the error of a failed Session call
+
+    :param result: The Result of the call
+    :returns: The exit code to exit the cli with
+    """
+    if result.error:
+        LOGGER.error(f"ERROR: {result.error}")
+    return result.exit_code
+
+
+def log_matrix(result):
+    """
+    Print the output of every Python version of a 'run --matrix',
+    then their exit codes and timings side by side
+
+    :param result: The Result of Session.run_matrix
+    :returns: The exit code to exit the cli with
+    """
+    if result.error:
+        return log_result(result)
+    for python_version, run in result.versions.items():
+        LOGGER.info(f"[*] ----- Python {python_version} -----")
+        if run["error"]:
+            LOGGER.error(f"ERROR: {run['error']}")
+        if run.get("stdout"):
+            sys.stdout.write(run["stdout"])
+        if run.get("stderr"):
+            sys.stderr.write(run["stderr"])
+        if run.get("profile"):
+            LOGGER.info(run["profile"])
+    LOGGER.info(f"[*] {'python':10} {'exit code':>10} {'time':>10}")
+    for python_version, run in result.versions.items():
+        duration = run.get("duration")
+        duration = f"{duration:.2f}s" if duration is not None else "-"
+        LOGGER.info(
+            f"[*] {python_version:10} {run['exit_code']:>10} {duration:>10}")
+    return result.exit_code
+
+
+def get_build_kwargs(args):
+    """
+    Get the arguments for Session.new or Session.upgrade
+
+    :param args: cli arguments
+    """
+    return dict(
+        requirements=args.requirements,
+        package=args.package,
+        allow_nonbinary=args.allow_nonbinary,
+        extra_pip_arguments=args.extra_pip_arguments,
+        import_profile=args.import_profile,
+        verbose=args.verbose)
+
+
+def log_imports(profile, top=None):
+    """
+    Print the slowest imports of an env
+
+    :param profile: The env's import profile
+    :param top: If not None, how many imports to print
+    """
+    for module, stats in get_slowest(profile, top):
+        if "error" in stats:
+            LOGGER.info(f"  {module:30} failed to import: {stats['error']}")
         else:
-            CLIENT.images.build(tag=dockenv_name, path=build_dir)
-        LOGGER.info(f"[*] built virtual env {dockenv_name!r}")
+            LOGGER.info(f"  {module:30} {stats['ms']:9.1f} ms "
+                        f"{stats['kb'] / 1024:9.1f} MB")
+
+
+def log_build(result):
+    """
+    Print the import times, and any import regressions, of a built env
+
+    :param result: The Result of Session.new or Session.upgrade
+    :returns: The exit code to exit the cli with
+    """
+    if result.imports:
+        LOGGER.info("[*] Slowest imports:")
+        log_imports(result.imports, top=5)
+    for regression in result.import_regressions or []:
+        (old_ms, new_ms), (old_kb, new_kb) = regression["ms"], regression["kb"]
+        LOGGER.warning(f"WARNING: {regression['module']!r} got slower to "
+                       f"import: {old_ms:.1f} ms -> {new_ms:.1f} ms, "
+                       f"{old_kb / 1024:.1f} MB -> {new_kb / 1024:.1f} MB")
+    return log_result(result)
+
+
+def add_tmpfs_arguments(parser):
+    """
+    Add the arguments to mount in-memory scratch folders to a parser
+
+    :param parser: The argparse parser to add them to
+    """
+    parser.add_argument(
+        "-tf",
+        "--tmpfs",
+        dest="tmpfs_size",
+        help="Mount an in-memory /tmp that can hold this much, e.g. '64m', "
+        "even though the env's filesystem is read-only")
+    parser.add_argument(
+        "-sd",
+        "--scratch-dir",
+        dest="scratch_dir",
+        help="Also mount an in-memory scratch folder at this path inside "
+        f"the container, e.g. '/scratch'. Uses --tmpfs size, or {TMPFS_SIZE}")
 
 
 def func_new_venv(args):
@@ -278,7 +173,25 @@ def func_new_venv(args):
 
     :param args: cli arguments
     """
-    build_venv(args, upgrade=False)
+    if args.python:
+        python_versions = [
+            version.strip() for version in args.python.split(",")
+            if version.strip()
+        ]
+        result = SESSION.new_matrix(
+            args.envname,
+            python_versions,
+            slim=args.slim,
+            **get_build_kwargs(args))
+        for python_version, version_result in getattr(
+                result, "versions", {}).items():
+            status = "ok" if version_result["exit_code"] == 0 else "FAILED"
+            LOGGER.info(f"[*] Python {python_version}: "
+                        f"{version_result['envname']!r} {status}")
+        return log_result(result)
+    return log_build(
+        get_session(args).new(
+            args.envname, slim=args.slim, **get_build_kwargs(args)))
 
 
 def func_upgrade_venv(args):
@@ -288,7 +201,8 @@ def func_upgrade_venv(args):
 
     :param args: cli arguments
     """
-    build_venv(args, upgrade=True)
+    return log_build(
+        get_session(args).upgrade(args.envname, **get_build_kwargs(args)))
 
 
 def func_run_script(args):
@@ -298,17 +212,58 @@ def func_run_script(args):
 
     :param args: cli arguments
     """
-    # Create a new container on top of the virtual env image
-    dockenv_name = f"dockenv-{args.envname}"
-    run_script(
-        dockenv_name,
-        args.script,
+    run_kwargs = dict(
         as_module=args.as_module,
         expose_port=args.port,
         mount=args.mount,
         write_mount=args.write_mount,
         write_filesystem=args.write_filesystem,
+        cache_mount=args.cache_mount,
+        tmpfs_size=args.tmpfs_size,
+        scratch_dir=args.scratch_dir,
+        profile=args.profiler if args.profile else None,
+        profile_top=args.profile_top,
+        profile_output=args.profile_output,
         script_args=args.arguments)
+    if args.matrix:
+        return log_matrix(SESSION.run_matrix(args.envname, args.script,
+                                             **run_kwargs))
+    # The service can't pass on our terminal, so a script run from one
+    # might want to read from it, e.g. input() or pdb
+    session = SESSION if sys.stdin.isatty() else get_session(args)
+    # Create a new container on top of the virtual env image
+    result = session.run(args.envname, args.script, **run_kwargs)
+    if result.error:
+        return log_result(result)
+    if result.profile:
+        LOGGER.info(result.profile)
+    if result.exit_code != 0:
+        # As long as docker is installed, this is just the same
+        # amout of information that is printed out by the running container
+        LOGGER.error("\nERROR: Script completed with error! "
+                     "Use 'dockenv --verbose run' to get more info")
+    return result.exit_code
+
+
+def func_watch_script(args):
+    """
+    Run a script inside a virtual env, re-running it every time the
+    script or mounted folder changes
+
+    :param args: cli arguments
+    """
+    preload = None
+    if args.preload:
+        preload = args.preload.split(",")
+    return log_result(
+        SESSION.watch(
+            args.envname,
+            args.script,
+            as_module=args.as_module,
+            expose_port=args.port,
+            mount=args.mount,
+            preload=preload,
+            script_args=args.arguments))
 
 
 def func_run_shell(args):
@@ -318,23 +273,18 @@ def func_run_shell(args):
 
     :param args: cli arguments
     """
-    dockenv_name = f"dockenv-{args.envname}"
-    with tempfile.TemporaryDirectory() as runner_dir:
-        shell_fname = os.path.join(runner_dir, "shell.py")
-        with open(shell_fname, "w", newline="\n") as fshell:
-            fshell.write("import pty; pty.spawn('/bin/bash')")
-        LOGGER.info(f"[*] Starting shell in {dockenv_name!r}")
-        LOGGER.info(
-            f"[*] NOTE: ANYTHING you do inside the container will be blown")
-        LOGGER.info(f"[*] away once you quit. This is only for debugging!")
-        # As this is for debugging, we'll always run with a writable filesystem
-        run_script(
-            dockenv_name,
-            shell_fname,
+    dockenv_name = get_dockenv_name(args.envname)
+    LOGGER.info(f"[*] Starting shell in {dockenv_name!r}")
+    LOGGER.info(f"[*] NOTE: ANYTHING you do inside the container will be blown")
+    LOGGER.info(f"[*] away once you quit. This is only for debugging!")
+    return log_result(
+        SESSION.shell(
+            args.envname,
             expose_port=args.port,
             mount=args.mount,
-            write_mount=True,
-            write_filesystem=True)
+            read_only=args.read_only,
+            tmpfs_size=args.tmpfs_size,
+            scratch_dir=args.scratch_dir))
 
 
 # pylint: disable=W0613
@@ -345,31 +295,40 @@ def func_list_venv(args):
 
     :param args: cli arguments, ignored.
     """
+    result = get_session(args).list()
     LOGGER.info("Dockenv virtual envs:")
-    for image in CLIENT.images.list():
-        for tag in image.tags:
-            if tag.startswith("dockenv"):
-                venv_name = get_venv_name(tag)
-                LOGGER.info(f"  {venv_name}")
+    imports = result.imports or {}
+    for venv_name in result.envs or []:
+        slowest = get_slowest(imports.get(venv_name), top=1)
+        if slowest and "ms" in slowest[0][1]:
+            module, stats = slowest[0]
+            LOGGER.info(f"  {venv_name:30} slowest import: {module} "
+                        f"{stats['ms']:.1f} ms")
+        else:
+            LOGGER.info(f"  {venv_name}")
+    return log_result(result)
 
 
 def func_run_freeze(args):
     """
-    This will call "dockenv run" calling a special script that
-    will run "pip freeze" inside the container.
+    Run "pip freeze" inside the container, listing the installed packages.
     Like "dockenv run" this will create a container based on an
     image named "dockenv-<envname>"
 
     :param args: cli arguments
     """
-    dockenv_name = f"dockenv-{args.envname}"
-    with tempfile.TemporaryDirectory() as runner_dir:
-        freeze_fname = os.path.join(runner_dir, "freeze.py")
-        with open(freeze_fname, "w", newline="\n") as ffreeze:
-            ffreeze.write(
-                "import subprocess; subprocess.run('pip freeze', shell=True)")
-        # Pip freeze needs write access to the container's /tmp for some reason...
-        run_script(dockenv_name, freeze_fname, write_filesystem=True)
+    result = SESSION.freeze(args.envname, tmpfs_size=args.tmpfs_size)
+    for package in result.packages:
+        LOGGER.info(package)
+    if result.imports:
+        LOGGER.info("\nImport times:")
+        log_imports(result.imports)
+    if result.stderr:
+        if result.exit_code != 0:
+            LOGGER.error(result.stderr)
+        else:
+            LOGGER.debug(result.stderr)
+    return log_result(result)
 
 
 def func_delete_venv(args):
@@ -380,44 +339,57 @@ def func_delete_venv(args):
 
     :param args: cli arguments
     """
-    dockenv_name = f"dockenv-{args.envname}"
+    return log_result(SESSION.delete(args.envname))
 
-    # Check env exists:
-    if not local_image_exists(dockenv_name):
-        LOGGER.error(f"ERROR: Virtual Env {args.envname!r} doesn't exist")
-        return
 
-    # First force-stop any running containers that start with venv_name
-    for container in CLIENT.containers.list():
-        for tag in container.image.tags:
-            if tag.startswith(dockenv_name):
-                LOGGER.info(f"[*] deleting container {dockenv_name!r}")
-                container.remove(force=True)
+def func_history_venv(args):
+    """
+    List the versions of a virtual env
 
-    # Then delete the image
-    LOGGER.info(f"[*] deleting image {dockenv_name!r}")
-    CLIENT.images.remove(dockenv_name, force=True)
+    :param args: cli arguments
+    """
+    result = SESSION.history(args.envname)
+    if result.ok:
+        LOGGER.info(f"{'version':>8} {'id':14} {'created':20} {'size':>10}")
+        for version in reversed(result.versions or []):
+            created = (version["created"] or "")[:19].replace("T", " ")
+            current = " <- latest" if version["version"] == result.current else ""
+            LOGGER.info(f"{version['version']:>8} {version['id'][7:]:14} "
+                        f"{created:20} {format_size(version['size']):>10}"
+                        f"{current}")
+    return log_result(result)
 
 
-def func_export_venv(args):
+def func_rollback_venv(args):
     """
-    Exports a virtual environment to a .tar file
+    Point a virtual env back at an older version, without rebuilding
+
+    :param args: cli arguments
+    """
+    try:
+        version = parse_version(args.version) if args.version else None
+    except ValueError as exc:
+        LOGGER.error(f"ERROR: {exc}")
+        return 1
+    return log_result(SESSION.rollback(args.envname, version))
+
+
+def func_prune_venv(args):
+    """
+    Remove old versions of a virtual env
 
     :param args: cli arguments
     """
-    dockenv_name = f"dockenv-{args.envname}"
+    return log_result(SESSION.prune(args.envname, args.keep))
+
 
-    # Check env exists:
-    if not local_image_exists(dockenv_name):
-        LOGGER.error(f"ERROR: Virtual Env {args.envname!r} doesn't exist")
-        return
+def func_export_venv(args):
+    """
+    Exports a virtual environment to a .tar file
 
-    image = CLIENT.images.get(dockenv_name)
-    LOGGER.info(f"Exporting env {args.envname!r}, this can take 5-10 minutes")
-    with open(args.filename, "wb") as fimage:
-        for chunk in image.save(chunk_size=209715, named=True):
-            fimage.write(chunk)
-    LOGGER.info(f"Exported env {args.envname!r} to {args.filename!r}")
+    :param args: cli arguments
+    """
+    return log_result(SESSION.export(args.envname, args.filename))
 
 
 def func_import_venv(args):
@@ -426,22 +398,43 @@ def func_import_venv(args):
 
     :param args: cli arguments
     """
-    LOGGER.info(
-        f"Attempting to import from {args.filename!r}, this can take 5 minutes"
-    )
-    with open(args.filename, "rb") as fimage:
-        image = CLIENT.images.load(fimage.read())[0]
-    # Get the new env name
-    for tag in image.tags:
-        if tag.startswith("dockenv"):
-            LOGGER.info(f"Imported env {get_venv_name(tag)!r}")
-            break
-    else:
-        # Wasn't a dockenv image, remove it an error out
-        CLIENT.images.remove(image.id)
-        LOGGER.error(
-            "Imported Docker image from {args.filename!r} wasn'y a dockenv env"
-        )
+    return log_result(SESSION.import_env(args.filename))
+
+
+def func_export_store(args):
+    """
+    Exports virtual environments into a shared store folder
+
+    :param args: cli arguments
+    """
+    return log_result(SESSION.export_store(args.envnames, args.store))
+
+
+def func_import_store(args):
+    """
+    Imports virtual environments from a store folder
+
+    :param args: cli arguments
+    """
+    return log_result(SESSION.import_store(args.store, args.envnames or None))
+
+
+def func_serve(args):
+    """
+    Run the dockenv service, until stopped with Ctrl+C
+
+    :param args: cli arguments
+    """
+    if not service_supported():
+        LOGGER.error("ERROR: The dockenv service needs Unix sockets")
+        return 1
+    service = Service(max_runs=args.max_runs, max_builds=args.max_builds)
+    try:
+        service.serve(args.socket)
+    except OSError as exc:
+        LOGGER.error(f"ERROR: {exc}")
+        return 1
+    return 0
 
 
 def main():
@@ -451,6 +444,12 @@ def main():
     parser = argparse.ArgumentParser(description="Run python inside docker")
     parser.add_argument(
         "-v", "--verbose", action="store_true", help="print verbose output")
+    parser.add_argument(
+        "-ns",
+        "--no-service",
+        action="store_true",
+        dest="no_service",
+        help="Don't use the dockenv service, even if it's running")
     subparsers = parser.add_subparsers(help="options")
 
     # --- New virtual Env ---
@@ -467,6 +466,24 @@ def main():
         action="store_true",
         dest="allow_nonbinary",
         help="If not set, pip will be run with '--only-binary=:all:'")
+    new_parser.add_argument(
+        "-ip",
+        "--import-profile",
+        action="store_true",
+        dest="import_profile",
+        help=("Measure how long importing each installed package takes, "
+              "and store it with the env"))
+    new_parser.add_argument(
+        "-sl",
+        "--slim",
+        action="store_true",
+        help=("Install packages in a builder stage, and copy them into a "
+              "smaller 'python:3-slim' image"))
+    new_parser.add_argument(
+        "-py",
+        "--python",
+        help=("Comma-separated list of Python versions, e.g. '3.8,3.12'. "
+              "Builds an env named '<envname>-py<version>' for each, at once"))
     new_parser.add_argument(
         "extra_pip_arguments",
         nargs=argparse.REMAINDER,
@@ -490,6 +507,13 @@ def main():
         action="store_true",
         dest="allow_nonbinary",
         help="If not set, pip will be run with '--only-binary=:all:'")
+    upgrade_parser.add_argument(
+        "-ip",
+        "--import-profile",
+        action="store_true",
+        dest="import_profile",
+        help=("Measure how long importing each installed package takes, "
+              "and store it with the env"))
     upgrade_parser.add_argument(
         "extra_pip_arguments",
         nargs=argparse.REMAINDER,
@@ -526,18 +550,93 @@ def main():
         action="store_true",
         dest="write_mount",
         help="Allow script to write data into the mount")
+    run_parser.add_argument(
+        "-cm",
+        "--cache-mount",
+        action="store_true",
+        dest="cache_mount",
+        help=("Copy the mount into a cached Docker volume, only sending files "
+              "that changed. Faster reads on slow bind mounts"))
+    run_parser.add_argument(
+        "-pr",
+        "--profile",
+        action="store_true",
+        help="Run script under a profiler and print the hotspots")
+    run_parser.add_argument(
+        "-pp",
+        "--profiler",
+        choices=["auto", "cprofile", "sampling"],
+        default="auto",
+        help=("Profiler to use with '--profile'. 'auto' uses pyinstrument's "
+              "sampling profiler if installed in the env, otherwise cProfile"))
+    run_parser.add_argument(
+        "-pt",
+        "--profile-top",
+        type=int,
+        default=20,
+        dest="profile_top",
+        help="Number of hotspots to print when profiling")
+    run_parser.add_argument(
+        "-po",
+        "--profile-output",
+        dest="profile_output",
+        help="Folder to save the full profile into when profiling")
     run_parser.add_argument(
         "-wf",
         "--writeable-fs",
         action="store_true",
         dest="write_filesystem",
         help="Allow script to write data anywhere in the env's own filesystem")
+    add_tmpfs_arguments(run_parser)
+    run_parser.add_argument(
+        "-mx",
+        "--matrix",
+        action="store_true",
+        help=("envname is a matrix made with 'new --python', run script in "
+              "every Python version at once"))
     run_parser.add_argument(
         "arguments",
         nargs=argparse.REMAINDER,
         help="arguments to pass into script")
     run_parser.set_defaults(func=func_run_script)
 
+    # --- Watch Script ---
+    watch_parser = subparsers.add_parser(
+        "watch",
+        help="run script inside an existing virtual env, "
+        "re-running it every time it changes")
+    watch_parser.add_argument(
+        "envname", help="name of the virtualenv to run script in")
+    watch_parser.add_argument("script", help="path to script to run")
+    watch_parser.add_argument(
+        "-am",
+        "--as-module",
+        action="store_true",
+        dest="as_module",
+        help=("If set, script is not a file on disk, "
+              "but a name of a python module"))
+    watch_parser.add_argument(
+        "-e",
+        "--expose-port",
+        type=int,
+        dest="port",
+        help="Expose a network port on the container")
+    watch_parser.add_argument(
+        "-m",
+        "--mount",
+        help=("Mount a folder read-only inside the container "
+              "to '/usr/src/app/<folder_name>', re-running when it changes"))
+    watch_parser.add_argument(
+        "-pl",
+        "--preload",
+        help=("Comma-separated list of modules to import once, "
+              "so they're already loaded on every re-run"))
+    watch_parser.add_argument(
+        "arguments",
+        nargs=argparse.REMAINDER,
+        help="arguments to pass into script")
+    watch_parser.set_defaults(func=func_watch_script)
+
     # --- List Virtual Envs ---
     list_parser = subparsers.add_parser(
         "list", help="list all virtual environments")
@@ -548,6 +647,12 @@ def main():
         "freeze", help="list packages inside an environment")
     freeze_parser.add_argument(
         "envname", help="name of the virtualenv to list packges in")
+    freeze_parser.add_argument(
+        "-tf",
+        "--tmpfs",
+        dest="tmpfs_size",
+        default=TMPFS_SIZE,
+        help=f"Size of the in-memory /tmp pip can write to, default {TMPFS_SIZE}")
     freeze_parser.set_defaults(func=func_run_freeze)
 
     # --- Delete Virtual Env ---
@@ -556,6 +661,34 @@ def main():
     del_parser.add_argument("envname", help="name of the virtualenv to enter")
     del_parser.set_defaults(func=func_delete_venv)
 
+    # --- Virtual Env versions ---
+    history_parser = subparsers.add_parser(
+        "history", help="list the versions of a virtual environment")
+    history_parser.add_argument("envname", help="name of the virtualenv")
+    history_parser.set_defaults(func=func_history_venv)
+
+    rollback_parser = subparsers.add_parser(
+        "rollback",
+        help="point a virtual environment back at an older version")
+    rollback_parser.add_argument("envname", help="name of the virtualenv")
+    rollback_parser.add_argument(
+        "version",
+        nargs="?",
+        help="version to roll back to, default is the one before the current")
+    rollback_parser.set_defaults(func=func_rollback_venv)
+
+    prune_parser = subparsers.add_parser(
+        "prune", help="remove old versions of a virtual environment")
+    prune_parser.add_argument("envname", help="name of the virtualenv")
+    prune_parser.add_argument(
+        "-k",
+        "--keep",
+        type=int,
+        default=None,
+        help=("number of the newest versions to keep, default is "
+              "$DOCKENV_KEEP_VERSIONS or 5"))
+    prune_parser.set_defaults(func=func_prune_venv)
+
     # --- Export Virtual Env ---
     export_parser = subparsers.add_parser(
         "export", help="Exports a virtual environment into a .tar file")
@@ -572,6 +705,30 @@ def main():
         "filename", help="file to save the virtualenv to")
     import_parser.set_defaults(func=func_import_venv)
 
+    # --- Export Virtual Envs into a store ---
+    export_store_parser = subparsers.add_parser(
+        "export-store",
+        help=("Exports virtual environments into a shared folder, "
+              "storing layers they share only once"))
+    export_store_parser.add_argument(
+        "store", help="folder to save the virtualenvs to")
+    export_store_parser.add_argument(
+        "envnames", nargs="+", help="names of the virtualenvs to export")
+    export_store_parser.set_defaults(func=func_export_store)
+
+    # --- Import Virtual Envs from a store ---
+    import_store_parser = subparsers.add_parser(
+        "import-store",
+        help=("imports virtual environments from a shared folder, "
+              "only loading layers Docker doesn't have"))
+    import_store_parser.add_argument(
+        "store", help="folder to load the virtualenvs from")
+    import_store_parser.add_argument(
+        "envnames",
+        nargs="*",
+        help="names of the virtualenvs to import, default is all of them")
+    import_store_parser.set_defaults(func=func_import_store)
+
     # --- Debug Shell Script ---
     shell_parser = subparsers.add_parser(
         "shell",
@@ -589,15 +746,48 @@ def main():
         "-m",
         "--mount",
         help="Mount a folder into the working directory of the container")
+    shell_parser.add_argument(
+        "-ro",
+        "--read-only",
+        action="store_true",
+        help="Keep the env's filesystem read-only, like 'run' does, "
+        "with an in-memory /tmp to write to")
+    add_tmpfs_arguments(shell_parser)
     shell_parser.set_defaults(func=func_run_shell)
 
+    # --- Service ---
+    serve_parser = subparsers.add_parser(
+        "serve",
+        help="run the dockenv service, which other dockenv commands "
+        "use when it is running")
+    serve_parser.add_argument(
+        "-s",
+        "--socket",
+        default=SOCKET_PATH,
+        help="path of the Unix socket to listen on. Set DOCKENV_SOCKET "
+        "to change the default for all commands")
+    serve_parser.add_argument(
+        "-mr",
+        "--max-runs",
+        type=int,
+        dest="max_runs",
+        help="most scripts to run at once")
+    serve_parser.add_argument(
+        "-mb",
+        "--max-builds",
+        type=int,
+        default=1,
+        dest="max_builds",
+        help="most envs to build at once")
+    serve_parser.set_defaults(func=func_serve)
+
     if len(sys.argv) == 1:
         parser.print_help()
     else:
         args = parser.parse_args()
         if args.verbose:
             LOGGER.setLevel(logging.DEBUG)
-        args.func(args)
+        sys.exit(args.func(args))
 
 
 if __name__ == "__main__":
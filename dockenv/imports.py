@@ -0,0 +1,111 @@
+"""
+Dockenv - Measure how long each env's packages take to import.
+
+After a build, every installed top-level package is imported in a new
+container, and the import time and memory are stored on the image as a
+label, so they travel with the env when it's exported.
+"""
+import io
+import json
+import os
+
+IMPORTS_LABEL = "dockenv.imports"
+PROFILER_SCRIPT = os.path.join(
+    os.path.abspath(os.path.dirname(__file__)), "scripts", "import_profiler.py")
+# How much worse an import can get after an upgrade before it's flagged
+REGRESSION_THRESHOLD = 0.25
+# Smaller changes than these are just noise
+REGRESSION_MIN_MS = 5.0
+REGRESSION_MIN_KB = 1024
+
+
+def get_image_imports(labels):
+    """
+    Get the import profile stored on an image
+
+    :param labels: The image's labels
+    :returns: The import profile dict, or None if the env wasn't profiled
+    """
+    try:
+        return json.loads((labels or {})[IMPORTS_LABEL])
+    except (KeyError, ValueError):
+        return None
+
+
+def profile_imports(client, image_name, runs=3):
+    """
+    Import every top-level package of an env, each in a new interpreter,
+    inside a container with no network
+
+    :param client: The docker.DockerClient to use
+    :param image_name: The env's Docker image name
+    :param runs: How many times to import each package, the median is kept
+    :returns: The import profile dict
+    """
+    with open(PROFILER_SCRIPT, "r") as fscript:
+        script = fscript.read()
+    output = client.containers.run(
+        image_name, ["python", "-c", script, "--runs", str(runs)],
+        environment={"PYTHONDONTWRITEBYTECODE": "1"},
+        network_disabled=True,
+        read_only=True,
+        remove=True)
+    return json.loads(output.decode())
+
+
+def label_image(client, image_name, profile):
+    """
+    Store an import profile on an image, as a label.
+    Labels don't add a layer, so this is a quick build
+
+    :param client: The docker.DockerClient to use
+    :param image_name: The env's Docker image name
+    :param profile: The import profile dict
+    """
+    client.images.build(
+        fileobj=io.BytesIO(f"FROM {image_name}\n".encode()),
+        tag=image_name,
+        labels={IMPORTS_LABEL: json.dumps(profile, sort_keys=True)},
+        rm=True)
+
+
+def find_regressions(old_profile, new_profile):
+    """
+    Find packages that got slower, or use more memory, to import
+
+    :param old_profile: The import profile from before an upgrade
+    :param new_profile: The import profile from after it
+    :returns: list of dicts, with 'module', and 'ms' and 'kb' as
+              [before, after]
+    """
+    regressions = []
+    old_modules = (old_profile or {}).get("modules", {})
+    for module, new in sorted(new_profile.get("modules", {}).items()):
+        old = old_modules.get(module)
+        if not old or "error" in old or "error" in new:
+            continue
+        slower = (new["ms"] - old["ms"] >= REGRESSION_MIN_MS
+                  and new["ms"] > old["ms"] * (1 + REGRESSION_THRESHOLD))
+        bigger = (new["kb"] - old["kb"] >= REGRESSION_MIN_KB
+                  and new["kb"] > old["kb"] * (1 + REGRESSION_THRESHOLD))
+        if slower or bigger:
+            regressions.append({
+                "module": module,
+                "ms": [old["ms"], new["ms"]],
+                "kb": [old["kb"], new["kb"]],
+            })
+    return regressions
+
+
+def get_slowest(profile, top=None):
+    """
+    Get the slowest imports of an import profile
+
+    :param profile: The import profile dict
+    :param top: If not None, how many to return
+    :returns: list of (module, stats dict), slowest first, then failed imports
+    """
+    modules = sorted(
+        (profile or {}).get("modules", {}).items(),
+        key=lambda item: -item[1].get("ms", -1))
+    return modules[:top] if top else modules
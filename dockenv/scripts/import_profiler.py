@@ -0,0 +1,107 @@
+"""
+Helper script run inside the container after an env is built.
+Imports every installed top-level package in a new interpreter, with
+'python -X importtime', and prints the cumulative import time and the extra
+memory used by each as JSON.
+"""
+import argparse
+import json
+import pkgutil
+import platform
+import re
+import site
+import statistics
+import subprocess
+import sys
+
+# e.g. 'import time:       312 |       1290 | requests'
+IMPORT_LINE = re.compile(r"^import time:\s*(\d+) \|\s*(\d+) \| (\S+)$")
+CHILD_SCRIPT = ("import resource, sys; {statement}; "
+                "sys.stdout.write(str(resource.getrusage("
+                "resource.RUSAGE_SELF).ru_maxrss))")
+
+
+def measure(module, timeout):
+    """
+    Import a module in a new interpreter
+
+    :param module: The module to import, or None to import nothing
+    :returns: tuple of (cumulative import time in microseconds,
+              max memory used in KB)
+    """
+    statement = f"import {module}" if module else "pass"
+    process = subprocess.run(
+        [
+            sys.executable, "-X", "importtime", "-c",
+            CHILD_SCRIPT.format(statement=statement)
+        ],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+        timeout=timeout,
+        check=False)
+    if process.returncode != 0:
+        lines = process.stderr.strip().splitlines() or ["import failed"]
+        raise ImportError(lines[-1][:200])
+
+    cumulative = 0
+    for line in process.stderr.splitlines():
+        # Only the top-level line for the module, not nested imports
+        match = IMPORT_LINE.match(line)
+        if match and match.group(3) == module:
+            cumulative = max(cumulative, int(match.group(2)))
+    return cumulative, int(process.stdout.strip())
+
+
+def measure_median(module, runs, timeout):
+    """
+    Import a module 'runs' times, each in a new interpreter
+
+    :returns: tuple of median (import time in microseconds, memory in KB)
+    """
+    results = [measure(module, timeout) for _ in range(runs)]
+    return (statistics.median(result[0] for result in results),
+            statistics.median(result[1] for result in results))
+
+
+def get_modules():
+    """
+    Get the top-level packages and modules installed for the user
+    """
+    modules = set()
+    for module in pkgutil.iter_modules([site.getusersitepackages()]):
+        if not module.name.startswith("_"):
+            modules.add(module.name)
+    return sorted(modules)
+
+
+def main():
+    """
+    Main entry function
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--timeout", type=float, default=60)
+    args = parser.parse_args()
+
+    _, baseline_kb = measure_median(None, args.runs, args.timeout)
+    modules = {}
+    for module in get_modules():
+        try:
+            import_us, memory_kb = measure_median(module, args.runs,
+                                                  args.timeout)
+        except (ImportError, subprocess.TimeoutExpired, ValueError) as exc:
+            modules[module] = {"error": str(exc) or type(exc).__name__}
+            continue
+        modules[module] = {
+            "ms": round(import_us / 1000, 2),
+            "kb": max(0, int(memory_kb - baseline_kb)),
+        }
+    json.dump({
+        "python": platform.python_version(),
+        "modules": modules
+    }, sys.stdout)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""
+Helper script run inside the container by 'dockenv run --profile'.
+Runs the script or module under a profiler, and writes the profile and a
+summary of the hotspots into the output folder.
+The summary is made here, so the host never has to load the profile itself.
+"""
+import argparse
+import cProfile
+import importlib.util
+import io
+import os
+import pstats
+import runpy
+import sys
+
+
+def run_target(target, as_module):
+    """
+    Run the script or module
+
+    :returns: The exit code of the script
+    """
+    try:
+        if as_module:
+            runpy.run_module(target, run_name="__main__", alter_sys=True)
+        else:
+            runpy.run_path(target, run_name="__main__")
+    except SystemExit as exc:
+        if exc.code is None:
+            return 0
+        return exc.code if isinstance(exc.code, int) else 1
+    return 0
+
+
+def profile_sampling(target, as_module, output, top):
+    """
+    Profile using pyinstrument's sampling profiler
+
+    :returns: The exit code of the script
+    """
+    # pylint: disable=import-error, import-outside-toplevel
+    from pyinstrument import Profiler
+    profiler = Profiler()
+    profiler.start()
+    try:
+        code = run_target(target, as_module)
+    finally:
+        profiler.stop()
+        with open(os.path.join(output, "profile.html"), "w") as fprofile:
+            fprofile.write(profiler.output_html())
+        with open(os.path.join(output, "summary.txt"), "w") as fsummary:
+            fsummary.write("[***] pyinstrument sampling profile [***]\n")
+            # pyinstrument prints a call tree, limit it to the top lines
+            lines = profiler.output_text(unicode=False, color=False).splitlines()
+            fsummary.write("\n".join(lines[:top * 2]) + "\n")
+    return code
+
+
+def profile_cprofile(target, as_module, output, top):
+    """
+    Profile using cProfile
+
+    :returns: The exit code of the script
+    """
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        code = run_target(target, as_module)
+    finally:
+        profiler.disable()
+        profiler.dump_stats(os.path.join(output, "profile.prof"))
+        summary = io.StringIO()
+        summary.write("[***] cProfile profile [***]\n")
+        stats = pstats.Stats(profiler, stream=summary)
+        stats.sort_stats("tottime").print_stats(top)
+        with open(os.path.join(output, "summary.txt"), "w") as fsummary:
+            fsummary.write(summary.getvalue())
+    return code
+
+
+def main():
+    """
+    Main entry function
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--as-module", action="store_true", dest="as_module")
+    parser.add_argument("--output", required=True)
+    parser.add_argument("--top", type=int, default=20)
+    parser.add_argument("--profiler", choices=["auto", "cprofile", "sampling"],
+                        default="auto")
+    parser.add_argument("target")
+    parser.add_argument("arguments", nargs=argparse.REMAINDER)
+    args = parser.parse_args()
+    sys.argv = [args.target] + args.arguments
+
+    profile_func = profile_cprofile
+    if args.profiler != "cprofile":
+        if importlib.util.find_spec("pyinstrument"):
+            profile_func = profile_sampling
+        elif args.profiler == "sampling":
+            print("[***] pyinstrument isn't installed in this env, "
+                  "using cProfile [***]", file=sys.stderr)
+    sys.exit(profile_func(args.target, args.as_module, args.output, args.top))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""
+Helper script run inside the container by 'dockenv watch'.
+Imports any modules to keep warm, then every time a line is read
+from stdin, runs the script in a forked child process.
+If the script is still running, it is stopped first.
+"""
+import argparse
+import importlib
+import os
+import runpy
+import select
+import signal
+import sys
+import time
+import traceback
+
+# How often to check if the script has finished
+CHILD_POLL = 0.05
+# How long a stopped script gets to exit before it is killed
+STOP_TIMEOUT = 2.0
+
+
+def run_child(target, as_module, script_args):
+    """
+    Run the script or module, in the forked child
+
+    :returns: The exit code of the script
+    """
+    sys.argv = [target] + script_args
+    try:
+        if as_module:
+            runpy.run_module(target, run_name="__main__", alter_sys=True)
+        else:
+            runpy.run_path(target, run_name="__main__")
+    except SystemExit as exc:
+        if exc.code is None:
+            return 0
+        return exc.code if isinstance(exc.code, int) else 1
+    except BaseException:  # pylint: disable=broad-except
+        traceback.print_exc()
+        return 1
+    return 0
+
+
+def start_child(args):
+    """
+    Fork a child to run the script, in its own process group, so anything
+    it starts is stopped with it
+
+    :returns: The child's pid
+    """
+    pid = os.fork()
+    if pid == 0:
+        os.setpgid(0, 0)
+        # Don't let the script read our run requests
+        sys.stdin = open(os.devnull, "r")
+        os.dup2(sys.stdin.fileno(), 0)
+        code = run_child(args.target, args.as_module, args.arguments)
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os._exit(code)  # pylint: disable=protected-access
+    try:
+        os.setpgid(pid, pid)
+    except OSError:
+        # The child already did it
+        pass
+    return pid
+
+
+def stop_child(pid):
+    """
+    Stop a running child, killing it if it doesn't exit in time
+    """
+    for sig in [signal.SIGTERM, signal.SIGKILL]:
+        try:
+            os.killpg(pid, sig)
+        except ProcessLookupError:
+            pass
+        deadline = time.perf_counter() + STOP_TIMEOUT
+        while time.perf_counter() < deadline:
+            done, _ = os.waitpid(pid, os.WNOHANG)
+            if done:
+                return
+            time.sleep(CHILD_POLL)
+    os.waitpid(pid, 0)
+
+
+def main():
+    """
+    Main entry function
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--as-module", action="store_true", dest="as_module")
+    parser.add_argument("--preload", default="")
+    parser.add_argument("target")
+    parser.add_argument("arguments", nargs=argparse.REMAINDER)
+    args = parser.parse_args()
+
+    for module in filter(None, args.preload.split(",")):
+        try:
+            importlib.import_module(module)
+        except ImportError:
+            print(f"[***] Failed to preload {module!r} [***]", flush=True)
+
+    stdin_fd = sys.stdin.fileno()
+    pid = None
+    start = None
+    while True:
+        readable, _, _ = select.select([stdin_fd], [], [],
+                                       CHILD_POLL if pid else None)
+        if readable:
+            if not os.read(stdin_fd, 4096):
+                # dockenv has gone away
+                break
+            if pid:
+                stop_child(pid)
+                print("[***] Changed, restarting [***]", flush=True)
+            start = time.perf_counter()
+            pid = start_child(args)
+            continue
+        done, status = os.waitpid(pid, os.WNOHANG)
+        if done:
+            code = os.WEXITSTATUS(status) if os.WIFEXITED(status) else 1
+            elapsed = time.perf_counter() - start
+            print(f"[***] Exited with code {code} in {elapsed:.2f}s [***]",
+                  flush=True)
+            pid = None
+    if pid:
+        stop_child(pid)
+
+
+if __name__ == "__main__":
+    main()
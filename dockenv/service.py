@@ -0,0 +1,382 @@
+"""
+Dockenv - Long-running service, listening on a Unix socket.
+
+The service keeps one Docker client and the list of local images in memory,
+so cli commands only need a socket round trip instead of starting up a new
+Docker client and listing every image. It also limits how many scripts run,
+and envs build, at once.
+
+Each request is one line of JSON: {"command": "run", "args": {...}}
+'args' are the arguments of the matching Session call.
+The service replies with lines of JSON. A 'run' first sends
+{"stdout": "..."} and {"stderr": "..."} lines as the script writes output,
+then every request ends with {"result": {...}}, the Result as a dict.
+
+Only the user running the service can use it. The socket is in a folder only
+that user can open, and on Linux both ends check who the other end is.
+"""
+import asyncio
+import json
+import logging
+import os
+import socket
+import stat
+import struct
+import sys
+import threading
+import traceback
+import docker
+from .api import AsyncSession, Result
+from .context import CACHE_FOLDER
+
+LOGGER = logging.getLogger(__name__)
+
+# A folder only we can open, so no one else can listen in our place
+if os.environ.get("XDG_RUNTIME_DIR"):
+    SOCKET_FOLDER = os.path.join(os.environ["XDG_RUNTIME_DIR"], "dockenv")
+else:
+    SOCKET_FOLDER = os.path.join(CACHE_FOLDER, "service")
+SOCKET_PATH = os.environ.get("DOCKENV_SOCKET",
+                             os.path.join(SOCKET_FOLDER, "dockenv.sock"))
+SOCKET_MODE = 0o600
+SOCKET_FOLDER_MODE = 0o700
+COMMANDS = ["ping", "list", "new", "upgrade", "run"]
+# Arguments that are paths, so need to be made absolute before sending
+PATH_ARGUMENTS = ["script", "mount", "requirements", "profile_output"]
+
+
+def service_supported():
+    """
+    Check if this platform has Unix sockets
+    """
+    return hasattr(socket, "AF_UNIX")
+
+
+def get_peer_uid(sock):
+    """
+    Get the user ID of the process at the other end of a Unix socket
+
+    :param sock: The connected socket
+    :returns: The user ID, or None if this platform can't tell
+    """
+    if not hasattr(socket, "SO_PEERCRED"):
+        return None
+    creds = sock.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED,
+                            struct.calcsize("3i"))
+    _, uid, _ = struct.unpack("3i", creds)
+    return uid
+
+
+def check_socket_owner(socket_path):
+    """
+    Make sure a socket was made by us, so we don't send our
+    requests to another user's service
+
+    :param socket_path: The path of the service's Unix socket
+    :raises PermissionError: If the socket is owned by someone else
+    """
+    socket_stat = os.stat(socket_path)
+    if not stat.S_ISSOCK(socket_stat.st_mode):
+        raise PermissionError(f"{socket_path!r} isn't a socket")
+    if socket_stat.st_uid != os.getuid():
+        raise PermissionError(f"{socket_path!r} is owned by another user")
+
+
+def make_socket_folder(socket_path):
+    """
+    Make the folder the socket goes in, if needed, and make sure only
+    we can use it
+
+    :param socket_path: The path of the service's Unix socket
+    :raises PermissionError: If other users can open the folder
+    """
+    folder = os.path.dirname(os.path.abspath(socket_path))
+    os.makedirs(folder, mode=SOCKET_FOLDER_MODE, exist_ok=True)
+    folder_stat = os.stat(folder)
+    if folder_stat.st_uid != os.getuid() or folder_stat.st_mode & 0o077:
+        raise PermissionError(
+            f"Other users can use {folder!r}, put the socket in a folder "
+            "only you can open, e.g. with 'chmod 700'")
+
+
+class Service():
+    """
+    The dockenv service
+    """
+
+    def __init__(self, max_runs=None, max_builds=1, client=None):
+        """
+        :param max_runs: If not None, the most scripts to run at once
+        :param max_builds: If not None, the most envs to build at once
+        :param client: A docker.DockerClient to use. If None, one is
+                       created from the environment
+        """
+        self.session = AsyncSession(
+            client, max_concurrency=max_runs, cache_images=True)
+        self._max_builds = max_builds
+        self._build_semaphore = None
+
+    def _watch_events(self, loop):
+        """
+        Forget the cached images whenever Docker says an image changed.
+        The events stream blocks, so this runs in its own thread
+        """
+        try:
+            events = self.session.session.client.events(
+                decode=True, filters={"type": "image"})
+            for _ in events:
+                loop.call_soon_threadsafe(self.session.session.invalidate_images)
+        except (docker.errors.DockerException, OSError, ValueError):
+            LOGGER.debug(traceback.format_exc())
+            LOGGER.error("ERROR: Lost the Docker events stream, "
+                         "no longer caching images")
+        # Without events, we can't know when the cache is stale
+        self.session.session.cache_images = False
+        if not loop.is_closed():
+            loop.call_soon_threadsafe(self.session.session.invalidate_images)
+
+    async def _build(self, command, kwargs):
+        """
+        Build an env, limited to 'max_builds' at once
+        """
+        if self._max_builds and self._build_semaphore is None:
+            self._build_semaphore = asyncio.Semaphore(self._max_builds)
+        # Build output would go to the service's terminal, not the client's
+        kwargs["verbose"] = False
+        if self._build_semaphore is None:
+            return await getattr(self.session, command)(**kwargs)
+        async with self._build_semaphore:
+            return await getattr(self.session, command)(**kwargs)
+
+    async def handle_request(self, request, send):
+        """
+        Do one request
+
+        :param request: The decoded request
+        :param send: Coroutine function to send a reply line to the client
+        :returns: The Result of the request
+        """
+        command = request.get("command")
+        kwargs = request.get("args") or {}
+        if command not in COMMANDS or not isinstance(kwargs, dict):
+            return Result(None, exit_code=1, error=f"Bad command {command!r}")
+
+        if command == "ping":
+            return Result(None)
+        if command == "list":
+            return await self.session.list()
+        if command in ["new", "upgrade"]:
+            return await self._build(command, kwargs)
+
+        async def send_output(stream, text):
+            await send({stream: text})
+
+        kwargs.pop("capture_output", None)
+        return await self.session.run(output_callback=send_output, **kwargs)
+
+    @staticmethod
+    async def _until_disconnected(reader, coro):
+        """
+        Await a coroutine, cancelling it if the client goes away first,
+        so a script doesn't keep running when no one is listening
+
+        :param reader: The client's asyncio.StreamReader
+        :param coro: The coroutine to await
+        :returns: The coroutine's result
+        :raises ConnectionResetError: If the client went away first
+        """
+        task = asyncio.ensure_future(coro)
+        # Clients send nothing after the request, so this only ends at EOF
+        eof = asyncio.ensure_future(reader.read())
+        try:
+            await asyncio.wait([task, eof],
+                               return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            eof.cancel()
+        if not task.done():
+            task.cancel()
+            # Wait for the run to clean up
+            await asyncio.wait([task])
+            raise ConnectionResetError("client went away")
+        return task.result()
+
+    async def handle_client(self, reader, writer):
+        """
+        Handle one client connection
+        """
+
+        async def send(message):
+            writer.write(json.dumps(message).encode() + b"\n")
+            await writer.drain()
+
+        try:
+            peer_uid = get_peer_uid(writer.get_extra_info("socket"))
+            if peer_uid is not None and peer_uid != os.getuid():
+                LOGGER.error(
+                    f"ERROR: Refused request from another user ({peer_uid})")
+                await send({
+                    "result":
+                    Result(None, exit_code=1,
+                           error="Permission denied").to_dict()
+                })
+                return
+            line = await reader.readline()
+            try:
+                request = json.loads(line.decode())
+                if request.get("command") == "run":
+                    result = await self._until_disconnected(
+                        reader, self.handle_request(request, send))
+                else:
+                    # Builds run in a thread, which can't be cancelled
+                    result = await self.handle_request(request, send)
+            except (ValueError, TypeError, AttributeError) as exc:
+                LOGGER.debug(traceback.format_exc())
+                result = Result(None, exit_code=1, error=f"Bad request: {exc}")
+            await send({"result": result.to_dict()})
+        except ConnectionError:
+            LOGGER.debug(traceback.format_exc())
+        finally:
+            writer.close()
+
+    def serve(self, socket_path=SOCKET_PATH):
+        """
+        Run the service until stopped with Ctrl+C
+
+        :param socket_path: The path of the Unix socket to listen on
+        """
+        make_socket_folder(socket_path)
+        if os.path.exists(socket_path):
+            if ping(socket_path):
+                raise OSError(f"dockenv service already running on {socket_path!r}")
+            # Left over from a service that didn't stop cleanly
+            os.remove(socket_path)
+
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        server = loop.run_until_complete(
+            asyncio.start_unix_server(self.handle_client, path=socket_path))
+        os.chmod(socket_path, SOCKET_MODE)
+        threading.Thread(
+            target=self._watch_events, args=(loop, ), daemon=True).start()
+        LOGGER.info(f"[*] dockenv service listening on {socket_path!r}")
+        try:
+            loop.run_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.close()
+            loop.run_until_complete(server.wait_closed())
+            if os.path.exists(socket_path):
+                os.remove(socket_path)
+            self.session.close()
+            loop.close()
+            LOGGER.info("[*] dockenv service stopped")
+
+
+def request(command, kwargs=None, socket_path=SOCKET_PATH, timeout=None):
+    """
+    Send a request to the service, printing any script output as it arrives
+
+    :param command: The command to run
+    :param kwargs: The arguments of the command
+    :param socket_path: The path of the service's Unix socket
+    :param timeout: If not None, seconds to wait for each reply
+    :returns: The Result of the request
+    :raises PermissionError: If the service is run by another user
+    """
+    check_socket_owner(socket_path)
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(socket_path)
+        # The socket could have been swapped since we checked it
+        peer_uid = get_peer_uid(sock)
+        if peer_uid is not None and peer_uid != os.getuid():
+            raise PermissionError(
+                f"dockenv service on {socket_path!r} is run by another user")
+        message = {"command": command, "args": kwargs or {}}
+        sock.sendall(json.dumps(message).encode() + b"\n")
+        with sock.makefile("r", encoding="utf-8") as freplies:
+            for line in freplies:
+                reply = json.loads(line)
+                if "stdout" in reply:
+                    sys.stdout.write(reply["stdout"])
+                    sys.stdout.flush()
+                elif "stderr" in reply:
+                    sys.stderr.write(reply["stderr"])
+                    sys.stderr.flush()
+                elif "result" in reply:
+                    fields = reply["result"]
+                    return Result(fields.pop("envname"), **fields)
+    return Result(None, exit_code=1, error="dockenv service closed connection")
+
+
+def ping(socket_path=SOCKET_PATH):
+    """
+    Check if the service is running
+
+    :param socket_path: The path of the service's Unix socket
+    :returns: True if the service replied
+    """
+    if not service_supported() or not os.path.exists(socket_path):
+        return False
+    try:
+        return request("ping", socket_path=socket_path, timeout=1).ok
+    except PermissionError as exc:
+        LOGGER.error(f"ERROR: Not using the dockenv service: {exc}")
+        return False
+    except (OSError, ValueError):
+        return False
+
+
+class ServiceClient():
+    """
+    Has the same calls as Session, for the commands the service can do,
+    but sends them to the service
+    """
+
+    def __init__(self, socket_path=SOCKET_PATH):
+        self.socket_path = socket_path
+
+    def _request(self, command, kwargs):
+        """
+        Send a request, making any paths absolute first
+        """
+        for name in PATH_ARGUMENTS:
+            if not kwargs.get(name):
+                continue
+            # A module name isn't a path
+            if name == "script" and kwargs.get("as_module"):
+                continue
+            kwargs[name] = os.path.abspath(kwargs[name])
+        try:
+            return request(command, kwargs, self.socket_path)
+        except (OSError, ValueError) as exc:
+            LOGGER.debug(traceback.format_exc())
+            return Result(
+                kwargs.get("envname"),
+                exit_code=1,
+                error=f"Failed to talk to dockenv service: {exc}")
+
+    def list(self):
+        """
+        See Session.list
+        """
+        return self._request("list", {})
+
+    def new(self, envname, **kwargs):
+        """
+        See Session.new
+        """
+        return self._request("new", dict(kwargs, envname=envname))
+
+    def upgrade(self, envname, **kwargs):
+        """
+        See Session.upgrade
+        """
+        return self._request("upgrade", dict(kwargs, envname=envname))
+
+    def run(self, envname, script, **kwargs):
+        """
+        See Session.run. The script's stdin isn't passed through
+        """
+        return self._request("run", dict(kwargs, envname=envname, script=script))
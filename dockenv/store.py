@@ -0,0 +1,508 @@
+"""
+Dockenv - Export envs into a shared, deduplicating OCI-layout folder.
+
+Every layer and image config is stored once, named by its digest, in
+'<store>/blobs/sha256/'. 'index.json' lists the env images in the store.
+Exporting many envs that share the 'python:3' base layers only stores
+those layers once, and syncing the store between machines only sends
+layers the other side doesn't have yet.
+
+Layers are stored uncompressed, named by their diff ID, so the store is
+the same whether Docker saved them as plain tars or, with the containerd
+image store, gzipped.
+
+Importing builds a 'docker load' archive on the fly, leaving out the
+layers the daemon already has.
+"""
+import os
+import io
+import json
+import functools
+import hashlib
+import tarfile
+import tempfile
+import zlib
+import docker
+
+OCI_LAYOUT = {"imageLayoutVersion": "1.0.0"}
+MANIFEST_TYPE = "application/vnd.oci.image.manifest.v1+json"
+CONFIG_TYPE = "application/vnd.oci.image.config.v1+json"
+LAYER_TYPE = "application/vnd.oci.image.layer.v1.tar"
+IMAGE_NAME_ANNOTATION = "io.containerd.image.name"
+REF_NAME_ANNOTATION = "org.opencontainers.image.ref.name"
+# The Docker image ID, which isn't the config digest on containerd
+IMAGE_ID_ANNOTATION = "dockenv.image.id"
+CHUNK_SIZE = 1024 * 1024
+# Blobs this small that are named by digest could be the image config
+MAX_CONFIG_SIZE = 1024 * 1024
+GZIP_MAGIC = b"\x1f\x8b"
+BLOCK_SIZE = tarfile.BLOCKSIZE
+
+
+def get_blob_path(store, digest):
+    """
+    Get the path of a blob in the store
+
+    :param store: The store folder
+    :param digest: The blob digest, e.g. 'sha256:abc...'
+    """
+    algorithm, hex_digest = digest.split(":", 1)
+    if algorithm != "sha256" or len(hex_digest) != 64:
+        raise ValueError(f"Unsupported digest {digest!r}")
+    return os.path.join(store, "blobs", algorithm, hex_digest)
+
+
+def init_store(store):
+    """
+    Create an empty store, if it doesn't exist yet
+    """
+    os.makedirs(os.path.join(store, "blobs", "sha256"), exist_ok=True)
+    layout_path = os.path.join(store, "oci-layout")
+    if not os.path.exists(layout_path):
+        with open(layout_path, "w") as flayout:
+            json.dump(OCI_LAYOUT, flayout)
+
+
+def load_index(store):
+    """
+    Load the store's index.json
+
+    :returns: The index dict, empty if the store has no index yet
+    """
+    try:
+        with open(os.path.join(store, "index.json"), "r") as findex:
+            return json.load(findex)
+    except FileNotFoundError:
+        return {"schemaVersion": 2, "manifests": []}
+
+
+def replace_file(path, data):
+    """
+    Write a file in one step, through a temp file of our own, so other
+    exports writing the same file at once don't get in the way
+
+    :param path: The file to write
+    :param data: The bytes to write into it
+    """
+    fd, tmp_path = tempfile.mkstemp(
+        dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as ftmp:
+            ftmp.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def save_index(store, index):
+    """
+    Save the store's index.json, replacing it in one step
+    """
+    replace_file(
+        os.path.join(store, "index.json"),
+        json.dumps(index, indent=2).encode())
+
+
+def write_blob(store, data):
+    """
+    Write bytes into the store, unless they're already there
+
+    :returns: tuple of (digest, size)
+    """
+    digest = "sha256:" + hashlib.sha256(data).hexdigest()
+    blob_path = get_blob_path(store, digest)
+    if not os.path.exists(blob_path):
+        replace_file(blob_path, data)
+    return digest, len(data)
+
+
+def get_chain_ids(diff_ids):
+    """
+    Get the chain ID of every layer, which names a layer together with
+    every layer under it, the way Docker does
+
+    :param diff_ids: list of layer digests, bottom layer first
+    :returns: list of chain IDs
+    """
+    chain_ids = []
+    for diff_id in diff_ids:
+        if chain_ids:
+            chain_data = f"{chain_ids[-1]} {diff_id}".encode()
+            diff_id = "sha256:" + hashlib.sha256(chain_data).hexdigest()
+        chain_ids.append(diff_id)
+    return chain_ids
+
+
+class ChunkReader():
+    """
+    File-like object reading from a generator of byte chunks,
+    e.g. the output of Image.save
+    """
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._chunk = b""
+        self._offset = 0
+
+    def read(self, size=-1):
+        """
+        Read up to 'size' bytes, or everything if 'size' is negative
+        """
+        parts = []
+        while size != 0:
+            if self._offset == len(self._chunk):
+                self._chunk = next(self._chunks, None)
+                self._offset = 0
+                if self._chunk is None:
+                    self._chunk = b""
+                    break
+            end = len(self._chunk)
+            if size > 0:
+                end = min(end, self._offset + size)
+                size -= end - self._offset
+            parts.append(self._chunk[self._offset:end])
+            self._offset = end
+        return b"".join(parts)
+
+
+def get_member_digest(name):
+    """
+    Get the digest a 'docker save' archive member is named after, if any.
+    Newer Docker names blobs 'blobs/sha256/<hex>', older Docker names
+    the config '<hex>.json' and layers '<id>/layer.tar', where the ID
+    isn't the digest
+
+    :returns: The digest, or None if the name doesn't say
+    """
+    parts = name.split("/")
+    if len(parts) == 3 and parts[:2] == ["blobs", "sha256"]:
+        return f"sha256:{parts[2]}"
+    if len(parts) == 1 and name.endswith(".json") and len(name) == 69:
+        return f"sha256:{name[:-len('.json')]}"
+    return None
+
+
+def _uncompressed_chunks(fmember, saved):
+    """
+    Generate the uncompressed contents of a layer in a 'docker save'
+    archive. The containerd image store saves layers gzipped, older
+    Docker saves them as plain tars
+
+    :param fmember: The layer's file object
+    :param saved: hashlib object, updated with the layer as saved
+    """
+    decompressor = None
+    first = True
+    for chunk in iter(functools.partial(fmember.read, CHUNK_SIZE), b""):
+        saved.update(chunk)
+        if first:
+            first = False
+            if chunk.startswith(GZIP_MAGIC):
+                decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        if decompressor is None:
+            yield chunk
+            continue
+        # Limit each piece, a small chunk can decompress to a lot
+        while chunk:
+            yield decompressor.decompress(chunk, CHUNK_SIZE)
+            chunk = decompressor.unconsumed_tail
+    if decompressor is not None:
+        yield decompressor.flush()
+
+
+def _store_layer(store, fmember, name, wanted):
+    """
+    Store a layer out of a 'docker save' archive, named by the digest
+    of its uncompressed tar, if it's wanted
+
+    :param store: The store folder
+    :param fmember: The layer's file object
+    :param name: The layer's name in the archive
+    :param wanted: set of uncompressed layer digests to store
+    :returns: Number of bytes written into the store
+    """
+    saved = hashlib.sha256()
+    layer = hashlib.sha256()
+    size = 0
+    with tempfile.NamedTemporaryFile(
+            dir=os.path.join(store, "blobs", "sha256"),
+            suffix=".tmp",
+            delete=False) as fblob:
+        for chunk in _uncompressed_chunks(fmember, saved):
+            layer.update(chunk)
+            fblob.write(chunk)
+            size += len(chunk)
+    digest = get_member_digest(name)
+    if digest is not None and f"sha256:{saved.hexdigest()}" != digest:
+        os.remove(fblob.name)
+        raise ValueError(f"{name!r} doesn't match its digest")
+    blob_path = get_blob_path(store, f"sha256:{layer.hexdigest()}")
+    if f"sha256:{layer.hexdigest()}" in wanted and not os.path.exists(blob_path):
+        os.replace(fblob.name, blob_path)
+        return size
+    os.remove(fblob.name)
+    return 0
+
+
+def store_archive(store, chunks, wanted):
+    """
+    Store the wanted layers, and the image config, out of a 'docker save'
+    archive, skipping layers the store already has
+
+    :param store: The store folder
+    :param chunks: The archive, as a generator of byte chunks
+    :param wanted: set of uncompressed layer digests to store
+    :returns: tuple of (bytes written into the store, config digest)
+    """
+    written = 0
+    save_manifest = None
+    # Which blob is the config is only known once manifest.json is read,
+    # which can be anywhere in the archive, so small ones are kept until then
+    small_blobs = {}
+    with tarfile.open(fileobj=ChunkReader(chunks), mode="r|") as archive:
+        for member in archive:
+            if not member.isfile():
+                continue
+            fmember = archive.extractfile(member)
+            if member.name == "manifest.json":
+                save_manifest = json.load(fmember)
+                continue
+            digest = get_member_digest(member.name)
+            if digest is None and not member.name.endswith(".tar"):
+                continue
+            if digest is not None and os.path.exists(get_blob_path(store, digest)):
+                continue
+            if digest is not None and member.size <= MAX_CONFIG_SIZE:
+                small_blobs[member.name] = fmember.read()
+                continue
+            written += _store_layer(store, fmember, member.name, wanted)
+
+    if not save_manifest:
+        raise ValueError("'docker save' archive has no manifest.json")
+    config_name = save_manifest[0]["Config"]
+    config_digest = get_member_digest(config_name)
+    for name, data in small_blobs.items():
+        if name != config_name:
+            written += _store_layer(store, io.BytesIO(data), name, wanted)
+        elif "sha256:" + hashlib.sha256(data).hexdigest() != config_digest:
+            raise ValueError(f"{name!r} doesn't match its digest")
+        else:
+            write_blob(store, data)
+            written += len(data)
+    return written, config_digest
+
+
+def get_stored_config(store, image):
+    """
+    Get the config digest of an image, if it's already in the store.
+    On the containerd image store, the image ID isn't the config digest,
+    so the ID of every exported image is kept in the index
+
+    :param store: The store folder
+    :param image: The docker Image
+    :returns: The config digest, or None if the store doesn't have it
+    """
+    for entry in load_index(store)["manifests"]:
+        if entry.get("annotations", {}).get(IMAGE_ID_ANNOTATION) != image.id:
+            continue
+        with open(get_blob_path(store, entry["digest"]), "r") as fmanifest:
+            config_digest = json.load(fmanifest)["config"]["digest"]
+        if os.path.exists(get_blob_path(store, config_digest)):
+            return config_digest
+    if os.path.exists(get_blob_path(store, image.id)):
+        return image.id
+    return None
+
+
+def export_image(store, image, image_name):
+    """
+    Export an image into the store
+
+    :param store: The store folder
+    :param image: The docker Image to export
+    :param image_name: The name to give the image in the store,
+                       e.g. 'dockenv-myenv:latest'
+    :returns: tuple of (bytes written, bytes already in the store)
+    """
+    init_store(store)
+    diff_ids = image.attrs["RootFS"]["Layers"]
+    missing = {
+        diff_id
+        for diff_id in diff_ids
+        if not os.path.exists(get_blob_path(store, diff_id))
+    }
+    config_digest = get_stored_config(store, image)
+
+    written = 0
+    # 'docker save' can't leave layers out, so only call it if needed
+    if missing or config_digest is None:
+        written, config_digest = store_archive(
+            store, image.save(chunk_size=CHUNK_SIZE), missing)
+    for diff_id in diff_ids:
+        if not os.path.exists(get_blob_path(store, diff_id)):
+            raise ValueError(
+                f"Exported image {image_name!r} is missing layer {diff_id}, "
+                "Docker may have saved it compressed in a way dockenv can't "
+                "read, e.g. zstd")
+    config_path = get_blob_path(store, config_digest)
+    with open(config_path, "r") as fconfig:
+        if json.load(fconfig).get("rootfs", {}).get("diff_ids") != diff_ids:
+            raise ValueError(
+                f"Exported image {image_name!r} config doesn't match its layers")
+
+    manifest = {
+        "schemaVersion": 2,
+        "mediaType": MANIFEST_TYPE,
+        "config": {
+            "mediaType": CONFIG_TYPE,
+            "digest": config_digest,
+            "size": os.path.getsize(config_path),
+        },
+        "layers": [{
+            "mediaType": LAYER_TYPE,
+            "digest": diff_id,
+            "size": os.path.getsize(get_blob_path(store, diff_id)),
+        } for diff_id in diff_ids],
+    }
+    digest, size = write_blob(
+        store, json.dumps(manifest, sort_keys=True).encode())
+
+    index = load_index(store)
+    index["manifests"] = [
+        entry for entry in index["manifests"]
+        if entry.get("annotations", {}).get(IMAGE_NAME_ANNOTATION) != image_name
+    ]
+    index["manifests"].append({
+        "mediaType": MANIFEST_TYPE,
+        "digest": digest,
+        "size": size,
+        "annotations": {
+            IMAGE_NAME_ANNOTATION: image_name,
+            REF_NAME_ANNOTATION: image_name.rsplit(":", 1)[-1],
+            IMAGE_ID_ANNOTATION: image.id,
+        },
+    })
+    save_index(store, index)
+
+    total = manifest["config"]["size"] + sum(
+        layer["size"] for layer in manifest["layers"])
+    return written, total - written
+
+
+def list_images(store):
+    """
+    Get the images in the store
+
+    :returns: dict of image name to manifest dict
+    """
+    images = {}
+    for entry in load_index(store)["manifests"]:
+        image_name = entry.get("annotations", {}).get(IMAGE_NAME_ANNOTATION)
+        if image_name is None:
+            continue
+        with open(get_blob_path(store, entry["digest"]), "r") as fmanifest:
+            images[image_name] = json.load(fmanifest)
+    return images
+
+
+def _tar_member(name, size, chunks):
+    """
+    Generate one file in a tar archive
+    """
+    info = tarfile.TarInfo(name)
+    info.size = size
+    info.mode = 0o644
+    yield info.tobuf(format=tarfile.USTAR_FORMAT)
+    yield from chunks
+    yield b"\0" * (-size % BLOCK_SIZE)
+
+
+def _read_chunks(path):
+    """
+    Generate the contents of a file in chunks
+    """
+    with open(path, "rb") as fblob:
+        yield from iter(functools.partial(fblob.read, CHUNK_SIZE), b"")
+
+
+def load_archive_chunks(store, image_name, manifest, skip_layers):
+    """
+    Generate a 'docker load' archive of an image in the store.
+    Docker only reads the layer files of layers it doesn't already have,
+    so layers in 'skip_layers' are listed, but left out
+
+    :param store: The store folder
+    :param image_name: The name to tag the loaded image with
+    :param manifest: The image's manifest dict
+    :param skip_layers: set of layer digests to leave out
+    """
+    config_digest = manifest["config"]["digest"]
+    config_name = f"{config_digest.split(':', 1)[1]}.json"
+    layer_names = [
+        f"{layer['digest'].split(':', 1)[1]}/layer.tar"
+        for layer in manifest["layers"]
+    ]
+    load_manifest = json.dumps([{
+        "Config": config_name,
+        "RepoTags": [image_name],
+        "Layers": layer_names,
+    }]).encode()
+
+    yield from _tar_member("manifest.json", len(load_manifest), [load_manifest])
+    config_path = get_blob_path(store, config_digest)
+    yield from _tar_member(
+        config_name, os.path.getsize(config_path), _read_chunks(config_path))
+    for layer, layer_name in zip(manifest["layers"], layer_names):
+        if layer["digest"] in skip_layers:
+            continue
+        layer_path = get_blob_path(store, layer["digest"])
+        yield from _tar_member(
+            layer_name, os.path.getsize(layer_path), _read_chunks(layer_path))
+    # End of archive
+    yield b"\0" * (BLOCK_SIZE * 2)
+
+
+def get_daemon_chain_ids(client):
+    """
+    Get the chain IDs of every layer the daemon has
+    """
+    chain_ids = set()
+    for image in client.images.list():
+        chain_ids.update(get_chain_ids(image.attrs["RootFS"]["Layers"]))
+    return chain_ids
+
+
+def import_image(client, store, image_name, manifest, daemon_chain_ids):
+    """
+    Load an image from the store, leaving out layers the daemon already has
+
+    :param client: The docker.DockerClient to load into
+    :param store: The store folder
+    :param image_name: The name of the image in the store
+    :param manifest: The image's manifest dict
+    :param daemon_chain_ids: set of chain IDs of the layers the daemon has
+    :returns: tuple of (bytes sent, bytes left out)
+    """
+    diff_ids = [layer["digest"] for layer in manifest["layers"]]
+    skip_layers = {
+        diff_id
+        for diff_id, chain_id in zip(diff_ids, get_chain_ids(diff_ids))
+        if chain_id in daemon_chain_ids
+    }
+    skipped = sum(layer["size"] for layer in manifest["layers"]
+                  if layer["digest"] in skip_layers)
+    total = manifest["config"]["size"] + sum(
+        layer["size"] for layer in manifest["layers"])
+
+    try:
+        client.images.load(
+            load_archive_chunks(store, image_name, manifest, skip_layers))
+    except docker.errors.APIError:
+        # Daemons using the containerd image store want every layer
+        if not skip_layers:
+            raise
+        client.images.load(load_archive_chunks(store, image_name, manifest, set()))
+        skipped = 0
+    daemon_chain_ids.update(get_chain_ids(diff_ids))
+    return total - skipped, skipped
@@ -0,0 +1,108 @@
+"""
+Dockenv - Versions of an env.
+
+Every build of an env is also tagged 'dockenv-<envname>:v<N>', with N going
+up by one each build, and 'latest' pointing at the version in use.
+Rolling back only moves 'latest', so takes no rebuild.
+"""
+import logging
+import os
+import re
+
+LOGGER = logging.getLogger(__name__)
+
+VERSION_TAG = re.compile(r"^v([0-9]+)$")
+# Number of versions of each env to keep, older ones are removed after a build.
+# Can be changed with $DOCKENV_KEEP_VERSIONS
+KEEP_VERSIONS = 5
+
+
+def get_keep_versions():
+    """
+    Get how many versions of each env to keep, from $DOCKENV_KEEP_VERSIONS
+
+    :returns: The number of versions, 0 to keep every version.
+              KEEP_VERSIONS if it isn't set, or isn't a number
+    """
+    value = os.environ.get("DOCKENV_KEEP_VERSIONS")
+    if value is None:
+        return KEEP_VERSIONS
+    try:
+        keep = int(value)
+    except ValueError:
+        keep = -1
+    if keep < 0:
+        LOGGER.warning(f"WARNING: DOCKENV_KEEP_VERSIONS={value!r} isn't a "
+                       f"number of versions, keeping {KEEP_VERSIONS}")
+        return KEEP_VERSIONS
+    return keep
+
+
+def get_version_tag(version):
+    """
+    Get the tag of a version of an env, e.g. 'v3'
+
+    :param version: The version number
+    """
+    return f"v{version}"
+
+
+def parse_version(version):
+    """
+    Get a version number from what a user typed, e.g. '3' or 'v3'
+
+    :param version: The version string
+    :returns: The version number
+    """
+    match = VERSION_TAG.match(version if version.startswith("v") else f"v{version}")
+    if not match:
+        raise ValueError(f"Bad version {version!r}, should be e.g. '3' or 'v3'")
+    return int(match.group(1))
+
+
+def get_image_versions(images, dockenv_name):
+    """
+    Get the versions of an env
+
+    :param images: list of docker Images, e.g. from 'images.list(name=...)'
+    :param dockenv_name: The env's Docker image name
+    :returns: dict of version number to Image
+    """
+    versions = {}
+    for image in images:
+        for tag in image.tags:
+            repository, _, tagname = tag.rpartition(":")
+            match = VERSION_TAG.match(tagname)
+            if repository == dockenv_name and match:
+                versions[int(match.group(1))] = image
+    return dict(sorted(versions.items()))
+
+
+def get_current_version(versions, image_id):
+    """
+    Get the version 'latest' points at
+
+    :param versions: dict of version number to Image
+    :param image_id: The ID of the image 'latest' points at
+    :returns: The version number, or None if 'latest' isn't a version
+    """
+    current = [
+        version for version, image in versions.items() if image.id == image_id
+    ]
+    return max(current) if current else None
+
+
+def get_prune_versions(versions, keep, current=None):
+    """
+    Get the versions to remove, to only keep the newest ones
+
+    :param versions: list of version numbers
+    :param keep: How many versions to keep. If None or 0, keep them all
+    :param current: The version 'latest' points at, which is always kept
+    :returns: list of version numbers to remove
+    """
+    if not keep:
+        return []
+    return [
+        version for version in sorted(versions)[:-keep] if version != current
+    ]
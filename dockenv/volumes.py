@@ -0,0 +1,275 @@
+"""
+Dockenv - Cache '--mount' folders inside Docker named volumes
+"""
+import os
+import contextlib
+import json
+import time
+import hashlib
+import tarfile
+import tempfile
+import threading
+import docker
+from .context import CACHE_FOLDER, file_digest
+
+VOLUME_FOLDER = os.path.join(CACHE_FOLDER, "volumes")
+VOLUME_PREFIX = "dockenv-cache-"
+# Number of cached volumes to keep before evicting the least recently used
+VOLUME_CACHE_SIZE = 8
+VOLUME_DEST = "/dockenv-cache"
+# Sync tars bigger than this are written to disk instead of kept in memory
+SPOOL_SIZE = 16 * 1024 * 1024
+
+# Runs in other threads, e.g. 'run --matrix', can sync the same folder at once
+_VOLUME_LOCKS = {}
+_VOLUME_LOCKS_LOCK = threading.Lock()
+
+
+def get_volume_lock(volume_name):
+    """
+    Get the lock that only lets one thread sync a volume at a time
+
+    :param volume_name: The name of the volume
+    :returns: threading.Lock
+    """
+    with _VOLUME_LOCKS_LOCK:
+        return _VOLUME_LOCKS.setdefault(volume_name, threading.Lock())
+
+
+def get_volume_name(src_folder):
+    """
+    Get the name of the named volume that caches a folder
+
+    :param src_folder: The absolute path of the folder
+    :returns: The volume name
+    """
+    path_hash = hashlib.sha256(src_folder.encode()).hexdigest()[:16]
+    return f"{VOLUME_PREFIX}{path_hash}"
+
+
+def load_manifest(volume_name, manifest_folder=VOLUME_FOLDER):
+    """
+    Load what we last synced into a volume
+
+    :param volume_name: The name of the volume
+    :param manifest_folder: The folder the manifests are stored in
+    :returns: The manifest dict, or None if there isn't one
+    """
+    manifest_path = os.path.join(manifest_folder, f"{volume_name}.json")
+    try:
+        with open(manifest_path, "r") as fmanifest:
+            return json.load(fmanifest)
+    except (OSError, ValueError):
+        return None
+
+
+def save_manifest(volume_name, manifest, manifest_folder=VOLUME_FOLDER):
+    """
+    Save what we synced into a volume
+
+    :param volume_name: The name of the volume
+    :param manifest: The manifest dict to save
+    :param manifest_folder: The folder the manifests are stored in
+    """
+    os.makedirs(manifest_folder, exist_ok=True)
+    manifest_path = os.path.join(manifest_folder, f"{volume_name}.json")
+    # A temp file of our own, as other runs can be saving the same manifest
+    fd, tmp_path = tempfile.mkstemp(dir=manifest_folder, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as fmanifest:
+            json.dump(manifest, fmanifest)
+        os.replace(tmp_path, manifest_path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def scan_folder(src_folder, old_files=None):
+    """
+    Get the size, modified time and content hash of every file in a folder.
+    Files whose size and modified time haven't changed since 'old_files'
+    reuse the old hash instead of being read again.
+
+    :param src_folder: The folder to scan
+    :param old_files: The 'files' entry of a previous manifest
+    :returns: dict of relative POSIX path to [size, mtime_ns, digest]
+    """
+    old_files = old_files or {}
+    files = {}
+    for root, _, fnames in os.walk(src_folder):
+        for fname in fnames:
+            path = os.path.join(root, fname)
+            if not os.path.isfile(path):
+                continue
+            rel_path = os.path.relpath(path, src_folder).replace(os.sep, "/")
+            stat = os.stat(path)
+            old = old_files.get(rel_path)
+            if old and old[0] == stat.st_size and old[1] == stat.st_mtime_ns:
+                files[rel_path] = old
+            else:
+                files[rel_path] = [
+                    stat.st_size, stat.st_mtime_ns,
+                    file_digest(path)
+                ]
+    return files
+
+
+def diff_files(old_files, new_files):
+    """
+    Work out which files need to be sent to, or removed from, a volume
+
+    :param old_files: The 'files' entry of the previous manifest
+    :param new_files: The 'files' entry of the new manifest
+    :returns: tuple of (list of changed paths, list of removed paths)
+    """
+    changed = [
+        rel_path for rel_path, entry in new_files.items()
+        if rel_path not in old_files or old_files[rel_path][2] != entry[2]
+    ]
+    removed = [rel_path for rel_path in old_files if rel_path not in new_files]
+    return sorted(changed), sorted(removed)
+
+
+def make_sync_tar(src_folder, changed):
+    """
+    Build a tar of the changed files, including their parent folders
+
+    :param src_folder: The folder the files are in
+    :param changed: list of relative POSIX paths to add
+    :returns: The tar, as a file object at the start of the tar.
+              Bigger tars are spooled to disk, so a big first sync doesn't
+              need the whole folder in memory. Close it once sent
+    """
+    folders = set()
+    for rel_path in changed:
+        parent = os.path.dirname(rel_path)
+        while parent:
+            folders.add(parent)
+            parent = os.path.dirname(parent)
+
+    ftar = tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE)
+    with tarfile.open(fileobj=ftar, mode="w") as tar:
+        for folder in sorted(folders):
+            info = tarfile.TarInfo(folder)
+            info.type = tarfile.DIRTYPE
+            info.mode = 0o755
+            tar.addfile(info)
+        for rel_path in changed:
+            path = os.path.join(src_folder, *rel_path.split("/"))
+            info = tar.gettarinfo(path, arcname=rel_path)
+            # Volume is mounted read-only, make sure the env's user can read it
+            info.mode |= 0o444
+            info.uid = info.gid = 0
+            info.uname = info.gname = ""
+            with open(path, "rb") as fdata:
+                tar.addfile(info, fdata)
+    ftar.seek(0)
+    return ftar
+
+
+def evict_volumes(client,
+                  keep=VOLUME_CACHE_SIZE,
+                  manifest_folder=VOLUME_FOLDER):
+    """
+    Remove the least recently used cached volumes
+
+    :param client: The Docker client
+    :param keep: How many volumes to keep
+    :param manifest_folder: The folder the manifests are stored in
+    """
+    volumes = client.volumes.list(filters={"label": "dockenv.cache"})
+    last_used = {}
+    for volume in volumes:
+        manifest = load_manifest(volume.name, manifest_folder) or {}
+        last_used[volume.name] = manifest.get("last_used", 0)
+    volumes.sort(key=lambda volume: last_used[volume.name], reverse=True)
+    for volume in volumes[keep:]:
+        lock = get_volume_lock(volume.name)
+        # Being synced by another thread, so about to be used
+        if not lock.acquire(blocking=False):
+            continue
+        try:
+            volume.remove(force=True)
+        except docker.errors.APIError:
+            # Volume is in use, try again next time
+            continue
+        finally:
+            lock.release()
+        manifest_path = os.path.join(manifest_folder, f"{volume.name}.json")
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(manifest_path)
+
+
+def sync_volume(client,
+                image_name,
+                src_folder,
+                manifest_folder=VOLUME_FOLDER,
+                keep=VOLUME_CACHE_SIZE):
+    """
+    Sync a folder into a named volume, only sending files whose contents
+    have changed since the last sync.
+    The env's own image is used to do the copy, so nothing is pulled.
+
+    :param client: The Docker client
+    :param image_name: The local image to use to write to the volume
+    :param src_folder: The folder to sync
+    :param manifest_folder: The folder the manifests are stored in
+    :param keep: How many cached volumes to keep
+    :returns: The name of the volume
+    """
+    src_folder = os.path.abspath(src_folder)
+    volume_name = get_volume_name(src_folder)
+    with get_volume_lock(volume_name):
+        _sync_volume(client, image_name, src_folder, volume_name,
+                     manifest_folder)
+    evict_volumes(client, keep, manifest_folder)
+    return volume_name
+
+
+def _sync_volume(client, image_name, src_folder, volume_name,
+                 manifest_folder):
+    """
+    Do the sync for 'sync_volume', while holding the volume's lock
+    """
+    manifest = load_manifest(volume_name, manifest_folder)
+    try:
+        client.volumes.get(volume_name)
+    except docker.errors.NotFound:
+        # Volume removed outside of dockenv, start again
+        manifest = None
+        client.volumes.create(
+            volume_name,
+            labels={
+                "dockenv.cache": "true",
+                "dockenv.source": src_folder
+            })
+    old_files = manifest["files"] if manifest else {}
+
+    new_files = scan_folder(src_folder, old_files)
+    changed, removed = diff_files(old_files, new_files)
+    if changed or removed:
+        container = client.containers.create(
+            image_name,
+            command=["rm", "-rf", "--"] + removed if removed else ["true"],
+            user="root",
+            working_dir=VOLUME_DEST,
+            network_disabled=True,
+            volumes={volume_name: {
+                "bind": VOLUME_DEST,
+                "mode": "rw"
+            }})
+        try:
+            if removed:
+                container.start()
+                container.wait()
+            if changed:
+                with make_sync_tar(src_folder, changed) as ftar:
+                    container.put_archive(VOLUME_DEST, ftar)
+        finally:
+            container.remove(force=True)
+
+    save_manifest(volume_name, {
+        "source": src_folder,
+        "last_used": time.time(),
+        "files": new_files
+    }, manifest_folder)
@@ -0,0 +1,139 @@
+"""
+Dockenv - Wait for files and folders to change, for 'dockenv watch'.
+
+On Linux, inotify is used, so a save is noticed straight away without
+polling. Everywhere else, or if inotify can't be used, the files are
+checked every 'interval' seconds instead.
+"""
+import ctypes
+import ctypes.util
+import os
+import select
+import sys
+import time
+
+# inotify event masks, from <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM
+              | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF
+              | IN_MOVE_SELF)
+# Editors often save with several writes, wait for them all
+SETTLE_TIME = 0.05
+
+
+def get_watch_folders(paths):
+    """
+    Get the folders to watch, to see changes to a list of files and folders.
+    Files are watched through their folder, as editors often save by
+    replacing the file, not writing to it
+
+    :param paths: list of files and folders
+    :returns: list of folders
+    """
+    folders = []
+    for path in paths:
+        if os.path.isdir(path):
+            folders += [root for root, _, _ in os.walk(path)]
+        else:
+            folders.append(os.path.dirname(path) or ".")
+    return sorted(set(folder for folder in folders if os.path.isdir(folder)))
+
+
+class Watcher():
+    """
+    Waits for a list of files and folders to change.
+    Use as a context manager, to close the inotify handle when done
+    """
+
+    def __init__(self, paths, interval=0.25):
+        """
+        :param paths: list of files and folders to watch
+        :param interval: How often, in seconds, to check for changes when
+                         inotify isn't available. Also the longest 'wait'
+                         blocks for, so callers can do other checks
+        """
+        self.paths = paths
+        self.interval = interval
+        self._libc = None
+        self._fd = None
+        if sys.platform.startswith("linux"):
+            try:
+                self._libc = ctypes.CDLL(
+                    ctypes.util.find_library("c"), use_errno=True)
+                self._fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+            except (OSError, AttributeError):
+                self._fd = None
+            if self._fd is not None and self._fd < 0:
+                self._fd = None
+        self._add_watches()
+
+    @property
+    def uses_inotify(self):
+        """
+        True if changes are seen with inotify, False if polling
+        """
+        return self._fd is not None
+
+    def _add_watches(self):
+        """
+        Watch every folder, including any made since the last call.
+        Watching a folder twice is harmless
+        """
+        if self._fd is None:
+            return
+        for folder in get_watch_folders(self.paths):
+            self._libc.inotify_add_watch(self._fd, os.fsencode(folder),
+                                         WATCH_MASK)
+
+    def _drain(self):
+        """
+        Throw away every queued event, we only need to know there were some
+        """
+        try:
+            while os.read(self._fd, 64 * 1024):
+                pass
+        except BlockingIOError:
+            pass
+
+    def wait(self):
+        """
+        Wait for something to change, or at most 'interval' seconds.
+        Without inotify this always waits 'interval' seconds, so callers
+        should check for themselves if anything actually changed
+
+        :returns: True if inotify saw a change
+        """
+        if self._fd is None:
+            time.sleep(self.interval)
+            return False
+        readable, _, _ = select.select([self._fd], [], [], self.interval)
+        if not readable:
+            return False
+        time.sleep(SETTLE_TIME)
+        self._drain()
+        self._add_watches()
+        return True
+
+    def close(self):
+        """
+        Close the inotify handle
+        """
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
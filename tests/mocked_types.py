@@ -9,6 +9,8 @@ class MockedImage():
     Mocked Class of docker.models.images.Image
     """
     tags = None
+    labels = None
 
-    def __init__(self, tags):
+    def __init__(self, tags, labels=None):
         self.tags = tags
+        self.labels = labels or {}
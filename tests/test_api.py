@@ -0,0 +1,303 @@
+"""
+Test dockenv python API
+"""
+import asyncio
+import json
+import os
+import threading
+from unittest.mock import MagicMock, patch
+import pytest
+from dockenv import api
+from .mocked_types import MockedImage
+
+
+def get_mocked_session(tags):
+    """
+    Get a Session whose client lists images with the given tags
+    """
+    client = MagicMock()
+    client.images.list.return_value = [MockedImage(tags)]
+    return api.Session(client)
+
+
+def test_result_ok():
+    """
+    Test Result reports success from the exit code, and only keeps known fields
+    """
+    result = api.Result("myenv", envs=["a"])
+    assert result.ok
+    assert result.to_dict() == {
+        "envname": "myenv",
+        "exit_code": 0,
+        "error": None,
+        "envs": ["a"]
+    }
+    assert not api.Result("myenv", exit_code=2).ok
+    assert api.Result("myenv").stdout is None
+    with pytest.raises(TypeError):
+        api.Result("myenv", not_a_field=1)
+
+
+def test_parse_freeze():
+    """
+    Test parse_freeze ignores blank lines
+    """
+    output = "requests==2.22.0\n\nurllib3==1.25.3\n"
+    assert api.parse_freeze(output) == ["requests==2.22.0", "urllib3==1.25.3"]
+
+
+def test_get_tmpfs_args():
+    """
+    Test get_tmpfs_args mounts /tmp, and the scratch folder, with a size
+    """
+    assert api.get_tmpfs_args() == []
+    assert api.get_tmpfs_args("1g") == [
+        "--tmpfs", f"/tmp:{api.TMPFS_OPTIONS},size=1g"
+    ]
+    assert api.get_tmpfs_args(scratch_dir="/scratch/") == [
+        "--tmpfs", f"/tmp:{api.TMPFS_OPTIONS},size={api.TMPFS_SIZE}",
+        "--tmpfs", f"/scratch:{api.TMPFS_OPTIONS},size={api.TMPFS_SIZE}"
+    ]
+    for tmpfs_size, scratch_dir in [("lots", None), ("0", None), ("0m", None),
+                                    ("64m", "scratch"), ("64m", "/")]:
+        with pytest.raises(api.DockenvError):
+            api.get_tmpfs_args(tmpfs_size, scratch_dir)
+
+
+def test_read_profile(tmp_path):
+    """
+    Test read_profile returns the summary and copies the full profile
+    """
+    profile_dir = tmp_path / "profile"
+    profile_dir.mkdir()
+    (profile_dir / "summary.txt").write_text("hotspot_function")
+    (profile_dir / "profile.prof").write_bytes(b"data")
+    output_dir = tmp_path / "output"
+    summary = api.read_profile(str(profile_dir), str(output_dir))
+    assert summary == "hotspot_function"
+    assert (output_dir / "profile.prof").read_bytes() == b"data"
+    assert not (output_dir / "profile.html").exists()
+
+
+@pytest.mark.skipif(os.name == "nt", reason="needs symlinks")
+def test_read_profile_links(tmp_path):
+    """
+    Test read_profile won't follow links the script swapped in
+    """
+    secret = tmp_path / "secret"
+    secret.write_text("host file")
+    profile_dir = tmp_path / "profile"
+    profile_dir.mkdir()
+    (profile_dir / "summary.txt").symlink_to(secret)
+    assert api.read_profile(str(profile_dir)) is None
+
+    (profile_dir / "summary.txt").unlink()
+    (profile_dir / "summary.txt").write_text("hotspot_function")
+    (profile_dir / "profile.prof").symlink_to(secret)
+    os.mkfifo(str(profile_dir / "profile.html"))
+    output_dir = tmp_path / "output"
+    assert api.read_profile(str(profile_dir), str(output_dir)) == \
+        "hotspot_function"
+    assert os.listdir(str(output_dir)) == []
+
+
+def test_read_profile_missing(tmp_path):
+    """
+    Test read_profile returns None if the profiler wrote nothing
+    """
+    assert api.read_profile(str(tmp_path)) is None
+
+
+def test_session_list():
+    """
+    Test Session.list only returns dockenv images
+    """
+    session = get_mocked_session(["python:3", "dockenv-aaa:latest"])
+    assert session.list().envs == ["aaa"]
+
+
+def test_session_client_reused():
+    """
+    Test Session only creates one client
+    """
+    session = get_mocked_session([])
+    session.list()
+    session.list()
+    assert session.client.images.list.call_count == 2
+
+
+def test_session_run_missing_env():
+    """
+    Test Session.run returns a failed Result if the env doesn't exist
+    """
+    session = get_mocked_session(["dockenv-aaa:latest"])
+    result = session.run("bbb", "script.py")
+    assert result.exit_code == 1
+    assert "'bbb' doesn't exist" in result.error
+
+
+def test_session_new_exists():
+    """
+    Test Session.new returns a failed Result if the env already exists
+    """
+    session = get_mocked_session(["dockenv-aaa:latest"])
+    result = session.new("aaa", package="requests")
+    assert not result.ok
+    session.client.images.build.assert_not_called()
+
+
+def test_session_matrix_envs():
+    """
+    Test Session.matrix_envs finds the envs of a matrix, oldest version first
+    """
+    session = get_mocked_session([
+        "dockenv-aaa-py3.10:latest", "dockenv-aaa-py3.8:latest",
+        "dockenv-aaa-pyx:latest", "dockenv-aaab-py3.9:latest"
+    ])
+    assert session.matrix_envs("aaa") == {
+        "3.8": "aaa-py3.8",
+        "3.10": "aaa-py3.10"
+    }
+    result = session.run_matrix("bbb", "script.py")
+    assert not result.ok
+    assert "'bbb' doesn't exist" in result.error
+
+
+def test_session_new_matrix_bad_version():
+    """
+    Test Session.new_matrix doesn't build anything if a version is bad
+    """
+    session = get_mocked_session([])
+    result = session.new_matrix("aaa", ["3.8", "latest"], package="requests")
+    assert not result.ok
+    session.client.images.build.assert_not_called()
+    session.client.containers.run.assert_not_called()
+
+
+def test_async_session_run_missing_env():
+    """
+    Test AsyncSession.run returns a failed Result if the env doesn't exist
+    """
+    session = api.AsyncSession(max_concurrency=2)
+    session.session = get_mocked_session(["dockenv-aaa:latest"])
+
+    async def run_all():
+        return await asyncio.gather(
+            *[session.run("bbb", "script.py") for _ in range(4)])
+
+    loop = asyncio.new_event_loop()
+    try:
+        results = loop.run_until_complete(run_all())
+    finally:
+        loop.close()
+    assert [result.exit_code for result in results] == [1, 1, 1, 1]
+
+
+def test_async_session_run_setup_off_loop():
+    """
+    Test AsyncSession.run lists images in the executor, not on the loop
+    """
+    session = api.AsyncSession()
+    session.session = get_mocked_session(["dockenv-aaa:latest"])
+    threads = []
+    list_images = session.session.client.images.list
+    session.session.client.images.list = MagicMock(
+        side_effect=lambda *args, **kwargs: threads.append(
+            threading.current_thread()) or list_images(*args, **kwargs))
+
+    loop = asyncio.new_event_loop()
+    try:
+        result = loop.run_until_complete(session.run("bbb", "script.py"))
+    finally:
+        loop.close()
+    assert not result.ok
+    assert threads and threading.main_thread() not in threads
+
+
+def test_async_session_run_cancelled_setup():
+    """
+    Test a run cancelled while being set up still cleans up after itself
+    """
+    session = api.AsyncSession()
+    session.session = get_mocked_session(["dockenv-aaa:latest"])
+    started = threading.Event()
+    release = threading.Event()
+    exited = threading.Event()
+    prepare = MagicMock()
+    prepare.__enter__.side_effect = lambda: (
+        started.set(), release.wait(5), (["true"], None))[-1]
+    prepare.__exit__.side_effect = lambda *args: exited.set()
+    session.session._prepare_run = MagicMock(  # pylint: disable=protected-access
+        return_value=prepare)
+
+    async def cancel_run():
+        task = asyncio.ensure_future(session.run("aaa", "script.py"))
+        while not started.is_set():
+            await asyncio.sleep(0.01)
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        release.set()
+        while not exited.is_set():
+            await asyncio.sleep(0.01)
+
+    loop = asyncio.new_event_loop()
+    try:
+        loop.run_until_complete(asyncio.wait_for(cancel_run(), 5))
+    finally:
+        loop.close()
+    prepare.__exit__.assert_called_once_with(None, None, None)
+
+
+def test_delete_only_matching_containers():
+    """
+    Test delete doesn't remove the containers of envs whose name starts
+    with the same name, e.g. a matrix's
+    """
+    session = get_mocked_session(["dockenv-aaa:latest", "dockenv-aaa:v1"])
+    container = MagicMock()
+    container.image = MockedImage(["dockenv-aaa:latest", "dockenv-aaa:v1"])
+    other = MagicMock()
+    other.image = MockedImage(["dockenv-aaa-py3.8:latest"])
+    session.client.containers.list.return_value = [container, other]
+    assert session.delete("aaa").ok
+    container.remove.assert_called_once_with(force=True)
+    other.remove.assert_not_called()
+
+
+def test_upgrade_import_profile_failed():
+    """
+    Test an upgrade whose import times can't be measured doesn't keep
+    the old env's import times
+    """
+    old_profile = {"modules": {"requests": {"ms": 10.0, "kb": 100}}}
+    session = get_mocked_session(["dockenv-aaa:latest"])
+    session.client.images.get.return_value.labels = {
+        "dockenv.imports": json.dumps(old_profile)
+    }
+    session.client.images.get.return_value.attrs = {"Size": 1}
+    with patch.object(api, "profile_imports", side_effect=ValueError("bad")), \
+            patch.object(api, "label_image") as mocked_label:
+        result = session.upgrade("aaa", package="requests")
+    assert result.ok
+    assert result.imports == {"error": "bad", "modules": {}}
+    assert not result.import_regressions
+    mocked_label.assert_called_once_with(
+        session.client, "dockenv-aaa", result.imports)
+
+
+def test_export_saves_latest_tag(tmp_path):
+    """
+    Test export saves the env's ':latest' tag, not one of its versions
+    """
+    session = get_mocked_session(["dockenv-aaa:latest", "dockenv-aaa:v2"])
+    image = session.client.images.get.return_value
+    image.save.return_value = [b"data"]
+    filename = str(tmp_path / "aaa.tar")
+    result = session.export("aaa", filename)
+    assert result.ok
+    assert result.size == 4
+    image.save.assert_called_once_with(chunk_size=209715,
+                                       named="dockenv-aaa:latest")
@@ -0,0 +1,88 @@
+"""
+Test dockenv Dockerfile helpers
+"""
+from unittest.mock import MagicMock
+import pytest
+from dockenv import build
+
+
+def test_get_pip_script():
+    """
+    Test get_pip_script only installs binary packages by default
+    """
+    assert build.get_pip_script(False) == ""
+    pip_script = build.get_pip_script(True)
+    assert "-r requirements.txt" in pip_script
+    assert "--only-binary=:all:" in pip_script
+    pip_script = build.get_pip_script(True, allow_nonbinary=True,
+                                      extra_pip_arguments=["--pre"])
+    assert "--only-binary=:all:" not in pip_script
+    assert pip_script.endswith(" --pre")
+
+
+def test_get_dockerfile_slim():
+    """
+    Test a slim Dockerfile installs in a builder, and copies into a slim image
+    """
+    pip_script = build.get_pip_script(True)
+    dockerfile = build.get_dockerfile(
+        "dockenv-myenv", slim=True, has_requirements=True, pip_script=pip_script)
+    builder, runtime = dockerfile.split(f"FROM {build.SLIM_IMAGE}\n")
+    assert f"FROM {build.BASE_IMAGE} AS builder" in builder
+    assert pip_script in builder
+    assert pip_script not in runtime
+    assert "COPY --from=builder" in runtime
+    assert build.USER_SCRIPT in runtime
+    assert "USER dockenv" in runtime
+
+
+def test_get_dockerfile_upgrade_ignores_slim():
+    """
+    Test an upgrade always builds off the env's own image
+    """
+    dockerfile = build.get_dockerfile("dockenv-myenv", upgrade=True, slim=True)
+    assert "FROM dockenv-myenv" in dockerfile
+    assert "builder" not in dockerfile
+
+
+def test_get_dockerfile_wheels():
+    """
+    Test shared wheels are only copied into the builder stage
+    """
+    pip_script = build.get_pip_script(True, wheels=True)
+    assert f"--find-links {build.WHEELS_DEST}" in pip_script
+    dockerfile = build.get_dockerfile(
+        "dockenv-myenv-py3.8", has_requirements=True, pip_script=pip_script,
+        python_version="3.8", wheels=True)
+    builder, runtime = dockerfile.split("FROM python:3.8\n")
+    assert "FROM python:3.8 AS builder" in builder
+    assert f"COPY wheels {build.WHEELS_DEST}" in builder
+    assert "wheels" not in runtime
+
+
+def test_get_base_images():
+    """
+    Test get_base_images only allows version numbers
+    """
+    assert build.get_base_images() == (build.BASE_IMAGE, build.SLIM_IMAGE)
+    assert build.get_base_images("3.10") == ("python:3.10", "python:3.10-slim")
+    with pytest.raises(ValueError):
+        build.get_base_images("3.10; rm -rf /")
+
+
+def test_download_wheels(tmp_path):
+    """
+    Test wheels are downloaded with each version's own Python
+    """
+    client = MagicMock()
+    client.containers.run.side_effect = [
+        b"Saved /wheels/six-1.16.0-py2.py3-none-any.whl\n",
+        b"File was already downloaded /wheels/six-1.16.0-py2.py3-none-any.whl\n"
+        b"Saved /wheels/tomli-2.0.1-py3-none-any.whl\n",
+    ]
+    wheels = build.download_wheels(client, b"six\ntomli; python_version < '3.11'",
+                                   ["3.12", "3.8"], str(tmp_path))
+    images = [call.args[0] for call in client.containers.run.call_args_list]
+    assert images == ["python:3.12", "python:3.8"]
+    assert wheels["3.12"] == [str(tmp_path / "six-1.16.0-py2.py3-none-any.whl")]
+    assert len(wheels["3.8"]) == 2
@@ -0,0 +1,65 @@
+"""
+Test dockenv build context helpers
+"""
+import os
+from dockenv import context
+
+
+def test_link_or_copy_links(tmp_path):
+    """
+    Test link_or_copy hardlinks when allowed
+    """
+    src = tmp_path / "script.py"
+    src.write_text("print('hi')")
+    dest = tmp_path / "dest.py"
+    context.link_or_copy(str(src), str(dest))
+    assert os.path.samefile(str(src), str(dest))
+
+
+def test_link_or_copy_no_link(tmp_path):
+    """
+    Test link_or_copy makes a separate copy when links aren't allowed
+    """
+    src = tmp_path / "script.py"
+    src.write_text("print('hi')")
+    dest = tmp_path / "dest.py"
+    context.link_or_copy(str(src), str(dest), allow_link=False)
+    assert not os.path.samefile(str(src), str(dest))
+    assert dest.read_text() == "print('hi')"
+
+
+def test_context_digest_matches_path_and_bytes(tmp_path):
+    """
+    Test context_digest is the same whether content is in memory or on disk
+    """
+    requirements = tmp_path / "requirements.txt"
+    requirements.write_bytes(b"requests")
+    from_path = context.context_digest({"requirements.txt": str(requirements)})
+    from_bytes = context.context_digest({"requirements.txt": b"requests"})
+    assert from_path == from_bytes
+    assert from_bytes != context.context_digest({"requirements.txt": b"lxml"})
+
+
+def test_get_context_tar_cached(tmp_path):
+    """
+    Test get_context_tar reuses a tarball for the same context
+    """
+    files = {"Dockerfile": b"FROM python:3", "requirements.txt": b"requests"}
+    first = context.get_context_tar(files, cache_folder=str(tmp_path))
+    mtime = os.path.getmtime(first)
+    os.utime(first, (mtime - 100, mtime - 100))
+    second = context.get_context_tar(files, cache_folder=str(tmp_path))
+    assert first == second
+    assert os.path.getmtime(second) > mtime - 100
+
+
+def test_prune_context_cache(tmp_path):
+    """
+    Test prune_context_cache keeps only the most recently used tarballs
+    """
+    for i in range(5):
+        tarball = tmp_path / f"{i}.tar"
+        tarball.write_bytes(b"")
+        os.utime(str(tarball), (i, i))
+    context.prune_context_cache(str(tmp_path), keep=2)
+    assert sorted(os.listdir(str(tmp_path))) == ["3.tar", "4.tar"]
@@ -1,8 +1,10 @@
 """
 Test dockenv
 """
+import argparse
 from unittest.mock import patch
-from dockenv import dockenv
+from dockenv import api, dockenv
+from dockenv.api import Result
 from .mocked_types import MockedImage
 
 
@@ -12,7 +14,7 @@ def test_get_venv_name_nolatest():
     """
     expected = "myenv"
     input_param = f"dockenv-{expected}"
-    output = dockenv.get_venv_name(input_param)
+    output = api.get_venv_name(input_param)
     assert expected == output
 
 
@@ -22,7 +24,7 @@ def test_get_venv_name_latest():
     """
     expected = "myenv"
     test_input = f"dockenv-{expected}:latest"
-    result = dockenv.get_venv_name(test_input)
+    result = api.get_venv_name(test_input)
     assert expected == result
 
 
@@ -133,3 +135,36 @@ def test_get_local_container_found(mocked_containerget, mocked_imagelist):
 
     assert dockenv.get_local_container(test_input) is expected_result
     mocked_containerget.assert_called_once_with(test_input)
+
+
+def test_func_run_freeze_failed(caplog):
+    """
+    Test a failed 'pip freeze' prints pip's error
+    """
+    result = Result(
+        "aaa", exit_code=1, stdout="", stderr="pip broke", packages=[],
+        imports=None)
+    with patch.object(dockenv.SESSION, "freeze", return_value=result):
+        args = argparse.Namespace(envname="aaa", tmpfs_size="64m")
+        assert dockenv.func_run_freeze(args) == 1
+    assert any(record.levelname == "ERROR" and record.message == "pip broke"
+               for record in caplog.records)
+
+
+def test_func_run_script_terminal():
+    """
+    Test a run from a terminal doesn't go through the service
+    """
+    args = argparse.Namespace(
+        envname="aaa", script="script.py", as_module=False, port=None,
+        mount=None, write_mount=False, write_filesystem=False,
+        cache_mount=None, tmpfs_size="64m", scratch_dir=None, profile=False,
+        profiler=None, profile_top=None, profile_output=None, arguments=[],
+        matrix=False)
+    with patch.object(dockenv.SESSION, "run",
+                      return_value=Result("aaa")) as mocked_run, \
+            patch.object(dockenv, "get_session") as mocked_get_session, \
+            patch.object(dockenv.sys.stdin, "isatty", return_value=True):
+        assert dockenv.func_run_script(args) == 0
+    mocked_run.assert_called_once()
+    mocked_get_session.assert_not_called()
@@ -0,0 +1,65 @@
+"""
+Test dockenv import time profiling helpers
+"""
+import json
+from dockenv import imports
+
+
+def get_profile(modules):
+    """
+    Get an import profile with the given module stats
+    """
+    return {"python": "3.12.0", "modules": modules}
+
+
+def test_get_image_imports():
+    """
+    Test get_image_imports reads the label, and ignores bad labels
+    """
+    profile = get_profile({"requests": {"ms": 50.0, "kb": 2048}})
+    labels = {imports.IMPORTS_LABEL: json.dumps(profile)}
+    assert imports.get_image_imports(labels) == profile
+    assert imports.get_image_imports({}) is None
+    assert imports.get_image_imports(None) is None
+    assert imports.get_image_imports({imports.IMPORTS_LABEL: "{bad"}) is None
+
+
+def test_find_regressions():
+    """
+    Test only imports that got noticeably slower or bigger are flagged
+    """
+    old = get_profile({
+        "slower": {"ms": 10.0, "kb": 100},
+        "noise": {"ms": 1.0, "kb": 100},
+        "bigger": {"ms": 10.0, "kb": 2048},
+        "broken": {"error": "ImportError"},
+    })
+    new = get_profile({
+        "slower": {"ms": 30.0, "kb": 100},
+        "noise": {"ms": 3.0, "kb": 100},
+        "bigger": {"ms": 10.0, "kb": 8192},
+        "broken": {"ms": 100.0, "kb": 100},
+        "added": {"ms": 100.0, "kb": 100},
+    })
+    regressions = imports.find_regressions(old, new)
+    assert [regression["module"] for regression in regressions] == [
+        "bigger", "slower"
+    ]
+    assert regressions[1]["ms"] == [10.0, 30.0]
+    assert imports.find_regressions(None, new) == []
+
+
+def test_get_slowest():
+    """
+    Test get_slowest sorts slowest first, with failed imports last
+    """
+    profile = get_profile({
+        "fast": {"ms": 1.0, "kb": 0},
+        "broken": {"error": "ImportError"},
+        "slow": {"ms": 100.0, "kb": 0},
+    })
+    assert [module for module, _ in imports.get_slowest(profile)] == [
+        "slow", "fast", "broken"
+    ]
+    assert [module for module, _ in imports.get_slowest(profile, 1)] == ["slow"]
+    assert imports.get_slowest(None) == []
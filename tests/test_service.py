@@ -0,0 +1,185 @@
+"""
+Test dockenv service
+"""
+import asyncio
+import json
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+from unittest.mock import MagicMock, patch
+import pytest
+from dockenv import service
+from .mocked_types import MockedImage
+
+pytestmark = pytest.mark.skipif(
+    not service.service_supported(), reason="needs Unix sockets")
+
+
+@pytest.fixture(name="running_service")
+def fixture_running_service():
+    """
+    Run a service, with a mocked Docker client, in a background thread
+    """
+    client = MagicMock()
+    client.images.list.return_value = [
+        MockedImage(["python:3", "dockenv-aaa:latest"])
+    ]
+    test_service = service.Service(client=client)
+    # Keep the path short, Unix socket paths have a length limit
+    socket_dir = tempfile.mkdtemp()
+    socket_path = os.path.join(socket_dir, "dockenv.sock")
+
+    loop = asyncio.new_event_loop()
+    server = loop.run_until_complete(
+        asyncio.start_unix_server(
+            test_service.handle_client, path=socket_path))
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    yield client, socket_path
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join()
+    server.close()
+    loop.close()
+    shutil.rmtree(socket_dir)
+
+
+def test_ping(running_service):
+    """
+    Test ping finds a running service, and not a missing one
+    """
+    _, socket_path = running_service
+    assert service.ping(socket_path)
+    assert not service.ping(socket_path + ".missing")
+
+
+def test_list_cached(running_service):
+    """
+    Test the service only lists images once, until they change
+    """
+    client, socket_path = running_service
+    service_client = service.ServiceClient(socket_path)
+    assert service_client.list().envs == ["aaa"]
+    assert service_client.list().envs == ["aaa"]
+    assert client.images.list.call_count == 1
+
+
+def test_run_missing_env(running_service):
+    """
+    Test a run of a missing env returns the error from the service
+    """
+    _, socket_path = running_service
+    result = service.ServiceClient(socket_path).run("bbb", "script.py")
+    assert result.exit_code == 1
+    assert "'bbb' doesn't exist" in result.error
+
+
+def test_bad_command(running_service):
+    """
+    Test the service refuses unknown commands
+    """
+    _, socket_path = running_service
+    result = service.request("delete", {"envname": "aaa"}, socket_path)
+    assert not result.ok
+    assert "Bad command" in result.error
+
+
+def test_get_peer_uid():
+    """
+    Test get_peer_uid finds our own user at the other end of a socket
+    """
+    left, right = socket.socketpair(socket.AF_UNIX)
+    with left, right:
+        assert service.get_peer_uid(left) in [os.getuid(), None]
+
+
+def test_refuse_other_users_socket(running_service):
+    """
+    Test requests aren't sent to a socket owned by another user
+    """
+    _, socket_path = running_service
+    with patch("dockenv.service.os.getuid", return_value=os.getuid() + 1):
+        with pytest.raises(PermissionError):
+            service.request("ping", socket_path=socket_path)
+        assert not service.ping(socket_path)
+
+
+def test_refuse_other_users_request():
+    """
+    Test the service refuses requests from another user
+    """
+    test_service = service.Service(client=MagicMock())
+    reader = MagicMock()
+    writer = MagicMock()
+    writer.drain = MagicMock(return_value=asyncio.sleep(0))
+    loop = asyncio.new_event_loop()
+    try:
+        with patch("dockenv.service.get_peer_uid",
+                   return_value=os.getuid() + 1):
+            loop.run_until_complete(test_service.handle_client(reader, writer))
+    finally:
+        loop.close()
+    reader.readline.assert_not_called()
+    reply = json.loads(writer.write.call_args[0][0])
+    assert reply["result"]["error"] == "Permission denied"
+
+
+def test_make_socket_folder(tmp_path):
+    """
+    Test the socket folder is made private, and a shared one is refused
+    """
+    socket_path = tmp_path / "private" / "dockenv.sock"
+    service.make_socket_folder(str(socket_path))
+    assert os.stat(str(socket_path.parent)).st_mode & 0o777 == 0o700
+    os.chmod(str(socket_path.parent), 0o755)
+    with pytest.raises(PermissionError):
+        service.make_socket_folder(str(socket_path))
+
+
+@pytest.mark.skipif(os.name == "nt", reason="needs a shell script")
+def test_run_stopped_when_client_goes_away(running_service, tmp_path,
+                                           monkeypatch):
+    """
+    Test a run is killed, and its container removed, if the client
+    disconnects while the script is running
+    """
+    _, socket_path = running_service
+    fake_docker = tmp_path / "docker"
+    fake_docker.write_text(
+        "#!/bin/sh\n"
+        f"echo \"$@\" >> {tmp_path / 'calls'}\n"
+        "if [ \"$1\" = run ]; then\n"
+        f"  echo $$ > {tmp_path / 'pid'}\n"
+        "  echo started\n"
+        "  exec sleep 30\n"
+        "fi\n")
+    fake_docker.chmod(0o755)
+    monkeypatch.setenv("PATH", f"{tmp_path}{os.pathsep}{os.environ['PATH']}")
+    script = tmp_path / "script.py"
+    script.write_text("print(1)")
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(socket_path)
+        message = {
+            "command": "run",
+            "args": {
+                "envname": "aaa",
+                "script": str(script)
+            }
+        }
+        sock.sendall(json.dumps(message).encode() + b"\n")
+        with sock.makefile("r") as freplies:
+            assert json.loads(freplies.readline()) == {"stdout": "started\n"}
+
+    pid = int((tmp_path / "pid").read_text())
+    for _ in range(50):
+        calls = (tmp_path / "calls").read_text().splitlines()
+        if calls[-1].startswith("rm "):
+            break
+        time.sleep(0.1)
+    name = calls[0].split("--name ")[1].split()[0]
+    assert calls[-1] == f"rm --force {name}"
+    with pytest.raises(ProcessLookupError):
+        os.kill(pid, 0)
@@ -0,0 +1,162 @@
+"""
+Test dockenv deduplicating export store
+"""
+import gzip
+import hashlib
+import io
+import json
+import tarfile
+from unittest.mock import MagicMock
+from dockenv import store
+
+
+def get_digest(data):
+    """
+    Get the sha256 digest of some bytes
+    """
+    return "sha256:" + hashlib.sha256(data).hexdigest()
+
+
+def get_config(layers, name="a"):
+    """
+    Get an image config for some layers
+    """
+    return json.dumps({
+        "name": name,
+        "rootfs": {
+            "type": "layers",
+            "diff_ids": [get_digest(layer) for layer in layers]
+        }
+    }).encode()
+
+
+def get_mocked_image(layers, config=None, containerd=False):
+    """
+    Get an image whose 'save' returns a 'docker save' archive.
+    By default in the older Docker format, with layers named by a random ID.
+    With 'containerd', in the containerd image store's format, with gzipped
+    layers named by their digest, and an image ID that isn't the config's
+    """
+    config = config or get_config(layers)
+    members = []
+    for i, layer in enumerate(layers):
+        if containerd:
+            layer = gzip.compress(layer)
+            members.append((f"blobs/sha256/{get_digest(layer)[7:]}", layer))
+        else:
+            members.append((f"layerid{i}/layer.tar", layer))
+    if containerd:
+        config_name = f"blobs/sha256/{get_digest(config)[7:]}"
+    else:
+        config_name = f"{get_digest(config)[7:]}.json"
+    members.append((config_name, config))
+    members.append(("manifest.json", json.dumps([{
+        "Config": config_name,
+        "Layers": [name for name, _ in members[:-1]]
+    }]).encode()))
+
+    archive = io.BytesIO()
+    with tarfile.open(fileobj=archive, mode="w") as tar:
+        for name, data in members:
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+    data = archive.getvalue()
+
+    image = MagicMock()
+    image.id = get_digest(b"index" + config) if containerd else get_digest(config)
+    image.attrs = {"RootFS": {"Layers": [get_digest(layer) for layer in layers]}}
+    # Small chunks, so tar members span chunks
+    image.save.side_effect = lambda **_: (
+        data[i:i + 1000] for i in range(0, len(data), 1000))
+    return image
+
+
+def test_export_deduplicates(tmp_path):
+    """
+    Test layers shared between images are only stored once
+    """
+    base = b"base" * 1000
+    config_a = get_config([base, b"a" * 100], "a")
+    config_b = get_config([base, b"b" * 100], "b")
+    image_a = get_mocked_image([base, b"a" * 100], config=config_a)
+    image_b = get_mocked_image([base, b"b" * 100], config=config_b)
+
+    written, deduplicated = store.export_image(str(tmp_path), image_a, "dockenv-a:latest")
+    assert written == len(base) + 100 + len(config_a)
+    assert deduplicated == 0
+    written, deduplicated = store.export_image(str(tmp_path), image_b, "dockenv-b:latest")
+    assert written == 100 + len(config_b)
+    assert deduplicated == len(base)
+
+    images = store.list_images(str(tmp_path))
+    assert sorted(images) == ["dockenv-a:latest", "dockenv-b:latest"]
+    for digest in image_b.attrs["RootFS"]["Layers"]:
+        assert (tmp_path / "blobs" / "sha256" / digest[7:]).is_file()
+
+    # Nothing new to store, so the image isn't saved again
+    image_a.save.reset_mock()
+    written, _ = store.export_image(str(tmp_path), image_a, "dockenv-a:latest")
+    assert written == 0
+    image_a.save.assert_not_called()
+    assert len(store.load_index(str(tmp_path))["manifests"]) == 2
+
+
+def test_import_skips_daemon_layers(tmp_path):
+    """
+    Test import leaves out the layers Docker already has
+    """
+    base = b"base" * 1000
+    image = get_mocked_image([base, b"a" * 100])
+    store.export_image(str(tmp_path), image, "dockenv-a:latest")
+    manifest = store.list_images(str(tmp_path))["dockenv-a:latest"]
+
+    loaded = []
+    client = MagicMock()
+    client.images.load.side_effect = lambda chunks: loaded.append(b"".join(chunks))
+    daemon_chain_ids = set(store.get_chain_ids([get_digest(base)]))
+    sent, skipped = store.import_image(
+        client, str(tmp_path), "dockenv-a:latest", manifest, daemon_chain_ids)
+    assert skipped == len(base)
+    assert sent == 100 + len(get_config([base, b"a" * 100]))
+
+    with tarfile.open(fileobj=io.BytesIO(loaded[0])) as tar:
+        names = tar.getnames()
+        load_manifest = json.load(tar.extractfile("manifest.json"))
+    assert load_manifest[0]["RepoTags"] == ["dockenv-a:latest"]
+    assert len(load_manifest[0]["Layers"]) == 2
+    assert f"{get_digest(base)[7:]}/layer.tar" not in names
+    assert f"{get_digest(b'a' * 100)[7:]}/layer.tar" in names
+
+
+def test_export_containerd(tmp_path):
+    """
+    Test images saved by the containerd image store, with gzipped layers
+    and an ID that isn't the config digest, are stored uncompressed
+    """
+    base = b"base" * 1000
+    image = get_mocked_image([base, b"a" * 100], containerd=True)
+    written, _ = store.export_image(str(tmp_path), image, "dockenv-a:latest")
+    config = get_config([base, b"a" * 100])
+    assert written == len(base) + 100 + len(config)
+
+    manifest = store.list_images(str(tmp_path))["dockenv-a:latest"]
+    assert manifest["config"]["digest"] == get_digest(config)
+    assert [layer["digest"] for layer in manifest["layers"]] == \
+        image.attrs["RootFS"]["Layers"]
+    assert (tmp_path / "blobs" / "sha256" / get_digest(base)[7:]).read_bytes() == base
+
+    # Found by its image ID, so the image isn't saved again
+    image.save.reset_mock()
+    assert store.export_image(str(tmp_path), image, "dockenv-a:latest")[0] == 0
+    image.save.assert_not_called()
+
+
+def test_get_chain_ids():
+    """
+    Test a layer's chain ID depends on the layers under it
+    """
+    chain_a = store.get_chain_ids(["sha256:1", "sha256:2"])
+    chain_b = store.get_chain_ids(["sha256:3", "sha256:2"])
+    assert chain_a[0] == "sha256:1"
+    assert chain_a[1] != chain_b[1]
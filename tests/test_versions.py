@@ -0,0 +1,108 @@
+"""
+Test dockenv env versions
+"""
+from unittest.mock import MagicMock
+import pytest
+from dockenv import api, versions
+
+
+def get_mocked_image(image_id, tags):
+    """
+    Get an image with an ID and tags
+    """
+    image = MagicMock()
+    image.id = image_id
+    image.short_id = image_id[:17]
+    image.tags = tags
+    image.attrs = {"Created": "2026-01-01T00:00:00Z", "Size": 1024}
+    image.tag.side_effect = lambda repository, tag: image.tags.append(
+        f"{repository}:{tag}")
+    return image
+
+
+def get_mocked_session(images, latest):
+    """
+    Get a Session whose client has the given images, and 'latest' image
+    """
+    client = MagicMock()
+    client.images.list.return_value = images
+    client.images.get.return_value = latest
+    return api.Session(client, keep_versions=2)
+
+
+def test_parse_version():
+    """
+    Test parse_version takes numbers, with or without a 'v'
+    """
+    assert versions.parse_version("3") == 3
+    assert versions.parse_version("v12") == 12
+    with pytest.raises(ValueError):
+        versions.parse_version("latest")
+
+
+def test_get_keep_versions(monkeypatch, caplog):
+    """
+    Test DOCKENV_KEEP_VERSIONS is read when needed, and a bad value
+    falls back to the default with a warning
+    """
+    monkeypatch.delenv("DOCKENV_KEEP_VERSIONS", raising=False)
+    assert versions.get_keep_versions() == versions.KEEP_VERSIONS
+    monkeypatch.setenv("DOCKENV_KEEP_VERSIONS", "0")
+    assert api.Session(MagicMock()).keep_versions == 0
+    for value in ["lots", "-1"]:
+        monkeypatch.setenv("DOCKENV_KEEP_VERSIONS", value)
+        assert versions.get_keep_versions() == versions.KEEP_VERSIONS
+        assert value in caplog.text
+
+
+def test_get_image_versions():
+    """
+    Test get_image_versions only finds version tags of the env
+    """
+    image_1 = get_mocked_image("sha256:1", ["dockenv-aaa:v1", "dockenv-aaa:latest"])
+    image_2 = get_mocked_image("sha256:2", ["dockenv-aaa:v10", "dockenv-aaab:v3"])
+    image_versions = versions.get_image_versions([image_2, image_1], "dockenv-aaa")
+    assert image_versions == {1: image_1, 10: image_2}
+    assert versions.get_current_version(image_versions, "sha256:2") == 10
+    assert versions.get_current_version(image_versions, "sha256:3") is None
+
+
+def test_get_prune_versions():
+    """
+    Test get_prune_versions keeps the newest, and the current version
+    """
+    assert versions.get_prune_versions([1, 2, 3, 4], 2) == [1, 2]
+    assert versions.get_prune_versions([1, 2, 3, 4], 2, current=1) == [2]
+    assert versions.get_prune_versions([1, 2, 3, 4], 0) == []
+
+
+def test_rollback():
+    """
+    Test rollback only moves the 'latest' tag to the previous version
+    """
+    image_1 = get_mocked_image("sha256:1", ["dockenv-aaa:v1"])
+    image_2 = get_mocked_image("sha256:2", ["dockenv-aaa:v2", "dockenv-aaa:latest"])
+    session = get_mocked_session([image_1, image_2], image_2)
+    result = session.rollback("aaa")
+    assert result.ok
+    assert result.version == 1
+    image_1.tag.assert_called_once_with("dockenv-aaa", "latest")
+    session.client.images.build.assert_not_called()
+
+    result = session.rollback("aaa", 5)
+    assert not result.ok
+    assert "no version 5" in result.error
+
+
+def test_tag_version_prunes():
+    """
+    Test a new build is tagged as the next version, and old ones removed
+    """
+    image_1 = get_mocked_image("sha256:1", ["dockenv-aaa:v1"])
+    image_2 = get_mocked_image("sha256:2", ["dockenv-aaa:v2"])
+    image_3 = get_mocked_image("sha256:3", ["dockenv-aaa:latest"])
+    session = get_mocked_session([image_1, image_2, image_3], image_3)
+    # pylint: disable=protected-access
+    assert session._tag_version("dockenv-aaa", old_image=image_2) == 3
+    image_3.tag.assert_called_once_with("dockenv-aaa", "v3")
+    session.client.images.remove.assert_called_once_with("dockenv-aaa:v1")
@@ -0,0 +1,79 @@
+"""
+Test dockenv mount cache volumes
+"""
+import os
+import tarfile
+import threading
+from unittest.mock import patch
+from dockenv import volumes
+
+
+def test_get_volume_name_stable():
+    """
+    Test get_volume_name gives the same name for the same folder only
+    """
+    name = volumes.get_volume_name("/data/a")
+    assert name.startswith(volumes.VOLUME_PREFIX)
+    assert name == volumes.get_volume_name("/data/a")
+    assert name != volumes.get_volume_name("/data/b")
+
+
+def test_scan_folder_reuses_digest(tmp_path):
+    """
+    Test scan_folder doesn't re-hash files that haven't changed
+    """
+    (tmp_path / "sub").mkdir()
+    (tmp_path / "sub" / "a.csv").write_text("1,2,3")
+    files = volumes.scan_folder(str(tmp_path))
+    assert list(files) == ["sub/a.csv"]
+    with patch("dockenv.volumes.file_digest") as mocked_digest:
+        assert volumes.scan_folder(str(tmp_path), files) == files
+        mocked_digest.assert_not_called()
+
+
+def test_diff_files():
+    """
+    Test diff_files finds added, changed and removed files
+    """
+    old_files = {"same": [1, 1, "a"], "changed": [1, 1, "b"], "gone": [1, 1, "c"]}
+    new_files = {"same": [1, 2, "a"], "changed": [1, 2, "x"], "added": [1, 1, "d"]}
+    changed, removed = volumes.diff_files(old_files, new_files)
+    assert changed == ["added", "changed"]
+    assert removed == ["gone"]
+
+
+def test_make_sync_tar(tmp_path):
+    """
+    Test make_sync_tar only includes the changed files and their folders
+    """
+    (tmp_path / "sub").mkdir()
+    (tmp_path / "sub" / "a.csv").write_text("1,2,3")
+    (tmp_path / "b.csv").write_text("4,5,6")
+    with volumes.make_sync_tar(str(tmp_path), ["sub/a.csv"]) as ftar, \
+            tarfile.open(fileobj=ftar) as tar:
+        assert tar.getnames() == ["sub", "sub/a.csv"]
+        assert tar.extractfile("sub/a.csv").read() == b"1,2,3"
+        assert tar.getmember("sub/a.csv").mode & 0o444 == 0o444
+    assert os.path.exists(str(tmp_path / "b.csv"))
+
+
+def test_save_manifest_concurrent(tmp_path):
+    """
+    Test saving the same manifest from many threads at once doesn't fail
+    """
+    errors = []
+
+    def save(i):
+        try:
+            volumes.save_manifest("vol", {"files": {}, "i": i}, str(tmp_path))
+        except OSError as exc:
+            errors.append(exc)
+
+    threads = [threading.Thread(target=save, args=(i, )) for i in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not errors
+    assert volumes.load_manifest("vol", str(tmp_path))["files"] == {}
+    assert os.listdir(str(tmp_path)) == ["vol.json"]
@@ -0,0 +1,61 @@
+"""
+Test dockenv watch change detection
+"""
+import threading
+from dockenv import api, watcher
+
+
+def test_get_watch_folders(tmp_path):
+    """
+    Test files are watched through their folder, and folders recursively
+    """
+    (tmp_path / "data" / "sub").mkdir(parents=True)
+    script = tmp_path / "script.py"
+    script.write_text("print(1)")
+    folders = watcher.get_watch_folders(
+        [str(script), str(tmp_path / "data"), str(tmp_path / "missing")])
+    assert folders == sorted([
+        str(tmp_path),
+        str(tmp_path / "data"),
+        str(tmp_path / "data" / "sub")
+    ])
+
+
+def test_watcher_wait(tmp_path):
+    """
+    Test wait returns after 'interval' with no changes, and sees a change
+    """
+    script = tmp_path / "script.py"
+    script.write_text("print(1)")
+    with watcher.Watcher([str(script)], interval=0.1) as watch:
+        assert not watch.wait()
+        timer = threading.Timer(0.02, script.write_text, args=("print(2)", ))
+        timer.start()
+        changed = watch.wait()
+        timer.join()
+        assert changed == watch.uses_inotify
+
+
+def test_get_watch_snapshot_changes(tmp_path):
+    """
+    Test get_watch_snapshot notices changed and added files
+    """
+    script = tmp_path / "script.py"
+    script.write_text("print(1)")
+    mount = tmp_path / "data"
+    mount.mkdir()
+    (mount / "a.txt").write_text("a")
+    paths = [str(script), str(mount)]
+    before = api.get_watch_snapshot(paths)
+    assert sorted(before) == [str(mount / "a.txt"), str(script)]
+    assert before == api.get_watch_snapshot(paths)
+
+    (mount / "b.txt").write_text("b")
+    assert before != api.get_watch_snapshot(paths)
+
+
+def test_get_watch_snapshot_missing(tmp_path):
+    """
+    Test get_watch_snapshot ignores paths that don't exist
+    """
+    assert api.get_watch_snapshot([str(tmp_path / "missing.py")]) == {}